@@ -8,10 +8,43 @@ from geopy.distance import geodesic
 import base64
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
 from datetime import datetime, timedelta
 import hashlib
 import json
 import os
+import math
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from crime_data import load_crime_store, heatmap_points, CRIME_TYPES
+from crime_cube import load_cube, slice_cube, cube_heatmap_points, hours_in_window, TIME_WINDOWS, WEEKDAYS
+from safety import compute_safety_scores, SAFETY_RADII_KM
+from routing import get_graph, get_safety_weights, find_route, route_exposure
+from geofence import high_risk_zones, classify_points
+from hotspots import ensure_hotspots, hotspots_error
+from risk_model import ensure_risk_grid, risk_heatmap_points, load_latest_snapshot, train_async, training_error, training_in_progress
+from clustering import get_cluster_index, get_clusters, CLUSTER_MIN_POINTS
+from map_layers import point_layer, heatmap_layer, polygon_layer, line_layer, add_to_folium, choose_renderer, to_deck, IconRegistry, PopupTable, VectorTileLayer
+from tile_cache import start_tile_server, seed_tiles_async, cached_tile_count, TILE_ATTRIBUTION
+from vector_tiles import ensure_vector_tiles, vector_tiles_error
+from poi_data import load_poi_store, nearby_places, POI_CATEGORIES
+from shared_cache import cached, cache_key, cache_stats, invalidate
+from warmup import warmup_status
+from scheduler import add_job, start_scheduler, run_job_now, job_status
+from visits import add_visit, pending_visits, take_visits, restore_visits, apply_visits, store_lock, MAX_VISITS, VISIT_FLUSH_SECONDS
+from tracing import span, traced, start_trace, finish_trace, summaries, recent_traces, set_trace_file, trace_file
+from metrics import start_metrics_server, session_seen, inc
+from memory import account_session, session_sizes, rss_history, rss_bytes, start_tracemalloc, stop_tracemalloc, top_allocators, traced_memory, ACCOUNT_SECONDS
+
+# Set by warmup.py, which drives this script headlessly in its own process: that process must not
+# take the server's metrics port or run the background jobs
+HEADLESS = os.environ.get("SAFEMAP_HEADLESS", "") == "1"
+
+# Every rerun is traced from here to the end of the script; its spans also feed /metrics
+start_trace()
+if not HEADLESS:
+    start_metrics_server()
 
 # Set page configuration
 st.set_page_config(
@@ -25,6 +58,7 @@ st.set_page_config(
 
 USER_DATA_FILE = "user_data.json"
 
+@traced("user_store.load")
 def load_user_data():
     """Load user data from JSON file"""
     if os.path.exists(USER_DATA_FILE):
@@ -35,11 +69,15 @@ def load_user_data():
             return {}
     return {}
 
+@traced("user_store.save")
 def save_user_data(user_data):
     """Save user data to JSON file"""
     try:
-        with open(USER_DATA_FILE, 'w') as f:
+        # Written aside and swapped in, so a concurrent reader never sees a partial file
+        tmp_path = USER_DATA_FILE + ".tmp"
+        with open(tmp_path, 'w') as f:
             json.dump(user_data, f, indent=4)
+        os.replace(tmp_path, USER_DATA_FILE)
         return True
     except Exception:
         return False
@@ -48,72 +86,97 @@ def hash_password(password):
     """Hash password using SHA-256"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+@traced("user_store.register")
 def register_user(username, password, email=""):
     """Register a new user"""
-    user_data = load_user_data()
-
-    if username in user_data:
-        return False, "Username already exists"
-
-    if len(password) < 6:
-        return False, "Password must be at least 6 characters long"
-
-    user_data[username] = {
-        "password": hash_password(password),
-        "email": email,
-        "registration_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "last_login": None,
-        "login_count": 0,
-        "visited_colleges": []
-    }
+    with store_lock:
+        user_data = load_user_data()
+
+        if username in user_data:
+            return False, "Username already exists"
+
+        if len(password) < 6:
+            return False, "Password must be at least 6 characters long"
+
+        user_data[username] = {
+            "password": hash_password(password),
+            "email": email,
+            "registration_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "last_login": None,
+            "login_count": 0,
+            "visited_colleges": []
+        }
 
-    if save_user_data(user_data):
-        return True, "Registration successful!"
-    else:
-        return False, "Registration failed. Please try again."
+        if save_user_data(user_data):
+            return True, "Registration successful!"
+        else:
+            return False, "Registration failed. Please try again."
 
+@traced("user_store.verify")
 def verify_user(username, password):
     """Verify user credentials"""
-    user_data = load_user_data()
+    with store_lock:
+        user_data = load_user_data()
 
-    if username not in user_data:
-        return False, "Invalid username or password"
+        if username not in user_data:
+            return False, "Invalid username or password"
 
-    if user_data[username]["password"] == hash_password(password):
-        # Update login stats
-        user_data[username]["last_login"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        user_data[username]["login_count"] = user_data[username].get("login_count", 0) + 1
-        save_user_data(user_data)
-        return True, "Login successful!"
+        if user_data[username]["password"] == hash_password(password):
+            # Update login stats
+            user_data[username]["last_login"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            user_data[username]["login_count"] = user_data[username].get("login_count", 0) + 1
+            save_user_data(user_data)
+            return True, "Login successful!"
 
-    return False, "Invalid username or password"
+        return False, "Invalid username or password"
 
 def record_college_visit(username, college_name):
-    """Record when a user visits a college"""
-    user_data = load_user_data()
-
-    if username in user_data:
-        visited_colleges = user_data[username].get("visited_colleges", [])
-
-        # Add college visit with timestamp
-        visit_record = {
-            "college_name": college_name,
-            "visit_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-        # Remove existing entry if it exists and add new one (to maintain unique recent visits)
-        visited_colleges = [v for v in visited_colleges if v["college_name"] != college_name]
-        visited_colleges.append(visit_record)
-
-        # Keep only last 20 visits
-        user_data[username]["visited_colleges"] = visited_colleges[-20:]
-        save_user_data(user_data)
-
+    """Record when a user visits a college; buffered and written by the flush_visits job"""
+    add_visit(username, college_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+@traced("user_store.flush_visits")
+def flush_visit_buffer():
+    """Write buffered college visits to the user store in one batch"""
+    with store_lock:
+        visits = take_visits()
+        if not visits:
+            return "no visits"
+        user_data = load_user_data()
+        applied = apply_visits(user_data, visits)
+        if not save_user_data(user_data):
+            restore_visits(visits)
+            raise OSError(f"could not write {USER_DATA_FILE}")
+    return f"{applied} of {len(visits)} visits written"
+
+def compact_user_store():
+    """Drop duplicate, malformed and surplus visit records and rewrite the user store"""
+    with store_lock:
+        before = os.path.getsize(USER_DATA_FILE) if os.path.exists(USER_DATA_FILE) else 0
+        user_data = load_user_data()
+        removed = 0
+        for record in user_data.values():
+            visits = [v for v in record.get("visited_colleges", []) if isinstance(v, dict) and v.get("college_name") and v.get("visit_time")]
+            latest = {}
+            for visit in sorted(visits, key=lambda v: v["visit_time"]):
+                latest.pop(visit["college_name"], None)
+                latest[visit["college_name"]] = visit
+            compacted = list(latest.values())[-MAX_VISITS:]
+            removed += len(record.get("visited_colleges", [])) - len(compacted)
+            if "visited_colleges" in record:
+                record["visited_colleges"] = compacted
+        if user_data and not save_user_data(user_data):
+            raise OSError(f"could not write {USER_DATA_FILE}")
+    after = os.path.getsize(USER_DATA_FILE) if os.path.exists(USER_DATA_FILE) else 0
+    return f"{len(user_data)} users, {removed} visit records removed, {before:,} -> {after:,} bytes"
+
+@traced()
 def get_user_stats(username):
     """Get user statistics"""
     user_data = load_user_data()
 
     if username in user_data:
+        # Visits still in the buffer count too
+        apply_visits(user_data, pending_visits(username))
         user_info = user_data[username]
         visited_count = len(user_info.get("visited_colleges", []))
         login_count = user_info.get("login_count", 0)
@@ -127,6 +190,15 @@ def get_user_stats(username):
         }
     return None
 
+# Usernames with access to the admin panel, comma-separated; a user record with "role": "admin" also qualifies
+ADMIN_USERS = {name.strip() for name in os.environ.get("SAFEMAP_ADMINS", "").split(",") if name.strip()}
+
+def is_admin(username):
+    """Whether a user may see the admin panel"""
+    if not username:
+        return False
+    return username in ADMIN_USERS or load_user_data().get(username, {}).get("role") == "admin"
+
 # --- Image Loading Function ---
 def load_local_image(image_path):
     """Load local image and convert to base64 for HTML display"""
@@ -139,7 +211,8 @@ def load_local_image(image_path):
         return "https://via.placeholder.com/140x140/2F80ED/FFFFFF?text=Logo"
 
 # --- Global Custom CSS for UI Enhancement ---
-st.markdown("""
+with span("css"):
+    st.markdown("""
 <style>
 /* Global Font & Primary Colors */
 :root {
@@ -1094,6 +1167,13 @@ enhanced_colleges = [
     }
 ]
 
+# A JSON list in the same format replaces the built-in colleges; the benchmarks use it
+# to run the app at larger scales
+COLLEGES_FILE = os.environ.get("SAFEMAP_COLLEGES_FILE", "")
+if COLLEGES_FILE:
+    with open(COLLEGES_FILE) as f:
+        enhanced_colleges = json.load(f)
+
 # For backward compatibility
 colleges = enhanced_colleges
 
@@ -1190,6 +1270,11 @@ if 'auth_tab' not in st.session_state:
 if 'enhanced_tools_tab' not in st.session_state:
     st.session_state.enhanced_tools_tab = 'map'
 
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+session_seen(st.session_state.session_id)
+
 # Navigation functions
 def go_to_map():
     st.session_state.page = 'map'
@@ -1207,6 +1292,7 @@ def login_user():
     password = st.session_state.login_password
     
     success, message = verify_user(username, password)
+    inc("safemap_login_attempts_total", result="success" if success else "failure")
     if success:
         st.session_state.authenticated = True
         st.session_state.username = username
@@ -1247,7 +1333,21 @@ if 'map_data' not in st.session_state:
     st.session_state.map_data = {}
 
 def generate_places(college, category, count=3, offset=0.005, include_fee=False):
-    """Generates and caches fake nearby place data."""
+    """Nearby places from the POI catalogue, or generated ones when no catalogue has been imported"""
+    poi_store = load_poi_store() if category in POI_CATEGORIES else None
+    if poi_store is not None:
+        # Queried from the shared memory-mapped store on each run rather than copied into the session
+        return [
+            {
+                "name": p["name"] or f"{category} {i+1}",
+                "lat": p["lat"],
+                "lon": p["lon"],
+                "icon": categories[category]["icon"],
+                "color": categories[category]["color"],
+                "fee": p["fee"] if include_fee else None
+            } for i, p in enumerate(nearby_places(poi_store, college["lat"], college["lon"], category))
+        ]
+
     key = f"{college['name'].replace(' ', '*')}*{category}"
     if key not in st.session_state.map_data:
         st.session_state.map_data[key] = [
@@ -1262,6 +1362,175 @@ def generate_places(college, category, count=3, offset=0.005, include_fee=False)
         ]
     return st.session_state.map_data[key]
 
+# --- Map Viewport ---
+
+# Viewports are snapped outward to this fraction of a tile width, then padded by VIEWPORT_MARGIN of their size
+VIEWPORT_SNAP_TILES = 0.5
+VIEWPORT_MARGIN = 0.25
+
+# Minimum seconds between applied viewport changes while the user keeps panning
+VIEWPORT_MIN_INTERVAL = 0.75
+
+def quantise_viewport(south, west, north, east, zoom):
+    """Snap map bounds to a zoom-dependent grid and pad them, so small pans give the same viewport"""
+    step = VIEWPORT_SNAP_TILES * 360.0 / (2 ** zoom)
+    south, west = math.floor(south / step) * step, math.floor(west / step) * step
+    north, east = math.ceil(north / step) * step, math.ceil(east / step) * step
+    pad_lat, pad_lon = (north - south) * VIEWPORT_MARGIN, (east - west) * VIEWPORT_MARGIN
+    return (round(south - pad_lat, 6), round(west - pad_lon, 6), round(north + pad_lat, 6), round(east + pad_lon, 6), zoom)
+
+def update_viewport(map_state):
+    """Debounce the bounds/zoom returned by st_folium into st.session_state.viewport"""
+    bounds = (map_state or {}).get("bounds") or {}
+    south_west, north_east = bounds.get("_southWest") or {}, bounds.get("_northEast") or {}
+    zoom = (map_state or {}).get("zoom")
+    if None in (south_west.get("lat"), south_west.get("lng"), north_east.get("lat"), north_east.get("lng")) or not isinstance(zoom, (int, float)):
+        return st.session_state.get("viewport")
+
+    viewport = quantise_viewport(south_west["lat"], south_west["lng"], north_east["lat"], north_east["lng"], int(zoom))
+    if viewport == st.session_state.get("viewport"):
+        return viewport
+    if time.time() - st.session_state.get("viewport_updated", 0.0) < VIEWPORT_MIN_INTERVAL:
+        # Too soon after the last change: keep drawing the previous (padded) viewport; st_folium
+        # returns the latest bounds on every rerun, so the next one after the interval applies them
+        return st.session_state.get("viewport")
+    st.session_state.viewport = viewport
+    st.session_state.viewport_updated = time.time()
+    return viewport
+
+def in_viewport(lat, lon, viewport, pad=0.0):
+    """Whether a point lies inside the (south, west, north, east, zoom) viewport, grown by pad degrees"""
+    if viewport is None:
+        return True
+    south, west, north, east, _ = viewport
+    return south - pad <= lat <= north + pad and west - pad <= lon <= east + pad
+
+# --- Lazy Popups ---
+
+# JS template literals for popups built on click from a PopupTable row; fields are available as r.<name>
+COLLEGE_POPUP_FIELDS = ["name", "university", "established", "rail", "bus", "courses", "website", "image"]
+COLLEGE_POPUP_TEMPLATE = (
+    "<div style='width:250px; font-family:sans-serif;'>"
+    "<h4 style='color:#2F80ED;'>${r.name}</h4>"
+    "<b>University:</b> ${r.university}<br>"
+    "<b>Established:</b> ${r.established}<br>"
+    "<b>Rail Dist:</b> ${r.rail} km<br>"
+    "<b>Bus Dist:</b> ${r.bus} km<br>"
+    "<b>Courses:</b> ${r.courses}<br>"
+    "<a href=\"${r.website}\" target=\"_blank\" style='color:#F2994A; font-weight:bold;'>Visit Website →</a>"
+    "${r.image ? '<br><img src=\"' + r.image + '\" width=\"240\" style=\"margin-top:10px; border-radius:8px;\">' : ''}"
+    "</div>"
+)
+PLACE_POPUP_FIELDS = ["name", "fee", "college", "distance"]
+PLACE_POPUP_TEMPLATE = (
+    "<b>${r.name}</b><br>"
+    "${r.fee ? 'Avg. Rent: ₹' + r.fee.toLocaleString('en-US') + '/month<br>' : ''}"
+    "${r.distance !== null ? 'Distance to ' + r.college + ': ' + r.distance + ' km' : ''}"
+)
+
+def cluster_bubble(cluster, color, label):
+    """Marker for a server-side cluster centroid, sized and labelled by its point count"""
+    size = 28 + 8 * min(len(str(cluster["count"])) - 1, 4)
+    return folium.Marker(
+        location=[cluster["lat"], cluster["lon"]],
+        icon=folium.DivIcon(
+            html=f"<div style='width:{size}px; height:{size}px; line-height:{size}px; border-radius:50%; background:{color}; opacity:0.85; color:white; font-weight:bold; text-align:center; font-family:sans-serif;'>{cluster['count']:,}</div>",
+            icon_size=(size, size),
+            icon_anchor=(size // 2, size // 2)
+        ),
+        tooltip=f"{cluster['count']:,} {label} - zoom in to expand"
+    )
+
+# --- Shared Cache ---
+
+def colleges_key(colleges):
+    """Cache key for a list of colleges, from the fields derived artefacts depend on"""
+    return cache_key([(c["name"], c["lat"], c["lon"]) for c in colleges])
+
+@traced()
+def get_safety_scores():
+    """Safety scores for every college, or None when no crime data is loaded"""
+    crime_store = load_crime_store()
+    if crime_store is None:
+        return None
+    return cached("safety_scores", cache_key(crime_store["meta"]["version"], SAFETY_RADII_KM, colleges_key(enhanced_colleges)),
+                  lambda: compute_safety_scores(crime_store, enhanced_colleges))
+
+@traced()
+def hub_distances(colleges):
+    """Distance matrix (km) from the railway station and bus stand to each college, as (rail, bus) rows"""
+    return cached("distances", colleges_key(colleges), lambda: [
+        (round(geodesic(station_coords, (c["lat"], c["lon"])).km, 2), round(geodesic(bus_stand_coords, (c["lat"], c["lon"])).km, 2))
+        for c in colleges
+    ])
+
+@traced()
+def cached_figure(name, df, build):
+    """Plotly figure for a DataFrame, built once and shared between server processes as figure JSON"""
+    return pio.from_json(cached("figures", cache_key(name, df.to_json()), lambda: build(df).to_json()))
+
+def show_cached_map(key, build_map, height):
+    """Show a static folium map whose rendered HTML is shared between server processes"""
+    st.iframe(cached("map_html", key, lambda: build_map().get_root().render()), height=height)
+
+# --- Background Jobs ---
+
+def rebuild_distance_matrix():
+    """Recompute the college distance matrix into the shared cache"""
+    invalidate("distances", colleges_key(enhanced_colleges))
+    return f"{len(hub_distances(enhanced_colleges))} colleges"
+
+def refresh_crime_aggregates():
+    """Bring the crime cube, hotspots and vector tiles up to date with the crime store"""
+    store = load_crime_store()
+    if store is None:
+        return "no crime store"
+    version = store["meta"]["version"]
+    load_cube(store)
+    hotspots = ensure_hotspots()
+    tiles = ensure_vector_tiles()
+    pending = [name for name, current in [("hotspots", hotspots and hotspots["store_version"] == version),
+                                          ("vector tiles", tiles and tiles.get("store_version") == version)] if not current]
+    failed = [f"{name} failed ({error})" for name, error in [("hotspots", hotspots_error()),
+                                                             ("vector tiles", vector_tiles_error())] if error]
+    return f"store {version}: " + "; ".join(failed + ([f"rebuilding {', '.join(pending)}"] if pending else ["all current"]))
+
+def retrain_risk_model():
+    """Retrain the risk model from scratch when the crime store has changed since the last snapshot"""
+    store = load_crime_store()
+    if store is None:
+        return "no crime store"
+    snapshot = load_latest_snapshot()
+    if snapshot is not None and snapshot.get("store_version") == store["meta"]["version"]:
+        return f"snapshot v{snapshot['version']} is current"
+    future = train_async()
+    if future is None:
+        if training_in_progress():
+            return "a training run is already in progress"
+        return f"the last training run failed ({training_error()}); it will be retried"
+    try:
+        snapshot = future.result()
+    except BrokenProcessPool:
+        # The workers module replaces the dead pool on the next run
+        return "training worker crashed; will retry on the next run"
+    return f"snapshot v{snapshot['version']} trained on {snapshot['samples']:,} samples"
+
+# name: (function, seconds between runs, concurrency limit, first run after, per process)
+BACKGROUND_JOBS = {
+    "flush_visits": (flush_visit_buffer, VISIT_FLUSH_SECONDS, 1, VISIT_FLUSH_SECONDS, True),
+    "distance_matrix": (rebuild_distance_matrix, 6 * 3600, 1, 0, False),
+    "crime_aggregates": (refresh_crime_aggregates, 10 * 60, 1, 0, False),
+    "risk_model": (retrain_risk_model, 24 * 3600, 1, 3600, False),
+    "compact_user_store": (compact_user_store, 24 * 3600, 1, 3600, False)
+}
+
+for job_name, (job_func, every, limit, delay, per_process) in BACKGROUND_JOBS.items():
+    add_job(job_name, job_func, every, max_concurrent=limit, initial_delay=delay, per_process=per_process,
+            description=job_func.__doc__)
+if not HEADLESS:
+    start_scheduler()
+
+@traced("view.comparison")
 def show_college_comparison():
     """Enhanced college comparison feature - FIXED PLACEMENT RATE ISSUE"""
     st.markdown('<div class="detail-card-enhanced">', unsafe_allow_html=True)
@@ -1271,6 +1540,7 @@ def show_college_comparison():
     selected_colleges = st.multiselect("Select colleges to compare:", college_options, max_selections=3)
     
     if selected_colleges:
+        safety_scores = get_safety_scores() or {}
         comparison_data = []
         for name in selected_colleges:
             college = next((c for c in enhanced_colleges if c["name"] == name), None)
@@ -1294,6 +1564,8 @@ def show_college_comparison():
                 # Extract package values for comparison
                 avg_package = placement.get("average_package", "N/A")
                 high_package = placement.get("highest_package", "N/A")
+
+                safety = safety_scores.get(name)
                 
                 comparison_data.append({
                     "Name": college["name"],
@@ -1306,6 +1578,7 @@ def show_college_comparison():
                     "Placement Rate Num": placement_rate_num,
                     "Highest Package": high_package,
                     "Campus Size": college.get("campus_size", "N/A"),
+                    "Safety Score": f"{safety['score']}/100 ({safety['risk_level']} risk)" if safety else "N/A",
                     "Top Recruiters": ", ".join(placement.get("top_recruiters", [])) if placement.get("top_recruiters") else "N/A"
                 })
         
@@ -1322,20 +1595,19 @@ def show_college_comparison():
                 
                 with col1:
                     # Number of Courses Comparison
-                    fig_courses = px.bar(
-                        df, 
+                    fig_courses = cached_figure("comparison_courses", df[['Name', 'Courses']], lambda data: px.bar(
+                        data, 
                         x='Name', 
                         y='Courses', 
                         title='Number of Courses Offered',
                         color='Name',
                         color_discrete_sequence=px.colors.qualitative.Set3
-                    )
-                    fig_courses.update_layout(
+                    ).update_layout(
                         xaxis_title="College",
                         yaxis_title="Number of Courses",
                         showlegend=False,
                         xaxis_tickangle=-45
-                    )
+                    ))
                     st.plotly_chart(fig_courses, use_container_width=True)
                 
                 with col2:
@@ -1372,26 +1644,24 @@ def show_college_comparison():
                     
                     if valid_placement_data:
                         placement_vis_df = pd.DataFrame(valid_placement_data)
-                        fig_placement = px.bar(
-                            placement_vis_df, 
+                        fig_placement = cached_figure("comparison_placement", placement_vis_df, lambda data: px.bar(
+                            data, 
                             x='Name', 
                             y='Placement Rate Num',
                             title='Placement Rate Comparison (%)',
                             color='Name',
                             color_discrete_sequence=px.colors.qualitative.Set1,
                             text='Placement Rate'
-                        )
-                        fig_placement.update_layout(
+                        ).update_layout(
                             xaxis_title="College",
                             yaxis_title="Placement Rate (%)",
                             yaxis_range=[0, 100],
                             showlegend=False,
                             xaxis_tickangle=-45
-                        )
-                        fig_placement.update_traces(
+                        ).update_traces(
                             texttemplate='%{text}',
                             textposition='outside'
-                        )
+                        ))
                         st.plotly_chart(fig_placement, use_container_width=True)
                     else:
                         # Show detailed information about missing data
@@ -1441,20 +1711,19 @@ def show_college_comparison():
                 
                 if package_comparison_data:
                     package_df = pd.DataFrame(package_comparison_data)
-                    fig_packages = px.bar(
-                        package_df,
+                    fig_packages = cached_figure("comparison_packages", package_df, lambda data: px.bar(
+                        data,
                         x='College',
                         y='Value (LPA)',
                         color='Package Type',
                         barmode='group',
                         title='Average vs Highest Packages (LPA)',
                         color_discrete_sequence=['#2E86AB', '#A23B72']
-                    )
-                    fig_packages.update_layout(
+                    ).update_layout(
                         xaxis_title="College",
                         yaxis_title="Package (LPA)",
                         xaxis_tickangle=-45
-                    )
+                    ))
                     st.plotly_chart(fig_packages, use_container_width=True)
                 else:
                     st.info("Package data not available for comparison.")
@@ -1526,6 +1795,7 @@ def show_placement_stats(college_name):
         st.info("Placement data not available for this college.")
     st.markdown('</div>', unsafe_allow_html=True)
 
+@traced("view.commute")
 def commute_planner(selected_college):
     """Enhanced commute planner"""
     st.markdown('<div class="detail-card-enhanced">', unsafe_allow_html=True)
@@ -1535,9 +1805,7 @@ def commute_planner(selected_college):
     selected_mode = st.selectbox("Transport Mode:", transport_modes)
     
     # Calculate distances
-    college_coords = [selected_college["lat"], selected_college["lon"]]
-    rail_distance = round(geodesic(station_coords, college_coords).km, 2)
-    bus_distance = round(geodesic(bus_stand_coords, college_coords).km, 2)
+    rail_distance, bus_distance = hub_distances([selected_college])[0]
     
     # Calculate estimated time based on mode and distance
     avg_speed = {"Car": 40, "Public Transport": 25, "Bike": 20, "Walk": 5}
@@ -1560,6 +1828,146 @@ def commute_planner(selected_college):
     else:
         st.write("• **Recommended:** Via Central Bus Stand (shorter distance)")
         st.write("• **Alternative:** Via Railway Station")
+
+    # Walking route from a student's lodging, optionally avoiding crime hotspots
+    st.write("**🏠 Route from Your Lodging:**")
+    with span("generate_places"):
+        lodgings = generate_places(selected_college, "Apartment", include_fee=True)
+    if not lodgings:
+        st.info("No apartments are listed near this college.")
+        st.markdown('</div>', unsafe_allow_html=True)
+        return
+    lodging_name = st.selectbox("Lodging:", [p["name"] for p in lodgings], key="commute_lodging")
+    lodging = next(p for p in lodgings if p["name"] == lodging_name)
+
+    route_col1, route_col2 = st.columns(2)
+    with route_col1:
+        route_type = st.radio("Route Type:", ["Shortest route", "Safest route"], horizontal=True, key="commute_route_type")
+    with route_col2:
+        travel_window = st.selectbox("Travel Time:", list(TIME_WINDOWS), key="commute_travel_window")
+
+    graph = get_graph()
+    origin = (lodging["lat"], lodging["lon"])
+    shortest = find_route(graph, origin, (selected_college["lat"], selected_college["lon"]))
+    route = shortest
+    penalties = None
+    if route_type == "Safest route":
+        hours = None if travel_window == "Any time" else hours_in_window(*TIME_WINDOWS[travel_window])
+        penalties = get_safety_weights(graph, hours)
+        if load_crime_store() is None:
+            st.info("Safest routing needs crime data; showing the shortest route.")
+        elif penalties is None:
+            st.info("Safety weights are being prepared in the background; showing the shortest route for now.")
+        else:
+            route = find_route(graph, origin, (selected_college["lat"], selected_college["lon"]), penalties)
+
+    if route is None:
+        st.warning("No walking route found between this lodging and the college.")
+    else:
+        col3, col4 = st.columns(2)
+        with col3:
+            st.metric("Walking Distance", f"{route['length_km']} km")
+            st.metric("Walking Time", f"{round(route['length_km'] / avg_speed['Walk'] * 60)} min")
+        with col4:
+            if penalties is not None and route is not shortest:
+                shortest_exposure = route_exposure(graph, shortest, penalties)
+                st.metric("Crime Exposure", route["exposure"], delta=round(route["exposure"] - shortest_exposure, 2),
+                          delta_color="inverse", help="Distance-weighted crime density along the route, compared with the shortest route")
+                st.metric("Extra Distance", f"{round(route['length_km'] - shortest['length_km'], 2)} km")
+
+        def build_route_map():
+            route_map = folium.Map(location=[selected_college["lat"], selected_college["lon"]], zoom_start=14)
+            if route is not shortest:
+                folium.PolyLine(shortest["coords"], color="#6B7280", weight=3, opacity=0.6, dash_array="6",
+                                tooltip=f"Shortest route: {shortest['length_km']} km").add_to(route_map)
+            folium.PolyLine(route["coords"], color="#27AE60" if route is not shortest else "#2F80ED", weight=5,
+                            tooltip=f"{route_type}: {route['length_km']} km").add_to(route_map)
+            folium.Marker(origin, popup=lodging["name"], icon=folium.Icon(color="blue", icon="building", prefix="fa")).add_to(route_map)
+            folium.Marker([selected_college["lat"], selected_college["lon"]], popup=selected_college["name"],
+                          icon=folium.Icon(color="darkblue", icon="graduation-cap", prefix="fa")).add_to(route_map)
+            route_map.fit_bounds([[min(c[0] for c in route["coords"]), min(c[1] for c in route["coords"])],
+                                  [max(c[0] for c in route["coords"]), max(c[1] for c in route["coords"])]])
+            return route_map
+
+        # Display-only map, so its rendered HTML can be reused for the same route
+        route_key = cache_key(selected_college["name"], lodging["name"], origin, route_type, route["coords"], shortest["coords"])
+        show_cached_map(route_key, build_route_map, height=400)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+@traced("view.lodging")
+def lodging_safety_check(target_colleges):
+    """Batch-check candidate lodgings against high-crime zones"""
+    st.markdown('<div class="detail-card-enhanced">', unsafe_allow_html=True)
+    st.subheader("🏠 Lodging Safety Check")
+
+    crime_cube = load_cube()
+    if crime_cube is None:
+        st.info("Load crime data to check lodgings against high-risk zones.")
+        st.markdown('</div>', unsafe_allow_html=True)
+        return
+
+    source = st.radio("Candidate Lodgings:", ["Apartments near selected colleges", "Upload CSV (name, lat, lon)"],
+                      horizontal=True, key="geofence_source")
+    if source == "Apartments near selected colleges":
+        with span("generate_places"):
+            candidates = pd.DataFrame([
+                {"Name": f"{p['name']} ({college['name']})", "lat": p["lat"], "lon": p["lon"], "Rent (₹/month)": p["fee"]}
+                for college in target_colleges
+                for p in generate_places(college, "Apartment", include_fee=True)
+            ])
+    else:
+        uploaded = st.file_uploader("Lodgings CSV", type=["csv"], key="geofence_upload")
+        candidates = pd.DataFrame()
+        if uploaded is not None:
+            candidates = pd.read_csv(uploaded)
+            candidates.columns = [c.strip().lower() for c in candidates.columns]
+            if not {"lat", "lon"}.issubset(candidates.columns):
+                st.error("The CSV needs lat and lon columns.")
+                candidates = pd.DataFrame()
+            else:
+                candidates = candidates.rename(columns={"name": "Name"})
+                if "Name" not in candidates.columns:
+                    candidates["Name"] = [f"Location {i + 1}" for i in range(len(candidates))]
+                candidates = candidates.dropna(subset=["lat", "lon"])
+
+    if candidates.empty:
+        st.info("Select a college or upload lodging locations to run the check.")
+        st.markdown('</div>', unsafe_allow_html=True)
+        return
+
+    # One vectorised pass over every candidate
+    zones = high_risk_zones(crime_cube)
+    zone_index = classify_points(candidates["lat"].to_numpy(), candidates["lon"].to_numpy(), zones)
+    candidates["In High-Risk Zone"] = zone_index >= 0
+    candidates["Zone Incidents"] = [zones[z]["incidents"] if z >= 0 else 0 for z in zone_index]
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Lodgings Checked", len(candidates))
+    with col2:
+        st.metric("In High-Risk Zones", int(candidates["In High-Risk Zone"].sum()))
+
+    def build_check_map():
+        check_map = folium.Map(location=[candidates["lat"].mean(), candidates["lon"].mean()], zoom_start=13)
+        for zone in zones:
+            folium.Polygon(zone["polygon"], color="#DC2626", weight=1, fill=True, fill_opacity=0.2,
+                           tooltip=f"High-risk zone: {zone['incidents']:,} incidents").add_to(check_map)
+        for name, lat, lon, at_risk in zip(candidates["Name"], candidates["lat"], candidates["lon"], candidates["In High-Risk Zone"]):
+            folium.CircleMarker(
+                location=[lat, lon],
+                radius=6,
+                color="#DC2626" if at_risk else "#27AE60",
+                fill=True,
+                fill_opacity=0.8,
+                tooltip=f"{name}: {'high-risk zone' if at_risk else 'outside high-risk zones'}"
+            ).add_to(check_map)
+        return check_map
+
+    check_key = cache_key(crime_cube["store_version"], candidates[["Name", "lat", "lon", "In High-Risk Zone"]].to_json())
+    show_cached_map(check_key, build_check_map, height=450)
+
+    st.dataframe(candidates.sort_values(["In High-Risk Zone", "Zone Incidents"], ascending=False),
+                 use_container_width=True, hide_index=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
 def cost_of_living_calculator():
@@ -1604,13 +2012,14 @@ def cost_of_living_calculator():
         st.write(f"**📅 Annual Estimate: ₹{total_cost * 12:,}**")
     st.markdown('</div>', unsafe_allow_html=True)
 
+@traced("view.analytics")
 def show_analytics():
     """College analytics dashboard"""
     st.markdown('<div class="detail-card-enhanced">', unsafe_allow_html=True)
     st.subheader("📊 College Analytics Dashboard")
     
-    # Create analytics data
-    data = {
+    # Create analytics data, shared between server processes so every user sees the same figures
+    data = cached("analytics_data", colleges_key(enhanced_colleges), lambda: {
         'College': [college['name'] for college in enhanced_colleges],
         'Students': [random.randint(800, 2500) for _ in enhanced_colleges],
         'Faculty': [random.randint(40, 120) for _ in enhanced_colleges],
@@ -1618,35 +2027,184 @@ def show_analytics():
                           for college in enhanced_colleges],
         'Established': [college.get('established', 2000) for college in enhanced_colleges],
         'University': [college['university'] for college in enhanced_colleges]
-    }
+    })
     df = pd.DataFrame(data)
+
+    safety_scores = get_safety_scores()
+    if safety_scores:
+        df['Safety Score'] = [safety_scores[college['name']]['score'] for college in enhanced_colleges]
     
     # Analytics charts
     col1, col2 = st.columns(2)
     
     with col1:
         # Student vs Faculty ratio
-        fig_ratio = px.scatter(df, x='Faculty', y='Students', size='Placement Rate',
+        fig_ratio = cached_figure("analytics_ratio", df, lambda data: px.scatter(data, x='Faculty', y='Students', size='Placement Rate',
                              hover_name='College', color='University',
                              title='Faculty vs Student Ratio & Placement Rate',
-                             labels={'Faculty': 'Number of Faculty', 'Students': 'Number of Students'})
+                             labels={'Faculty': 'Number of Faculty', 'Students': 'Number of Students'}))
         st.plotly_chart(fig_ratio, use_container_width=True)
         
         # Establishment year distribution
-        fig_est = px.histogram(df, x='Established', title='College Establishment Years')
+        fig_est = cached_figure("analytics_established", df[['Established']], lambda data: px.histogram(data, x='Established', title='College Establishment Years'))
         st.plotly_chart(fig_est, use_container_width=True)
     
     with col2:
         # Placement rate by university
-        fig_placement = px.box(df, x='University', y='Placement Rate',
-                             title='Placement Rate Distribution by University')
+        fig_placement = cached_figure("analytics_placement", df[['University', 'Placement Rate']], lambda data: px.box(data, x='University', y='Placement Rate',
+                             title='Placement Rate Distribution by University'))
         st.plotly_chart(fig_placement, use_container_width=True)
         
         # Top colleges by placement
         top_colleges = df.nlargest(5, 'Placement Rate')
-        fig_top = px.bar(top_colleges, x='College', y='Placement Rate',
-                        title='Top 5 Colleges by Placement Rate')
+        fig_top = cached_figure("analytics_top", top_colleges[['College', 'Placement Rate']], lambda data: px.bar(data, x='College', y='Placement Rate',
+                        title='Top 5 Colleges by Placement Rate'))
         st.plotly_chart(fig_top, use_container_width=True)
+
+    # Safety scores from crime density around each campus
+    if safety_scores:
+        fig_safety = cached_figure("analytics_safety", df[['College', 'Safety Score']].sort_values('Safety Score', ascending=False),
+                                   lambda data: px.bar(data, x='College', y='Safety Score',
+                            color='Safety Score', color_continuous_scale='RdYlGn', range_color=[0, 100],
+                            title='Safety Score by College (100 = safest, 50 = city average)'
+                        ).update_layout(yaxis_range=[0, 100], xaxis_tickangle=-45))
+        st.plotly_chart(fig_safety, use_container_width=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def format_seconds(seconds):
+    """A duration as a short human string, e.g. 45s, 10m, 6.0h"""
+    return f"{seconds:.0f}s" if seconds < 120 else f"{seconds / 60:.0f}m" if seconds < 7200 else f"{seconds / 3600:.1f}h"
+
+def format_age(timestamp):
+    """Time since a past timestamp, or until a future one"""
+    if timestamp is None:
+        return "never"
+    seconds = time.time() - timestamp
+    return f"{format_seconds(seconds)} ago" if seconds >= 0 else f"in {format_seconds(-seconds)}"
+
+def show_admin_panel():
+    """Background job, shared cache, warm-up, rerun timing and memory status for admins"""
+    st.markdown('<div class="detail-card-enhanced">', unsafe_allow_html=True)
+    st.subheader("🛠️ Admin Status")
+
+    st.write("**⏱️ Background Jobs**")
+    jobs = job_status()
+    st.dataframe(pd.DataFrame([
+        {
+            "Job": job["name"],
+            "Every": format_seconds(job["every"]),
+            "Limit": job["max_concurrent"],
+            "Running": job["running"],
+            "Runs": job["runs"],
+            "Failures": job["failures"],
+            "Skipped": job["skipped"],
+            "Last Run": format_age(job["last_started"]),
+            "Took (s)": job["last_seconds"],
+            "Next Run": format_age(job["next_run"]),
+            "Last Result": job["last_error"] or job["last_result"] or ""
+        } for job in jobs
+    ]), hide_index=True, use_container_width=True)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        job_name = st.selectbox("Job:", [job["name"] for job in jobs], key="admin_job",
+                                format_func=lambda name: f"{name} - {next(j['description'] for j in jobs if j['name'] == name)}")
+    with col2:
+        if st.button("▶️ Run now", key="admin_run_job", use_container_width=True):
+            if run_job_now(job_name):
+                st.success(f"Started {job_name}")
+            else:
+                st.warning(f"{job_name} is already running")
+    st.caption(f"{len(pending_visits())} college visits waiting to be written")
+
+    st.write("**🗄️ Shared Cache**")
+    stats = cache_stats()
+    if "error" in stats:
+        st.warning(f"Shared cache ({stats['backend']}) is unavailable: {stats['error']}")
+    else:
+        hit_rate = f"{stats['hit_rate']:.0%}" if stats["hit_rate"] is not None else "n/a"
+        st.caption(f"{stats['backend']} • {stats['entries']:,} entries • {stats['bytes'] / 1e6:.1f} MB • "
+                   f"{hit_rate} hit rate • {stats['evictions']:,} evicted")
+        st.dataframe(pd.DataFrame([
+            {"Artefact": namespace, "Hits": c["hits"], "Misses": c["misses"],
+             "Hit Rate": f"{c['hit_rate']:.0%}" if c["hit_rate"] is not None else "n/a"}
+            for namespace, c in sorted(stats["namespaces"].items())
+        ]), hide_index=True, use_container_width=True)
+    warm = warmup_status()
+    if warm is not None:
+        took = f" in {warm['seconds']}s" if warm["seconds"] is not None else ""
+        st.caption(f"Warm-up {warm['state']}: {warm['done']}/{warm['total']} steps{took}, {len(warm['failed'])} failed")
+
+    st.write("**🐞 Rerun Timings**")
+    timings = summaries()
+    if timings:
+        st.dataframe(pd.DataFrame([
+            {"Span": name, "Count": t["count"], "p50 (ms)": t["p50"], "p95 (ms)": t["p95"],
+             "p99 (ms)": t["p99"], "Mean (ms)": t["mean"], "Max (ms)": t["max"]}
+            for name, t in sorted(timings.items(), key=lambda item: -item[1]["p95"])
+        ]), hide_index=True, use_container_width=True)
+    else:
+        st.caption("No reruns timed yet")
+    traces = recent_traces()
+    if traces:
+        last = traces[0]
+        dropped = f", {last['dropped_spans']:,} spans dropped" if last.get("dropped_spans") else ""
+        with st.expander(f"Last rerun: {last['page']} page, {last['ms']:.0f} ms ({last['status']}{dropped})"):
+            depth = {}
+            lines = []
+            for s in last["spans"]:
+                depth[s["name"]] = depth.get(s["parent"], -1) + 1 if s["parent"] else 0
+                lines.append(f"{'  ' * depth[s['name']]}{s['name']}: {s['ms']:.1f} ms (at {s['start_ms']:.0f} ms)")
+            st.code("\n".join(lines) or "No spans", language=None)
+    export = st.checkbox("Append every rerun to a JSONL trace file", value=bool(trace_file()), key="admin_trace_export")
+    if export:
+        path = st.text_input("Trace file:", value=trace_file() or os.path.join("data", "traces.jsonl"), key="admin_trace_file")
+        set_trace_file(path)
+        if os.path.exists(path):
+            st.caption(f"{path} • {os.path.getsize(path) / 1e6:.2f} MB")
+    elif trace_file():
+        set_trace_file("")
+
+    st.write("**🧠 Memory**")
+    sessions = session_sizes()
+    total_state = sum(session["bytes"] for session in sessions)
+    st.caption(f"Process RSS {rss_bytes() / 1e6:.0f} MB • {len(sessions)} active sessions • "
+               f"{total_state / 1e6:.1f} MB of session state")
+    st.dataframe(pd.DataFrame([
+        {
+            "Session": session["session_id"][:8],
+            "User": session["username"] or "",
+            "State (KB)": round(session["bytes"] / 1024, 1),
+            "Largest Keys": ", ".join(f"{key} ({size / 1024:.0f} KB)" for key, size in session["top_keys"]),
+            "Last Rerun": format_age(session["seen"]),
+            "Measured": format_age(session["measured"])
+        } for session in sessions
+    ]), hide_index=True, use_container_width=True)
+    st.caption(f"Session state is measured at most every {ACCOUNT_SECONDS}s per session.")
+    history = rss_history()
+    if len(history) > 1:
+        st.scatter_chart(pd.DataFrame([
+            {"Sessions": sample["sessions"], "RSS (MB)": round(sample["rss"] / 1e6, 1)} for sample in history
+        ]), x="Sessions", y="RSS (MB)", height=250)
+    tracing_memory = st.checkbox("Trace allocations with tracemalloc (slows every rerun)",
+                                 value=traced_memory() is not None, key="admin_tracemalloc")
+    if tracing_memory and traced_memory() is None:
+        start_tracemalloc()
+    elif not tracing_memory and traced_memory() is not None:
+        stop_tracemalloc()
+    if tracing_memory:
+        current, peak = traced_memory()
+        st.caption(f"Traced: {current / 1e6:.1f} MB now, {peak / 1e6:.1f} MB peak")
+        since = st.radio("Growth since:", ["previous", "start"], horizontal=True, key="admin_alloc_since",
+                         format_func=lambda value: "the previous rerun" if value == "previous" else "tracing started")
+        allocators = top_allocators(since)
+        if allocators:
+            st.dataframe(pd.DataFrame([
+                {"Allocated At": a["where"], "Growth (KB)": round(a["size_diff"] / 1024, 1),
+                 "Blocks": a["count_diff"], "Total (KB)": round(a["size"] / 1024, 1)}
+                for a in allocators
+            ]), hide_index=True, use_container_width=True)
+        else:
+            st.caption("Snapshots are taken at the end of each rerun; rerun to compare")
     st.markdown('</div>', unsafe_allow_html=True)
 
 def export_data(selected_college):
@@ -1997,12 +2555,17 @@ else:
                 go_to_front()
         
         # Create tabs for main content and enhanced tools
-        tab1, tab2, tab3, tab4 = st.tabs([
+        tab_labels = [
             "🗺️ Interactive Map",
             "🏫 Compare Colleges", 
             "💰 Cost Calculator",
             "📊 View Analytics"
-        ])
+        ]
+        show_admin = is_admin(st.session_state.username)
+        if show_admin:
+            tab_labels.append("🛠️ Admin")
+        tabs = st.tabs(tab_labels)
+        tab1, tab2, tab3, tab4 = tabs[:4]
         
         # Tab 1: Interactive Map (Original Functionality)
         with tab1:
@@ -2047,8 +2610,45 @@ else:
                 for category in categories:
                     if st.checkbox(f"Show {category}", value=False):
                         selected_categories.append(category)
+                st.checkbox("Load only what's in view", value=False, key="viewport_mode",
+                            help="Query and send only the colleges, places and crime cells inside the visible map area")
+                st.radio("Map renderer:", ["Auto", "Leaflet", "WebGL"], horizontal=True, key="map_renderer",
+                         help="Auto switches to WebGL (pydeck) when the map has too many markers for Leaflet, even after clustering")
+                st.checkbox("Build popups on click", value=True, key="lazy_popups",
+                            help="Send a compact table of popup details instead of full popup HTML for every marker")
+                if st.checkbox("Use offline map tiles", value=False, key="offline_tiles",
+                               help="Serve the base map from a local tile cache, downloading missing tiles once"):
+                    st.caption(f"{cached_tile_count():,} map tiles cached")
+                st.checkbox("Draw crime layers from vector tiles", value=False, key="vector_tiles",
+                            help="Load the crime grid and hotspots as prebuilt tiles for the visible area instead of on every rerun")
+
+                # Time and type filters for the crime layer, answered from the pre-built cube
+                crime_filter = None
+                show_risk_forecast = False
+                crime_cube = load_cube() if "Crime Data" in selected_categories else None
+                if crime_cube is not None:
+                    st.markdown("---")
+                    st.subheader("🕒 Crime Time Filter")
+                    time_window = st.selectbox("Time of Day:", list(TIME_WINDOWS) + ["Custom"])
+                    if time_window == "Custom":
+                        start_hour, end_hour = st.slider("Hours (from, to):", 0, 24, (18, 24))
+                    else:
+                        start_hour, end_hour = TIME_WINDOWS[time_window]
+                    selected_weekdays = st.multiselect("Weekdays:", WEEKDAYS, default=WEEKDAYS)
+                    selected_crime_types = st.multiselect("Crime Types:", CRIME_TYPES, default=CRIME_TYPES)
+
+                    crime_filter = {
+                        "hours": hours_in_window(start_hour, end_hour),
+                        "weekdays": [WEEKDAYS.index(d) for d in selected_weekdays],
+                        "type_ids": [CRIME_TYPES.index(t) for t in selected_crime_types]
+                    }
+                    _, slice_counts = slice_cube(crime_cube, **crime_filter)
+                    st.caption(f"{int(slice_counts.sum()):,} incidents match this filter")
+                    show_risk_forecast = st.checkbox("Show predicted risk for these hours", value=False)
+
 
             # Determine what to show based on selection
+            map_build = span("map.build").start()
             target_colleges = st.session_state.filtered_colleges
             show_colleges = len(target_colleges) > 0
             show_college_connections = show_colleges
@@ -2062,145 +2662,306 @@ else:
             sw = [min(all_lats) - 0.05, min(all_lons) - 0.05]
             ne = [max(all_lats) + 0.05, max(all_lons) + 0.05]
 
-            # Create map with initial settings
-            m = folium.Map(location=[17.6768, 75.9216], zoom_start=12)
+            # In viewport mode, layers that depend on the visible area are sent separately from the base map,
+            # so panning updates them without reloading the map
+            viewport_mode = st.session_state.get("viewport_mode", False)
+            viewport = update_viewport(st.session_state.get("main_map")) if viewport_mode else None
+            viewport_layers = []
+            lazy_popups = st.session_state.get("lazy_popups", True)
+
+            # Point, heatmap and polygon layers shared by the Leaflet and WebGL renderers
+            map_layer_defs = []
+            map_zoom = viewport[4] if viewport else 12
+            view_bounds = viewport[:4] if viewport else (sw[0], sw[1], ne[0], ne[1])
+
+            # Layer data and server-side clusters come first: the renderer is chosen from the markers
+            # Leaflet would draw, and the folium map is only built when Leaflet is used
+            # Large sets are clustered on the server, so only this zoom's centroids inside the view are sent.
+            # That needs the map to report its zoom and bounds back, so without a viewport they are clustered
+            # in the browser, where the clusters split as the user zooms in
+            cluster_on_server = viewport is not None
 
-            # Add college markers if selected with improved clustering
             if show_colleges:
-                cluster = MarkerCluster(name="Engineering Colleges")
-                for college in target_colleges:
-                    college_coords = [college["lat"], college["lon"]]
-                    rail_distance = round(geodesic(station_coords, college_coords).km, 2)
-                    bus_distance = round(geodesic(bus_stand_coords, college_coords).km, 2)
-                    
-                    popup_html = f"""
-                    <div style='width:250px; font-family:sans-serif;'>
-                        <h4 style='color:#2F80ED;'>{college['name']}</h4>
-                        <b>University:</b> {college['university']}<br>
-                        <b>Established:</b> {college.get('established', 'N/A')}<br>
-                        <b>Rail Dist:</b> {rail_distance} km<br>
-                        <b>Bus Dist:</b> {bus_distance} km<br>
-                        <b>Courses:</b> {len(college.get('courses', []))}<br>
-                        <a href="{college['website']}" target="_blank" style='color:#F2994A; font-weight:bold;'>Visit Website →</a>
-                        {'<br><img src="' + college['image'] + '" width="240" style="margin-top:10px; border-radius:8px;">' if college['image'] else ''}
-                    </div>
-                    """
-                    cluster.add_child(folium.Marker(
-                        location=college_coords,
-                        popup=folium.Popup(popup_html, max_width=300),
-                        icon=folium.Icon(color="darkblue", icon="graduation-cap", prefix="fa")
-                    ))
-                    
-                    # Record college visit if user is authenticated
-                    if st.session_state.authenticated and st.session_state.username:
-                        record_college_visit(st.session_state.username, college['name'])
-                    
-                    # Add transport connections if showing colleges and transport is selected
-                    if "Public Transport" in selected_categories:
-                        # Rail connection
-                        folium.PolyLine(
-                            locations=[station_coords, college_coords],
-                            color="#2F80ED", # Blue for rail
-                            weight=2,
-                            opacity=0.6,
-                            tooltip=f"Railway to {college['name']}: {rail_distance} km"
-                        ).add_to(m)
-                        
-                        # Bus connection
-                        folium.PolyLine(
-                            locations=[bus_stand_coords, college_coords],
-                            color="#219653", # Green for bus
-                            weight=2,
-                            opacity=0.6,
-                            tooltip=f"Bus Stand to {college['name']}: {bus_distance} km"
-                        ).add_to(m)
-                
-                m.add_child(cluster)
-
-            # Add selected category data
+                server_clustered = cluster_on_server and len(target_colleges) >= CLUSTER_MIN_POINTS
+                if server_clustered:
+                    college_index = get_cluster_index([c["lat"] for c in target_colleges], [c["lon"] for c in target_colleges])
+                    college_clusters = get_clusters(college_index, view_bounds, map_zoom)
+                    shown_colleges = [c["point"] for c in college_clusters if c["point"] >= 0]
+                else:
+                    college_clusters = []
+                    shown_colleges = [i for i, c in enumerate(target_colleges) if in_viewport(c["lat"], c["lon"], viewport)]
+                map_layer_defs.append(point_layer(
+                    "scatter", "Engineering Colleges",
+                    [c["lat"] for c in target_colleges], [c["lon"] for c in target_colleges],
+                    color="darkblue", radius=120, tooltip=[c["name"] for c in target_colleges],
+                    drawn=len(college_clusters) if server_clustered else len(shown_colleges)
+                ))
+                college_distances = hub_distances(target_colleges)
+
+                # Record college visits if user is authenticated; one span for the loop, not one per college
+                if st.session_state.authenticated and st.session_state.username:
+                    with span("record_college_visit"):
+                        for college in target_colleges:
+                            record_college_visit(st.session_state.username, college['name'])
+
+                # Transport connections, one GeoJSON layer per connection type instead of a PolyLine per college
+                hub_connections = []
+                if "Public Transport" in selected_categories:
+                    for name, color, hub_coords, hub_label, column in [("Rail Connections", "#2F80ED", station_coords, "Railway", 0),
+                                                                        ("Bus Connections", "#219653", bus_stand_coords, "Bus Stand", 1)]:
+                        hub_connections.append(line_layer(
+                            name, [[hub_coords, [c["lat"], c["lon"]]] for c in target_colleges], color,
+                            tooltip=[f"{hub_label} to {c['name']}: {college_distances[i][column]} km" for i, c in enumerate(target_colleges)]
+                        ))
+                    map_layer_defs += hub_connections
+
+            # Data for the selected categories
+            crime_store = load_crime_store()
+            category_layers = {}
             for category in selected_categories:
-                if category == "Public Transport":
-                    # Add transport hubs only when checkbox is selected
-                    folium.Marker(
-                        location=station_coords,
-                        popup="Solapur Railway Station",
-                        icon=folium.Icon(color="darkgreen", icon="train", prefix="fa")
-                    ).add_to(m)
-                    
-                    folium.Marker(
-                        location=bus_stand_coords,
-                        popup="Solapur Central Bus Stand",
-                        icon=folium.Icon(color="orange", icon="bus", prefix="fa")
-                    ).add_to(m)
-                    
-                elif show_colleges:
-                    # Use FeatureGroup for other amenities for layer control
-                    fg = FeatureGroup(name=category)
-                    
+                if category == "Crime Data" and crime_store is not None:
+                    # Crime density from the pre-aggregated grid; payload is bounded by cell count
+                    crime = category_layers[category] = {"heatmap": None, "hotspots": None, "risk": None}
+                    is_filtered = crime_filter is not None and (
+                        len(crime_filter["hours"]) < 24
+                        or len(crime_filter["weekdays"]) < len(WEEKDAYS)
+                        or len(crime_filter["type_ids"]) < len(CRIME_TYPES)
+                    )
+                    severity_colors = {"Critical": "#7F1D1D", "High": "#DC2626", "Elevated": "#F2994A"}
+
+                    # Prebuilt tiles hold all-time totals, so filtered views and the WebGL renderer are built per rerun
+                    use_vector_tiles = st.session_state.get("vector_tiles") and not is_filtered and st.session_state.get("map_renderer") != "WebGL"
+                    crime["vector_meta"] = ensure_vector_tiles() if use_vector_tiles else None
+                    if crime["vector_meta"] is None:
+                        if use_vector_tiles and vector_tiles_error():
+                            st.warning(f"Crime vector tiles could not be built ({vector_tiles_error()}); showing the heatmap instead.")
+                        elif use_vector_tiles:
+                            st.info("Crime vector tiles are being built in the background; showing the heatmap until they are ready.")
+                        if is_filtered:
+                            points = cube_heatmap_points(crime_cube, map_zoom, bounds=view_bounds, **crime_filter)
+                        else:
+                            points = heatmap_points(crime_store, map_zoom, bounds=view_bounds)
+                        crime["heatmap"] = heatmap_layer("Crime Heatmap", points)
+                        map_layer_defs += [crime["heatmap"], heatmap_layer("Crime Density", points, kind="hexagon")]
+
+                        # Hotspot polygons are clustered in a background process; draw the latest available
+                        hotspot_result = ensure_hotspots()
+                        if hotspot_result and hotspot_result["hotspots"]:
+                            crime["hotspots"] = polygon_layer(
+                                "Crime Hotspots",
+                                [h["polygon"] for h in hotspot_result["hotspots"]],
+                                [severity_colors.get(h["severity"], "#DC2626") for h in hotspot_result["hotspots"]],
+                                tooltip=[f"{h['severity']} hotspot: {h['incidents']:,} incidents ({h['density']:,}/km²)"
+                                         for h in hotspot_result["hotspots"]]
+                            )
+                            map_layer_defs.append(crime["hotspots"])
+                        elif hotspot_result is None and hotspots_error():
+                            st.warning(f"Crime hotspots could not be computed ({hotspots_error()}); they will be retried shortly.")
+
+                    # Model predictions are precomputed per cell and hour, so this is a lookup
+                    risk_grid = ensure_risk_grid() if show_risk_forecast else None
+                    if risk_grid is not None:
+                        crime["risk"] = heatmap_layer(
+                            "Predicted Crime Risk",
+                            risk_heatmap_points(risk_grid, map_zoom, hours=crime_filter["hours"], bounds=view_bounds),
+                            gradient={0.2: "#DDD6FE", 0.5: "#8B5CF6", 0.8: "#6D28D9", 1.0: "#3B0764"}
+                        )
+                        map_layer_defs.append(crime["risk"])
+                    elif show_risk_forecast and training_error():
+                        st.warning(f"The risk model could not be trained ({training_error()}); it will be retried shortly.")
+                    elif show_risk_forecast:
+                        st.info("The risk model is training in the background; predictions will appear shortly.")
+
+                elif category != "Public Transport" and show_colleges:
                     # Determine if we should show fee/distance details (Apartment is a good candidate)
                     include_details = category == "Apartment" or category == "Cafe"
 
-                    for college in target_colleges:
-                        places = generate_places(college, category, include_fee=include_details)
-                        for p in places:
-                            distance = round(geodesic((college["lat"], college["lon"]), (p["lat"], p["lon"])).km, 2) if include_details else None
-                            
+                    with span("generate_places"):
+                        place_rows = [(college, p) for college in target_colleges
+                                      for p in generate_places(college, category, include_fee=include_details)]
+                    place_bubbles = []
+                    if cluster_on_server and len(place_rows) >= CLUSTER_MIN_POINTS:
+                        place_index = get_cluster_index([p["lat"] for _, p in place_rows], [p["lon"] for _, p in place_rows])
+                        place_clusters = get_clusters(place_index, view_bounds, map_zoom)
+                        place_bubbles = [c for c in place_clusters if c["point"] < 0]
+                        shown_places = [place_rows[c["point"]] for c in place_clusters if c["point"] >= 0]
+                    else:
+                        shown_places = [(college, p) for college, p in place_rows if in_viewport(p["lat"], p["lon"], viewport)]
+                    map_layer_defs.append(point_layer(
+                        "scatter", category, [p["lat"] for _, p in place_rows], [p["lon"] for _, p in place_rows],
+                        color=categories[category]["color"], radius=40, tooltip=[p["name"] for _, p in place_rows],
+                        drawn=len(place_bubbles) + len(shown_places)
+                    ))
+                    category_layers[category] = {"include_details": include_details, "bubbles": place_bubbles, "rows": shown_places,
+                                                 "browser_clustered": not cluster_on_server and len(place_rows) >= CLUSTER_MIN_POINTS}
+
+            # Transport hubs, drawn as icon markers by Leaflet
+            if "Public Transport" in selected_categories:
+                for name, color, hub_coords in [("Solapur Railway Station", "darkgreen", station_coords),
+                                                ("Solapur Central Bus Stand", "orange", bus_stand_coords)]:
+                    map_layer_defs.append(point_layer("scatter", name, [hub_coords[0]], [hub_coords[1]], color=color,
+                                                      radius=200, tooltip=[name]))
+
+            # University markers and connection lines
+            university_connections = {}
+            for uni_name, shown, color in [("DBATU", filter_dbat, "black"), ("Solapur University", filter_solapur_uni, "gray")]:
+                if not shown:
+                    continue
+                uni = universities[uni_name]
+                if show_colleges and show_college_connections:
+                    members = [c for c in target_colleges if c["university"] == uni_name]
+                    university_connections[uni_name] = line_layer(
+                        f"{uni_name} Connections", [[uni["coords"], [c["lat"], c["lon"]]] for c in members], "black",
+                        tooltip=[f"{uni_name}: {c['name']}" for c in members], weight=1.5, opacity=0.5
+                    )
+                    map_layer_defs.append(university_connections[uni_name])
+                map_layer_defs.append(point_layer("scatter", uni_name, [uni["coords"][0]], [uni["coords"][1]], color=color,
+                                                  radius=200, tooltip=[uni_name]))
+
+            # pydeck reports no bounds back, so viewport mode would never leave it; Auto stays on Leaflet there
+            renderer_preference = st.session_state.get("map_renderer", "Auto")
+            if viewport_mode and renderer_preference == "Auto":
+                renderer_preference = "Leaflet"
+            map_renderer = choose_renderer(map_layer_defs, renderer_preference)
+
+            if map_renderer == "folium":
+                if st.session_state.get("offline_tiles"):
+                    # Seed the whole map area in the background; tiles not cached yet are fetched on first view
+                    seed_tiles_async((sw[0], sw[1], ne[0], ne[1]))
+                    m = folium.Map(location=[17.6768, 75.9216], zoom_start=12, tiles=start_tile_server(), attr=TILE_ATTRIBUTION)
+                else:
+                    m = folium.Map(location=[17.6768, 75.9216], zoom_start=12)
+
+                # Every marker icon is defined once in a shared table; registering them all up front keeps
+                # the base map HTML unchanged when categories are toggled
+                icon_registry = IconRegistry().add_to(m)
+                for color, icon in [("darkblue", "graduation-cap"), ("darkgreen", "train"), ("orange", "bus"), ("black", "building"), ("gray", "building")]:
+                    icon_registry.register(color, icon)
+                for category_style in categories.values():
+                    icon_registry.register(category_style["color"], category_style["icon"])
+
+                # Add college markers if selected with improved clustering
+                if show_colleges:
+                    if server_clustered:
+                        cluster = FeatureGroup(name="Engineering Colleges")
+                        for c in college_clusters:
+                            if c["point"] < 0:
+                                cluster_bubble(c, "#2F80ED", "colleges").add_to(cluster)
+                    else:
+                        cluster = MarkerCluster(name="Engineering Colleges")
+                    college_popups = PopupTable(COLLEGE_POPUP_TEMPLATE, COLLEGE_POPUP_FIELDS).add_to(cluster) if lazy_popups else None
+                    for i in shown_colleges:
+                        college = target_colleges[i]
+                        college_coords = [college["lat"], college["lon"]]
+                        rail_distance, bus_distance = college_distances[i]
+                        if college_popups is not None:
+                            row = college_popups.add_row(
+                                name=college["name"],
+                                university=college["university"],
+                                established=college.get("established", "N/A"),
+                                rail=rail_distance,
+                                bus=bus_distance,
+                                courses=len(college.get("courses", [])),
+                                website=college["website"],
+                                image=college["image"]
+                            )
+                            marker = icon_registry.marker(college_coords, "darkblue", "graduation-cap", popup_table=college_popups, popup_row=row)
+                        else:
+                            popup_html = f"""
+                            <div style='width:250px; font-family:sans-serif;'>
+                                <h4 style='color:#2F80ED;'>{college['name']}</h4>
+                                <b>University:</b> {college['university']}<br>
+                                <b>Established:</b> {college.get('established', 'N/A')}<br>
+                                <b>Rail Dist:</b> {rail_distance} km<br>
+                                <b>Bus Dist:</b> {bus_distance} km<br>
+                                <b>Courses:</b> {len(college.get('courses', []))}<br>
+                                <a href="{college['website']}" target="_blank" style='color:#F2994A; font-weight:bold;'>Visit Website →</a>
+                                {'<br><img src="' + college['image'] + '" width="240" style="margin-top:10px; border-radius:8px;">' if college['image'] else ''}
+                            </div>
+                            """
+                            marker = icon_registry.marker(college_coords, "darkblue", "graduation-cap", popup=folium.Popup(popup_html, max_width=300))
+                        cluster.add_child(marker)
+
+                    for connections in hub_connections:
+                        add_to_folium(connections, m)
+
+                    if viewport_mode:
+                        viewport_layers.append(FeatureGroup(name="Engineering Colleges").add_child(cluster))
+                    else:
+                        m.add_child(cluster)
+
+                # Add selected category data
+                for category in selected_categories:
+                    if category == "Crime Data" and category in category_layers:
+                        crime = category_layers[category]
+                        crime_layer = FeatureGroup(name="Crime Heatmap") if viewport_mode else m
+                        if crime["vector_meta"] is not None:
+                            vector_url = f"{start_tile_server(kind='vtiles')}?v={crime['vector_meta']['version']}"
+                            m.add_child(VectorTileLayer(vector_url, "Crime Grid", crime["vector_meta"]["maxzoom"], severity_colors))
+                        if crime["heatmap"] is not None:
+                            add_to_folium(crime["heatmap"], crime_layer)
+                        if crime["hotspots"] is not None:
+                            m.add_child(add_to_folium(crime["hotspots"], FeatureGroup(name="Crime Hotspots")))
+                        if crime["risk"] is not None:
+                            add_to_folium(crime["risk"], crime_layer)
+                        if viewport_mode:
+                            viewport_layers.append(crime_layer)
+
+                    elif category == "Public Transport":
+                        # Add transport hubs only when checkbox is selected
+                        icon_registry.marker(station_coords, "darkgreen", "train", popup="Solapur Railway Station").add_to(m)
+                        icon_registry.marker(bus_stand_coords, "orange", "bus", popup="Solapur Central Bus Stand").add_to(m)
+
+                    elif category in category_layers:
+                        # Use FeatureGroup for other amenities for layer control
+                        fg = FeatureGroup(name=category)
+                        places = category_layers[category]
+                        for c in places["bubbles"]:
+                            cluster_bubble(c, categories[category]["color"], category.lower()).add_to(fg)
+                        place_layer = MarkerCluster(name=category).add_to(fg) if places["browser_clustered"] else fg
+
+                        place_popups = PopupTable(PLACE_POPUP_TEMPLATE, PLACE_POPUP_FIELDS).add_to(place_layer) if lazy_popups else None
+                        for college, p in places["rows"]:
+                            distance = round(geodesic((college["lat"], college["lon"]), (p["lat"], p["lon"])).km, 2) if places["include_details"] else None
+
+                            if place_popups is not None:
+                                row = place_popups.add_row(name=p["name"], fee=p["fee"], college=college["name"], distance=distance)
+                                icon_registry.marker([p["lat"], p["lon"]], p["color"], p["icon"], popup_table=place_popups, popup_row=row).add_to(place_layer)
+                                continue
+
                             popup_text = f"<b>{p['name']}</b><br>"
                             if p["fee"]:
                                  popup_text += f"Avg. Rent: ₹{p['fee']:,}/month<br>"
                             if distance is not None:
                                 popup_text += f"Distance to {college['name']}: {distance} km"
-                                
-                            folium.Marker(
-                                location=[p["lat"], p["lon"]],
-                                popup=popup_text,
-                                icon=folium.Icon(color=p["color"], icon=p["icon"], prefix="fa")
-                            ).add_to(fg)
-                    m.add_child(fg)
-
-            # Add university markers and connection lines
-            university_network_fg = FeatureGroup(name="University Network")
-
-            # Add DBATU marker and connections
-            if filter_dbat:
-                uni = universities["DBATU"]
-                popup_html = f"<b>DBATU</b><br><a href=\"{uni['website']}\" target=\"_blank\">Visit Website</a>"
-                folium.Marker(
-                    location=uni["coords"],
-                    popup=folium.Popup(popup_html, max_width=300),
-                    icon=folium.Icon(color="black", icon="building", prefix="fa")
-                ).add_to(university_network_fg)
-                
-                if show_colleges and show_college_connections:
-                    for college in target_colleges:
-                        if college["university"] == "DBATU":
-                            folium.PolyLine(
-                                locations=[uni["coords"], [college["lat"], college["lon"]]],
-                                color="black", weight=1.5, opacity=0.5
-                            ).add_to(university_network_fg)
-
-            # Add Solapur University marker and connections
-            if filter_solapur_uni:
-                uni = universities["Solapur University"]
-                popup_html = f"<b>Solapur University</b><br><a href=\"{uni['website']}\" target=\"_blank\">Visit Website</a>"
-                folium.Marker(
-                    location=uni["coords"],
-                    popup=folium.Popup(popup_html, max_width=300),
-                    icon=folium.Icon(color="gray", icon="building", prefix="fa")
-                ).add_to(university_network_fg)
-
-                if show_colleges and show_college_connections:
-                    for college in target_colleges:
-                        if college["university"] == "Solapur University":
-                            folium.PolyLine(
-                                locations=[uni["coords"], [college["lat"], college["lon"]]],
-                                color="black", weight=1.5, opacity=0.5
-                            ).add_to(university_network_fg)
-
-            m.add_child(university_network_fg)
 
-            LayerControl(collapsed=True).add_to(m)
-            m.fit_bounds([sw, ne])
+                            icon_registry.marker([p["lat"], p["lon"]], p["color"], p["icon"], popup=popup_text).add_to(place_layer)
+                        if viewport_mode:
+                            viewport_layers.append(fg)
+                        else:
+                            m.add_child(fg)
+
+                # Add university markers and connection lines
+                university_network_fg = FeatureGroup(name="University Network")
+                for uni_name, shown, color in [("DBATU", filter_dbat, "black"), ("Solapur University", filter_solapur_uni, "gray")]:
+                    if shown:
+                        uni = universities[uni_name]
+                        popup_html = f"<b>{uni_name}</b><br><a href=\"{uni['website']}\" target=\"_blank\">Visit Website</a>"
+                        icon_registry.marker(uni["coords"], color, "building",
+                                             popup=folium.Popup(popup_html, max_width=300)).add_to(university_network_fg)
+                        if uni_name in university_connections:
+                            add_to_folium(university_connections[uni_name], university_network_fg)
+                m.add_child(university_network_fg)
+
+                layer_control = LayerControl(collapsed=True)
+                m.fit_bounds([sw, ne])
+                if viewport_mode:
+                    map_options = {"returned_objects": ["bounds", "zoom"], "key": "main_map",
+                                   "feature_group_to_add": viewport_layers, "layer_control": layer_control}
+                else:
+                    layer_control.add_to(m)
+                    map_options = {"returned_objects": []}
+            map_build.finish()
             
             # --- Dynamic Layout Rendering: Map and Details ---
             
@@ -2239,21 +3000,38 @@ else:
                     st.markdown("---")
                     
                     # Calculate and display distances using metrics
-                    college_coords = [selected_college["lat"], selected_college["lon"]]
-                    rail_distance = round(geodesic(station_coords, college_coords).km, 2)
-                    bus_distance = round(geodesic(bus_stand_coords, college_coords).km, 2)
+                    rail_distance, bus_distance = hub_distances([selected_college])[0]
 
                     st.metric(label="🚉 Rail Station Distance", value=f"{rail_distance} km")
                     st.metric(label="🚌 Bus Stand Distance", value=f"{bus_distance} km")
 
+                    safety_scores = get_safety_scores()
+                    if safety_scores:
+                        safety = safety_scores[selected_college["name"]]
+                        st.metric(label="🛡️ Safety Score", value=f"{safety['score']}/100")
+                        radius = SAFETY_RADII_KM[len(SAFETY_RADII_KM) // 2]
+                        st.caption(f"{safety['risk_level']} risk • {safety['densities'][radius]} incidents/km² within {radius} km")
+
                     st.markdown("</div>", unsafe_allow_html=True)
 
                 with map_col:
-                    st_folium(m, height=800, width='100%', returned_objects=[], center=None)
+                    with span(f"map.render.{map_renderer}"):
+                        if map_renderer == "pydeck":
+                            st.pydeck_chart(to_deck(map_layer_defs, [17.6768, 75.9216], map_zoom), height=800)
+                        else:
+                            st_folium(m, height=800, width='100%', center=None, **map_options)
+                    commute_planner(selected_college)
                     
             else:
                 # Full width for the map when multiple or no colleges are selected
-                st_folium(m, height=800, width='100%', returned_objects=[], center=None)
+                with span(f"map.render.{map_renderer}"):
+                    if map_renderer == "pydeck":
+                        st.pydeck_chart(to_deck(map_layer_defs, [17.6768, 75.9216], map_zoom), height=800)
+                    else:
+                        st_folium(m, height=800, width='100%', center=None, **map_options)
+
+            with st.expander("🏠 Lodging Safety Check"):
+                lodging_safety_check(target_colleges)
         
         # Tab 2: College Comparison
         with tab2:
@@ -2265,4 +3043,14 @@ else:
         
         # Tab 4: Analytics
         with tab4:
-            show_analytics()
\ No newline at end of file
+            show_analytics()
+
+        # Tab 5: Admin status, for admins only
+        if show_admin:
+            with tabs[4]:
+                show_admin_panel()
+
+with span("memory.account"):
+    account_session(st.session_state.session_id, st.session_state.username, st.session_state.to_dict)
+
+finish_trace(page=st.session_state.page if st.session_state.authenticated else "login")
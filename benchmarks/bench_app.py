@@ -0,0 +1,455 @@
+"""Benchmark the app's hot paths at synthetic scales, end to end.
+
+Builds a work directory with a user store of --users users, a crime store
+of --incidents incidents and a POI catalogue of --places places. Then, for
+each college count in --colleges, drives app.py headlessly with Streamlit's
+AppTest through these steps:
+
+- default: the map page with no college selected (analytics renders on
+  every run);
+- login: a login form submit (verify_user, which loads and saves the
+  user store);
+- all_colleges: the "All Colleges" map;
+- college: one college with every place category and the crime layer
+  shown (record_college_visit, generate_places, the commute planner and
+  lodging check);
+- comparison: three colleges in the comparison tab.
+
+Each scale runs in a fresh process in the work directory, with the
+synthetic colleges passed in SAFEMAP_COLLEGES_FILE and an empty shared
+cache. The crime layers and first scheduler runs are finished before
+anything is timed. Every step is run --repeats times. The first run after
+the change is reported as cold and the rest as warm. Timings come from the
+app's own tracing spans: map.build, map.render.*, user_store.*, view.* and
+the traced helpers. Next to them are the bytes sent for st_folium maps,
+iframes, decks and figures. The visit flushes the scheduler ran during the
+scale are reported as user_store.flush_visits.
+
+Results are written as JSON, tagged with the git commit. --compare takes
+an earlier results file and exits non-zero if any warm span or run is
+slower by more than --threshold times. Run from the repository root:
+
+    python benchmarks/bench_app.py [--colleges 10 1000 100000] [--users 10000]
+        [--incidents 1000000] [--places 1000000] [--output bench_app.json]
+        [--compare previous.json]
+
+Building the 1M-row stores takes several minutes. Pass --workdir to keep
+them between runs, so commits are compared on the same data.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import streamlit
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP_PATH = os.path.join(ROOT, "app.py")
+CENTER = (17.6768, 75.9216)
+PASSWORD = "benchmark"
+COLLEGE_SELECTOR = "Choose College:"
+COMPARISON_SELECTOR = "Select colleges to compare:"
+SETTLE_TIMEOUT = 1800
+
+# Proto field holding what each element sends to the browser
+PAYLOAD_FIELDS = {
+    "component_instance": "json_args",
+    "iframe": "srcdoc",
+    "deck_gl_json_chart": "json",
+    "plotly_chart": "spec"
+}
+
+
+# --- Synthetic Data ---
+
+def synthetic_colleges(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "name": f"Synthetic College {i}",
+            "lat": CENTER[0] + rng.gauss(0, 0.03),
+            "lon": CENTER[1] + rng.gauss(0, 0.03),
+            "image": "",
+            "website": "",
+            "university": rng.choice(["DBATU", "Solapur University"]),
+            "established": rng.randint(1960, 2015),
+            "courses": ["Computer Science & Engineering", "Mechanical Engineering", "Civil Engineering"],
+            "fees_range": "₹1.5 L – ₹4 L",
+            "facilities": ["Hostel", "Library", "Cafeteria"],
+            "contact": "",
+            "address": f"{i} College Road, Solapur",
+            "campus_size": f"{rng.randint(5, 50)} acres"
+        }
+        for i in range(n)
+    ]
+
+
+def synthetic_users(n, colleges=20):
+    """User records in the app's format, each with a few visits"""
+    password = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    return {
+        f"user{i}": {
+            "password": password,
+            "email": f"user{i}@example.com",
+            "registration_date": "2025-06-01 10:00:00",
+            "last_login": "2025-06-02 10:00:00",
+            "login_count": 1,
+            "visited_colleges": [
+                {"college_name": f"Synthetic College {(i + j) % colleges}", "visit_time": "2025-06-02 10:05:00"}
+                for j in range(3)
+            ]
+        }
+        for i in range(n)
+    }
+
+
+def build_stores(workdir, users, incidents, places):
+    """Write the user store, crime store and POI catalogue once per work directory"""
+    import crime_cube
+    import crime_data
+    import poi_data
+
+    marker = os.path.join(workdir, "stores.json")
+    config = {"users": users, "incidents": incidents, "places": places}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == config:
+                return
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    link = os.path.join(workdir, "images")
+    if not os.path.exists(link):
+        os.symlink(os.path.join(ROOT, "images"), link)
+
+    started = time.perf_counter()
+    with open(os.path.join(workdir, "users.json"), "w") as f:
+        json.dump(synthetic_users(users), f, indent=4)
+
+    # The modules' default paths are relative to the data directory in the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+            csv_path = os.path.join(tmp, "incidents.csv")
+            crime_data.generate_synthetic_incidents(csv_path, incidents)
+            crime_data.ingest_incidents(csv_path, append=False)
+            crime_cube.load_cube()
+            extract = os.path.join(tmp, "city.osm")
+            poi_data.generate_synthetic_osm(extract, places, untagged_per_poi=2)
+            poi_data.ingest_pois(extract)
+    finally:
+        os.chdir(cwd)
+    with open(marker, "w") as f:
+        json.dump(config, f)
+    print(f"Built stores in {time.perf_counter() - started:.0f}s")
+
+
+# --- One Scale (in its own process) ---
+
+def payload_bytes(at):
+    """Bytes each kind of element sends to the browser, over the whole page"""
+    sizes = {}
+    stack = [at._tree]
+    while stack:
+        node = stack.pop()
+        stack.extend(getattr(node, "children", {}).values())
+        field = PAYLOAD_FIELDS.get(getattr(node, "type", None))
+        if field:
+            sizes[node.type] = sizes.get(node.type, 0) + len(getattr(node.proto, field).encode("utf-8"))
+    return sizes
+
+
+def new_traces(seen):
+    from tracing import recent_traces
+
+    traces = [t for t in reversed(recent_traces()) if t["id"] not in seen]
+    seen.update(t["id"] for t in traces)
+    return traces
+
+
+def span_totals(traces):
+    """Milliseconds and calls per span name over a run's traces (a login's rerun adds a second trace)"""
+    totals = {"run": {"ms": sum(t["ms"] for t in traces), "calls": len(traces)}}
+    for trace in traces:
+        for s in trace["spans"]:
+            total = totals.setdefault(s["name"], {"ms": 0.0, "calls": 0})
+            total["ms"] += s["ms"]
+            total["calls"] += 1
+    return totals
+
+
+def summarise(runs):
+    """Cold (first run) and warm (median of the rest) milliseconds per span"""
+    names = sorted({name for run in runs for name in run})
+    result = {}
+    for name in names:
+        cold = runs[0].get(name)
+        warm = sorted(run[name]["ms"] for run in runs[1:] if name in run)
+        result[name] = {
+            "cold_ms": round(cold["ms"], 2) if cold else None,
+            "warm_ms": round(warm[len(warm) // 2], 2) if warm else None,
+            "calls": cold["calls"] if cold else runs[-1][name]["calls"]
+        }
+    return result
+
+
+def session(timeout, authenticated=True):
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    if authenticated:
+        at.session_state["authenticated"] = True
+        at.session_state["username"] = "user1"
+        at.session_state["page"] = "map"
+    return at
+
+
+def run_step(name, setup, repeats, timeout, seen):
+    """Time a step: setup(at) changes the page, then it is rerun repeats - 1 more times"""
+    runs = []
+    at = None
+    for i in range(repeats):
+        if at is None or name == "login":
+            at = session(timeout, authenticated=name != "login")
+            at.run()
+            new_traces(seen)
+        if i == 0 or name == "login":
+            setup(at)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        runs.append(span_totals(new_traces(seen)))
+    return {"spans": summarise(runs), "payload_bytes": payload_bytes(at)}
+
+
+def select(elements, label, value):
+    next(e for e in elements if e.label == label).set_value(value)
+
+
+def login(at):
+    at.text_input(key="login_username").input("user1")
+    at.text_input(key="login_password").input(PASSWORD)
+    next(b for b in at.button if b.label == "🚀 Login").click()
+
+
+def show_everything(at):
+    select(at.sidebar.selectbox, COLLEGE_SELECTOR, "Synthetic College 1")
+    for checkbox in at.sidebar.checkbox:
+        if checkbox.label.startswith("Show "):
+            checkbox.check()
+
+
+def settle(timeout=SETTLE_TIMEOUT):
+    """Wait for the crime layers and the scheduler's first runs, so they do not compete with the timings
+
+    Returns the error of a crime layer build that failed, such as a worker
+    running out of memory; the steps are still timed without that layer.
+    """
+    import scheduler
+    import warmup
+
+    try:
+        warmup.wait_for_crime_layers(timeout)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        now = time.time()
+        if all(job["running"] == 0 and job["next_run"] > now for job in scheduler.job_status()):
+            break
+        time.sleep(1.0)
+    return error
+
+
+def run_scale(workdir, colleges, repeats, run_timeout, results):
+    """Entry point of a scale's process; puts its results on the results queue"""
+    colleges_file = os.path.join(workdir, f"colleges-{colleges}.json")
+    with open(colleges_file, "w") as f:
+        json.dump(synthetic_colleges(colleges), f)
+    os.environ["SAFEMAP_COLLEGES_FILE"] = colleges_file
+    os.environ["SAFEMAP_METRICS_PORT"] = "0"
+    os.chdir(workdir)
+    shutil.copy("users.json", "user_data.json")
+    for name in os.listdir("data"):
+        if name.startswith("shared_cache.sqlite"):
+            os.remove(os.path.join("data", name))
+
+    from tracing import summaries
+
+    seen = set()
+    scale = {"colleges": colleges, "steps": {}}
+    try:
+        # Imports, first-run setup and the background builds are not timed
+        at = session(run_timeout)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        settle_error = settle()
+        if settle_error:
+            scale["settle_error"] = settle_error
+        new_traces(seen)
+
+        steps = [
+            ("default", lambda at: None),
+            ("login", login),
+            ("all_colleges", lambda at: select(at.sidebar.selectbox, COLLEGE_SELECTOR, "All Colleges")),
+            ("college", show_everything),
+            ("comparison", lambda at: select(at.multiselect, COMPARISON_SELECTOR,
+                                             [f"Synthetic College {i}" for i in range(min(3, colleges))]))
+        ]
+        for name, setup in steps:
+            started = time.perf_counter()
+            try:
+                scale["steps"][name] = run_step(name, setup, repeats, run_timeout, seen)
+            except Exception as e:
+                scale["steps"][name] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"{colleges:>8} colleges  {name:<14} {time.perf_counter() - started:>7.1f}s", flush=True)
+        flushes = summaries().get("user_store.flush_visits")
+        if flushes:
+            scale["background"] = {"user_store.flush_visits": flushes}
+    except Exception as e:
+        scale["error"] = f"{type(e).__name__}: {e}"
+    results.put(scale)
+    # The app's background build pools would outlive this process
+    for child in multiprocessing.active_children():
+        child.terminate()
+
+
+def measure_scale(workdir, colleges, repeats, run_timeout, scale_timeout):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=run_scale, args=(workdir, colleges, repeats, run_timeout, results))
+    proc.start()
+    try:
+        scale = results.get(timeout=scale_timeout)
+    except queue.Empty:
+        scale = {"colleges": colleges, "error": f"no result within {scale_timeout}s"}
+    # Script threads of a timed-out run may still be going; they die with the process
+    proc.join(10)
+    if proc.is_alive():
+        proc.terminate()
+    return scale
+
+
+# --- Results ---
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_scale(scale):
+    if "error" in scale:
+        print(f"{scale['colleges']:>8} colleges  FAILED: {scale['error']}")
+    if "settle_error" in scale:
+        print(f"{scale['colleges']:>8} colleges  crime layers failed to build: {scale['settle_error']}")
+    for step, result in scale.get("steps", {}).items():
+        if "error" in result:
+            print(f"{scale['colleges']:>8} {step:<14} FAILED: {result['error']}")
+            continue
+        spans = result["spans"]
+        shown = ["run"] + sorted((n for n in spans if n != "run"), key=lambda n: -(spans[n]["warm_ms"] or spans[n]["cold_ms"] or 0))[:6]
+        for name in shown:
+            s = spans[name]
+            cold = f"{s['cold_ms']:.1f}" if s["cold_ms"] is not None else "-"
+            warm = f"{s['warm_ms']:.1f}" if s["warm_ms"] is not None else "-"
+            print(f"{scale['colleges']:>8} {step:<14} {name:<28} {cold:>10} {warm:>10} {s['calls']:>6}")
+        for kind, size in sorted(result["payload_bytes"].items()):
+            print(f"{scale['colleges']:>8} {step:<14} {'bytes: ' + kind:<28} {size:>21,}")
+
+
+def compare(previous, current, threshold):
+    """Warm spans and runs slower than threshold times the previous results"""
+    regressions = []
+    old_scales = {str(s["colleges"]): s for s in previous["scales"]}
+    for scale in current["scales"]:
+        old = old_scales.get(str(scale["colleges"]))
+        if old is None:
+            continue
+        for step, result in scale.get("steps", {}).items():
+            old_spans = old.get("steps", {}).get(step, {}).get("spans", {})
+            for name, s in result.get("spans", {}).items():
+                before, after = old_spans.get(name, {}).get("warm_ms"), s["warm_ms"]
+                # Sub-millisecond spans are noise
+                if before and after and max(before, after) >= 1.0 and after > threshold * before:
+                    regressions.append(f"{scale['colleges']} colleges, {step}, {name}: {before:.1f} -> {after:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--colleges", type=int, nargs="+", default=[10, 1000, 100_000])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--incidents", type=int, default=1_000_000)
+    parser.add_argument("--places", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=5, help="runs per step; the first is cold")
+    parser.add_argument("--run-timeout", type=float, default=900, help="seconds allowed for one app run")
+    parser.add_argument("--scale-timeout", type=float, default=7200, help="seconds allowed for one scale")
+    parser.add_argument("--workdir", help="keep the synthetic stores here between runs")
+    parser.add_argument("--output", default="bench_app.json")
+    parser.add_argument("--compare", help="earlier results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.5, help="slowdown ratio counted as a regression")
+    args = parser.parse_args()
+    if args.repeats < 2:
+        parser.error("--repeats must be at least 2 (one cold run, then warm runs)")
+
+    tmp = None
+    workdir = args.workdir
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = tmp.name
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    commit, dirty = git_commit()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "config": {"users": args.users, "incidents": args.incidents, "places": args.places, "repeats": args.repeats},
+        "scales": []
+    }
+    try:
+        build_stores(workdir, args.users, args.incidents, args.places)
+        for colleges in args.colleges:
+            results["scales"].append(measure_scale(workdir, colleges, args.repeats, args.run_timeout, args.scale_timeout))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"{'colleges':>8} {'step':<14} {'span':<28} {'cold ms':>10} {'warm ms':>10} {'calls':>6}")
+    for scale in results["scales"]:
+        print_scale(scale)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(previous, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark the crime heatmap layer at 1M incidents.
+
+Builds a synthetic incident file, ingests it into a temporary crime store and
+times heatmap aggregation per zoom level. The payload sent to the browser is
+reported next to the incident count to show it tracks cells, not incidents.
+
+Run from the repository root:
+
+    python benchmarks/bench_crime_heatmap.py [--rows 1000000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import folium
+from folium.plugins import HeatMap
+
+import crime_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        incidents = os.path.join(tmp, "incidents.csv")
+        store_paths = {
+            "store_path": os.path.join(tmp, "crime_store.npy"),
+            "meta_path": os.path.join(tmp, "crime_store.json"),
+            "seen_path": os.path.join(tmp, "crime_seen.npy")
+        }
+
+        started = time.perf_counter()
+        crime_data.generate_synthetic_incidents(incidents, args.rows)
+        print(f"synthetic data: {args.rows:,} rows in {time.perf_counter() - started:.2f}s")
+
+        report = crime_data.ingest_incidents(incidents, **store_paths)
+        print(f"ingest: {report['rows_valid']:,} incidents -> {report['bins']:,} bins in {report['seconds']:.2f}s")
+
+        store = crime_data.load_crime_store(store_paths["store_path"], store_paths["meta_path"])
+        bounds = (17.55, 75.75, 17.80, 76.05)
+        print(f"\n{'zoom':>4} {'level':>5} {'cells':>8} {'payload':>10} {'html':>10} {'cold ms':>8} {'warm ms':>8}")
+        for zoom in range(10, 17):
+            crime_data._heatmap_cache.clear()
+            started = time.perf_counter()
+            points = crime_data.heatmap_points(store, zoom, bounds=bounds)
+            cold = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            crime_data.heatmap_points(store, zoom, bounds=bounds)
+            warm = (time.perf_counter() - started) * 1000
+
+            m = folium.Map(location=[17.6768, 75.9216], zoom_start=zoom)
+            HeatMap(points).add_to(m)
+            html_size = len(m.get_root().render())
+            payload = len(json.dumps(points))
+            level = crime_data.heatmap_level_for_zoom(zoom)
+            print(f"{zoom:>4} {level:>5} {len(points):>8,} {payload:>10,} {html_size:>10,} {cold:>8.1f} {warm:>8.2f}")
+
+        naive = len(json.dumps([[17.12345, 75.12345, 1]])) * report["incidents"]
+        print(f"\none point per incident would be ~{naive:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Compare the folium (Leaflet) and pydeck (WebGL) map renderers.
+
+Builds the same synthetic point layers at each size and times turning them
+into what Streamlit ships to the browser: the folium map HTML, or the pydeck
+deck JSON. Payload size is reported next to the time, since the browser has
+to parse and draw all of it. Leaflet scatter layers create one DOM element
+per point, so by default they are only built up to --max-folium-scatter.
+
+Run from the repository root:
+
+    python benchmarks/bench_map_renderers.py [--sizes 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import folium
+import numpy as np
+
+import map_layers
+
+CENTER = (17.6768, 75.9216)
+
+
+def synthetic_points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = CENTER[0] + rng.normal(0, 0.03, n)
+    lon = CENTER[1] + rng.normal(0, 0.03, n)
+    return lat, lon, rng.uniform(0, 1, n)
+
+
+def time_folium(layer):
+    started = time.perf_counter()
+    m = folium.Map(location=CENTER, zoom_start=12)
+    map_layers.add_to_folium(layer, m)
+    html = m.get_root().render()
+    return time.perf_counter() - started, len(html)
+
+
+def time_pydeck(layer):
+    started = time.perf_counter()
+    spec = map_layers.to_deck([layer], CENTER, 12).to_json()
+    return time.perf_counter() - started, len(spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--max-folium-scatter", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'layer':>8} {'renderer':>8} {'seconds':>8} {'payload':>14}")
+    for n in args.sizes:
+        lat, lon, weight = synthetic_points(n)
+        layers = {
+            "scatter": map_layers.point_layer("scatter", "Points", lat, lon, weight),
+            "heatmap": map_layers.point_layer("heatmap", "Heat", lat, lon, weight),
+            "hexagon": map_layers.point_layer("hexagon", "Hexagons", lat, lon, weight)
+        }
+        for kind, layer in layers.items():
+            rows = [("pydeck", time_pydeck(layer))]
+            # Leaflet has no hexagon layer, and a million DOM markers is not a usable map
+            if kind == "heatmap" or (kind == "scatter" and n <= args.max_folium_scatter):
+                rows.insert(0, ("folium", time_folium(layer)))
+            for renderer, (seconds, size) in rows:
+                print(f"{n:>10,} {kind:>8} {renderer:>8} {seconds:>8.2f} {size:>14,}")
+
+    print(f"\nmap_layers chooses pydeck automatically above {map_layers.WEBGL_POINT_THRESHOLD:,} Leaflet markers after clustering")
+
+
+if __name__ == "__main__":
+    main()
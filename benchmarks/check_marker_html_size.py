@@ -0,0 +1,76 @@
+"""Check that shared marker icons keep the map HTML from growing with every icon.
+
+Renders maps with increasing numbers of markers spread over a dozen
+icon/colour combinations, once with a folium.Icon per marker and once with
+map_layers.IconRegistry. Exits non-zero if, with the registry:
+
+- the number of icon definitions grows with the marker count, or
+- each extra marker adds more than 70% of the bytes a folium.Icon
+  marker adds.
+
+Marker positions still grow the HTML linearly; it is the icon part that
+must stay constant.
+
+Run from the repository root:
+
+    python benchmarks/check_marker_html_size.py [--sizes 100 1000 5000]
+"""
+import argparse
+import os
+import sys
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import folium
+
+import map_layers
+
+ICONS = [(color, icon) for color in ("blue", "purple", "orange", "green")
+         for icon in ("building", "coffee", "cutlery")]
+
+
+def render(n, shared):
+    m = folium.Map(location=[17.6768, 75.9216], zoom_start=12)
+    registry = map_layers.IconRegistry().add_to(m)
+    for i in range(n):
+        color, icon = ICONS[i % len(ICONS)]
+        location = [17.6 + (i % 100) * 0.001, 75.9 + (i // 100) * 0.001]
+        if shared:
+            registry.marker(location, color, icon).add_to(m)
+        else:
+            folium.Marker(location, icon=folium.Icon(color=color, icon=icon, prefix="fa")).add_to(m)
+    return m.get_root().render()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args()
+    warnings.simplefilter("ignore")
+
+    print(f"{'markers':>8} {'folium.Icon':>12} {'registry':>12} {'icon defs':>10}")
+    results = {}
+    for n in args.sizes:
+        baseline, shared = render(n, False), render(n, True)
+        icon_defs = shared.count("L.AwesomeMarkers.icon(")
+        results[n] = (len(baseline), len(shared), icon_defs)
+        print(f"{n:>8,} {len(baseline):>12,} {len(shared):>12,} {icon_defs:>10}")
+
+    failures = []
+    if len({defs for _, _, defs in results.values()}) != 1:
+        failures.append("icon definitions grow with marker count")
+    small, large = min(results), max(results)
+    baseline_per_marker = (results[large][0] - results[small][0]) / (large - small)
+    shared_per_marker = (results[large][1] - results[small][1]) / (large - small)
+    print(f"\nbytes per extra marker: folium.Icon {baseline_per_marker:.0f}, registry {shared_per_marker:.0f}")
+    if shared_per_marker > 0.7 * baseline_per_marker:
+        failures.append("registry markers are not clearly smaller than folium.Icon markers")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Check the Prometheus metrics endpoint against a headless run of the app.
+
+Drives app.py with Streamlit's AppTest (in this process, so its metrics
+server starts here on a free port): one failed login, then reruns of the
+map page as a signed-in user. Then scrapes /metrics over HTTP, as
+Prometheus or `curl -s localhost:9108/metrics` would, and checks that:
+
+- every line parses as the text exposition format;
+- map reruns, the failed login, map build and user store timings and
+  shared cache lookups were counted;
+- each histogram's +Inf bucket matches its count, and buckets never
+  decrease;
+- at least one session is active.
+
+Prints the scraped metric families and exits non-zero on any failure.
+Run from the repository root:
+
+    python benchmarks/check_metrics.py
+"""
+import os
+import re
+import socket
+import sys
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Read by metrics.py at import, which happens when the app first runs
+PORT = free_port()
+os.environ["SAFEMAP_METRICS_HOST"] = "127.0.0.1"
+os.environ["SAFEMAP_METRICS_PORT"] = str(PORT)
+
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(ROOT, "app.py")
+MAP_RERUNS = 3
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+
+def run_app():
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    at.run()
+    at.text_input(key="login_username").input("no_such_user")
+    at.text_input(key="login_password").input("wrong")
+    next(b for b in at.button if b.label == "🚀 Login").click()
+    at.run()
+
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    at.session_state["authenticated"] = True
+    at.session_state["username"] = "metrics_check"
+    at.session_state["page"] = "map"
+    for _ in range(MAP_RERUNS):
+        at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+
+def parse(text):
+    """{(name, labels string): value} and a list of unparsable lines"""
+    samples, bad = {}, []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = SAMPLE_LINE.match(line)
+        if match is None:
+            bad.append(line)
+            continue
+        samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples, bad
+
+
+def total(samples, name, label=""):
+    return sum(value for (n, labels), value in samples.items() if n == name and label in labels)
+
+
+def main():
+    run_app()
+    with urllib.request.urlopen(f"http://127.0.0.1:{PORT}/metrics", timeout=5) as response:
+        content_type = response.headers["Content-Type"]
+        text = response.read().decode("utf-8")
+    samples, bad = parse(text)
+
+    failures = [f"unparsable line: {line}" for line in bad]
+    if not content_type.startswith("text/plain"):
+        failures.append(f"content type is {content_type}")
+    if total(samples, "safemap_reruns_total", 'page="map"') < MAP_RERUNS:
+        failures.append("map reruns were not counted")
+    if total(samples, "safemap_login_attempts_total", 'result="failure"') != 1:
+        failures.append("the failed login was not counted once")
+    for name in ("safemap_rerun_seconds", "safemap_map_build_seconds", "safemap_user_store_seconds"):
+        if total(samples, f"{name}_count") == 0:
+            failures.append(f"{name} has no samples")
+    if total(samples, "safemap_cache_requests_total") == 0:
+        failures.append("no shared cache lookups were counted")
+    if total(samples, "safemap_active_sessions") < 1:
+        failures.append("no active sessions")
+
+    # Histogram consistency, per series
+    series = {}
+    for (name, labels), value in samples.items():
+        if name.endswith("_bucket"):
+            base = re.sub(r',?le="[^"]*"', "", labels).replace("{}", "")
+            le = re.search(r'le="([^"]*)"', labels).group(1)
+            series.setdefault((name[:-7], base), []).append((float(le), value))
+    for (name, labels), buckets in series.items():
+        counts = [count for _, count in sorted(buckets)]
+        if counts != sorted(counts):
+            failures.append(f"{name}{labels} buckets decrease")
+        if counts[-1] != samples.get((f"{name}_count", labels)):
+            failures.append(f"{name}{labels} +Inf bucket does not match its count")
+
+    for line in text.splitlines():
+        if line.startswith("# TYPE"):
+            name = line.split()[2]
+            print(f"{name:<32} {line.split()[3]:<10} {total(samples, name) + total(samples, f'{name}_count'):>8.0f}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
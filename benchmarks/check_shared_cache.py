@@ -0,0 +1,117 @@
+"""Check the shared cache backends: sharing, expiry, eviction and hit rates.
+
+Runs the same checks against the SQLite backend (in a temporary file) and
+the Redis-protocol backend (against the local stand-in server):
+
+- a value computed in one process is a hit in another;
+- an entry is recomputed once its TTL has passed;
+- filling the cache past its size limit evicts the least recently used
+  entries and keeps recently read ones;
+- hits and misses are reported per namespace.
+
+Prints lookup latencies and exits non-zero on any failure. Run from the
+repository root:
+
+    python benchmarks/check_shared_cache.py [--redis-url redis://host:port/0]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shared_cache
+
+VALUE_BYTES = 10_000
+MAX_BYTES = 200_000
+
+
+def compute_in_child(url, key):
+    """Look a key up in a fresh process; returns whether the value had to be computed"""
+    shared_cache.set_backend(shared_cache.open_backend(url))
+    computed = []
+    shared_cache.cached("check", key, lambda: computed.append(1) or "from child")
+    shared_cache.flush_counters()
+    return bool(computed)
+
+
+def run_checks(url, backend):
+    failures = []
+    shared_cache.set_backend(backend)
+    backend.clear()
+    spawn = multiprocessing.get_context("spawn")
+
+    # Shared between processes
+    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+        if not pool.submit(compute_in_child, url, "shared").result():
+            failures.append("first lookup in a new process was not a miss")
+    value = shared_cache.cached("check", "shared", lambda: "from parent")
+    if value != "from child":
+        failures.append(f"value computed in another process was not shared (got {value!r})")
+
+    # Expiry
+    shared_cache.cached("check", "short", lambda: 1, ttl=1)
+    time.sleep(1.2)
+    if shared_cache.cached("check", "short", lambda: 2, ttl=1) != 2:
+        failures.append("entry was still served after its TTL")
+
+    # Eviction: touch the first entry throughout, so it stays recently used
+    payload = b"x" * VALUE_BYTES
+    for i in range(3 * MAX_BYTES // VALUE_BYTES):
+        shared_cache.cached("evict", i, lambda: payload)
+        shared_cache.cached("evict", 0, lambda: payload)
+    entries, size = backend.size()
+    if backend.name == "sqlite" and size > MAX_BYTES:
+        failures.append(f"cache holds {size:,} bytes, over its {MAX_BYTES:,} byte limit")
+    if entries > MAX_BYTES // VALUE_BYTES + 2:
+        failures.append(f"{entries} entries kept, expected at most {MAX_BYTES // VALUE_BYTES + 2}")
+    recomputed = []
+    shared_cache.cached("evict", 0, lambda: recomputed.append(0) or payload)
+    shared_cache.cached("evict", 1, lambda: recomputed.append(1) or payload)
+    if recomputed != [1]:
+        failures.append(f"eviction was not least recently used first (recomputed {recomputed})")
+
+    # Latency of a hit
+    shared_cache.cached("latency", "value", lambda: {"score": 50.0, "coords": list(range(100))})
+    lookups = 1000
+    started = time.perf_counter()
+    for _ in range(lookups):
+        shared_cache.cached("latency", "value", lambda: None)
+    hit_ms = (time.perf_counter() - started) * 1000 / lookups
+
+    stats = shared_cache.cache_stats()
+    check = stats["namespaces"].get("check", {})
+    if (check.get("hits"), check.get("misses")) != (1, 3):
+        failures.append(f"check namespace counted {check.get('hits')} hits and {check.get('misses')} misses, expected 1 and 3")
+    print(f"{backend.name:>7} {entries:>8} {size:>12,} {stats['evictions']:>10} {stats['hit_rate']:>9.1%} {hit_ms:>8.3f}")
+    return [f"{backend.name}: {failure}" for failure in failures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--redis-url", help="check a real Redis-protocol server instead of the local stand-in")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'backend':>7} {'entries':>8} {'bytes':>12} {'evictions':>10} {'hit rate':>9} {'hit ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite")
+        failures += run_checks(f"sqlite://{path}", shared_cache.SQLiteBackend(path, MAX_BYTES))
+
+    redis_url = args.redis_url
+    if redis_url is None:
+        server = shared_cache.start_resp_server(port=0, max_bytes=MAX_BYTES)
+        redis_url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    failures += run_checks(redis_url, shared_cache.open_backend(redis_url))
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
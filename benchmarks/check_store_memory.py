@@ -0,0 +1,103 @@
+"""Check that the memory-mapped stores keep worker heap memory flat.
+
+Builds a synthetic crime store and POI store, then, in a fresh process per
+measurement, opens each store and reads every column while tracking the
+process's private (anonymous) memory. Memory-mapped columns stay in the
+page cache that all worker processes share, so the growth must stay far
+below the store size. Loading the same file into the heap is shown for
+comparison. Exits non-zero if a memory-mapped store grows private memory
+by more than 10% of its size (or 5 MB, whichever is larger).
+
+Linux only (reads /proc/self/status). Run from the repository root:
+
+    python benchmarks/check_store_memory.py [--incidents 1000000] [--pois 50000]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import crime_data
+import poi_data
+
+
+def rss_mb():
+    """Private (anonymous) and file-backed resident memory of this process, in MB"""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("RssAnon", "RssFile"):
+                fields[name] = int(value.split()[0]) / 1024
+    return fields["RssAnon"], fields["RssFile"]
+
+
+def read_store(kind, paths, mapped):
+    """Open a store and touch every column; returns the growth in private and file-backed memory"""
+    anon_before, file_before = rss_mb()
+    if not mapped:
+        table = np.load(paths["store_path"])
+        columns = {name: table[name] for name in table.dtype.names}
+    elif kind == "crime":
+        columns = crime_data.load_crime_store(paths["store_path"], paths["meta_path"])
+    else:
+        columns = poi_data.load_poi_store(paths["store_path"], paths["meta_path"], paths["names_path"])
+    checksum = sum(float(np.sum(columns[name], dtype=np.float64)) for name in columns if name != "meta")
+    anon_after, file_after = rss_mb()
+    return anon_after - anon_before, file_after - file_before, checksum
+
+
+def measure(kind, paths, mapped):
+    # A fresh process each time, so nothing is already resident
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(read_store, kind, paths, mapped).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--incidents", type=int, default=1_000_000)
+    parser.add_argument("--pois", type=int, default=50_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        crime_paths = {
+            "store_path": os.path.join(tmp, "crime_store.npy"),
+            "meta_path": os.path.join(tmp, "crime_store.json"),
+            "seen_path": os.path.join(tmp, "crime_seen.npy")
+        }
+        incidents = os.path.join(tmp, "incidents.csv")
+        crime_data.generate_synthetic_incidents(incidents, args.incidents)
+        crime_data.ingest_incidents(incidents, append=False, **crime_paths)
+
+        poi_paths = {
+            "store_path": os.path.join(tmp, "poi_store.npy"),
+            "meta_path": os.path.join(tmp, "poi_store.json"),
+            "names_path": os.path.join(tmp, "poi_names.npy")
+        }
+        extract = os.path.join(tmp, "city.osm")
+        poi_data.generate_synthetic_osm(extract, args.pois, untagged_per_poi=2)
+        poi_data.ingest_pois(extract, **poi_paths)
+
+        print(f"{'store':>6} {'size MB':>8} {'load':>6} {'private MB':>11} {'shared MB':>10}")
+        failures = []
+        for kind, paths in [("crime", crime_paths), ("poi", poi_paths)]:
+            size = os.path.getsize(paths["store_path"]) / 1e6
+            for mapped in (False, True):
+                anon, shared, _ = measure(kind, paths, mapped)
+                print(f"{kind:>6} {size:>8.1f} {'mmap' if mapped else 'heap':>6} {anon:>11.1f} {shared:>10.1f}")
+                if mapped and anon > max(0.1 * size, 5.0):
+                    failures.append(f"{kind} store grows private memory by {anon:.1f} MB")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Check the hours selected by the crime time filter's windows.
+
+hours_in_window(start, end) turns the Time of Day choice, or the custom
+(from, to) slider, into hours of day. Exits non-zero if:
+
+- a preset window in TIME_WINDOWS selects other hours than it names;
+- a window wrapping past midnight misses hours on either side;
+- a custom window with equal ends selects anything but that one hour
+  (it used to select the whole day).
+
+Run from the repository root:
+
+    python benchmarks/check_time_windows.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crime_cube import TIME_WINDOWS, hours_in_window
+
+CASES = [
+    (TIME_WINDOWS["Any time"], list(range(24))),
+    (TIME_WINDOWS["Morning (06:00–12:00)"], list(range(6, 12))),
+    (TIME_WINDOWS["Late night (21:00–05:00)"], [21, 22, 23, 0, 1, 2, 3, 4]),
+    ((18, 24), list(range(18, 24))),
+    ((23, 1), [23, 0]),
+    ((18, 18), [18]),
+    ((0, 0), [0]),
+    ((24, 24), [0])
+]
+
+
+def main():
+    failures = []
+    for (start, end), expected in CASES:
+        hours = hours_in_window(start, end)
+        print(f"({start:>2}, {end:>2}) -> {hours}")
+        if hours != expected:
+            failures.append(f"({start}, {end}) selected {hours}, expected {expected}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
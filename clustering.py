@@ -0,0 +1,91 @@
+"""Server-side hierarchical point clustering, in the style of supercluster.
+
+Points are projected to Web Mercator and merged level by level, from
+CLUSTER_MAX_ZOOM down to zoom 0: at each zoom, the clusters of the level
+above that fall in the same CLUSTER_RADIUS_PX grid cell become one weighted
+centroid. A query returns only one zoom's clusters inside a bounding box, so
+the payload is bounded by screen size rather than by the number of points.
+"""
+import hashlib
+
+import numpy as np
+
+# Cluster radius in screen pixels and the deepest zoom that still clusters
+CLUSTER_RADIUS_PX = 60
+CLUSTER_MAX_ZOOM = 16
+TILE_SIZE = 256
+
+# Below this many points, browser-side MarkerCluster is cheaper than a server round trip
+CLUSTER_MIN_POINTS = 200
+
+MAX_MERCATOR_LAT = 85.05112878
+
+_index_cache = {}
+
+def project(lat, lon):
+    """Web Mercator x, y in [0, 1]"""
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    x = np.asarray(lon, dtype=np.float64) / 360.0 + 0.5
+    y = 0.5 - np.log(np.tan(np.pi / 4.0 + np.radians(lat) / 2.0)) / (2.0 * np.pi)
+    return x, y
+
+def unproject(x, y):
+    """Inverse of project: (lat, lon) in degrees"""
+    lat = np.degrees(2.0 * np.arctan(np.exp((0.5 - np.asarray(y)) * 2.0 * np.pi)) - np.pi / 2.0)
+    return lat, (np.asarray(x) - 0.5) * 360.0
+
+def build_cluster_index(lat, lon, max_zoom=CLUSTER_MAX_ZOOM, radius_px=CLUSTER_RADIUS_PX):
+    """Clusters for every zoom from 0 to max_zoom, plus the raw points at max_zoom + 1
+
+    Each level holds centroid "x"/"y", the "count" of points merged into
+    each cluster, and "point", the original point index for clusters of a
+    single point (-1 otherwise).
+    """
+    x, y = project(lat, lon)
+    n = len(x)
+    levels = {max_zoom + 1: {"x": x, "y": y, "count": np.ones(n, dtype=np.int64), "point": np.arange(n)}}
+    for z in range(max_zoom, -1, -1):
+        finer = levels[z + 1]
+        cell = radius_px / (TILE_SIZE * 2.0 ** z)
+        cells_per_row = int(np.ceil(1.0 / cell)) + 1
+        keys = np.floor(finer["y"] / cell).astype(np.int64) * cells_per_row + np.floor(finer["x"] / cell).astype(np.int64)
+        _, first, parent = np.unique(keys, return_index=True, return_inverse=True)
+        parent = parent.ravel()
+        weight = finer["count"].astype(np.float64)
+        count = np.bincount(parent, weights=weight).astype(np.int64)
+        levels[z] = {
+            "x": np.bincount(parent, weights=finer["x"] * weight) / count,
+            "y": np.bincount(parent, weights=finer["y"] * weight) / count,
+            "count": count,
+            "point": np.where(count == 1, finer["point"][first], -1)
+        }
+    return {"levels": levels, "max_zoom": max_zoom, "points": n}
+
+def get_cluster_index(lat, lon):
+    """Cluster index for a set of points, built once per distinct coordinate set"""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    key = hashlib.sha1(lat.tobytes() + lon.tobytes()).hexdigest()
+    if key not in _index_cache:
+        if len(_index_cache) >= 8:
+            _index_cache.clear()
+        _index_cache[key] = build_cluster_index(lat, lon)
+    return _index_cache[key]
+
+def get_clusters(index, bounds, zoom):
+    """Clusters at a zoom level inside (south, west, north, east) bounds
+
+    Returns dicts with "lat", "lon", "count" and "point" (the original point
+    index when the cluster is a single point, else -1).
+    """
+    z = int(np.clip(int(zoom), 0, index["max_zoom"] + 1))
+    level = index["levels"][z]
+    south, west, north, east = bounds
+    x0, y1 = project(south, west)
+    x1, y0 = project(north, east)
+    inside = np.flatnonzero((level["x"] >= x0) & (level["x"] <= x1) & (level["y"] >= y0) & (level["y"] <= y1))
+    lat, lon = unproject(level["x"][inside], level["y"][inside])
+    return [
+        {"lat": float(la), "lon": float(lo), "count": int(c), "point": int(p)}
+        for la, lo, c, p in zip(lat, lon, level["count"][inside], level["point"][inside])
+    ]
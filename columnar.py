@@ -0,0 +1,80 @@
+"""Memory-mapped columnar files for the crime and POI stores.
+
+A store is written as one NumPy structured array (.npy) with a field per
+column and opened with mmap_mode="r". Columns are then read from the OS
+page cache, shared by every Streamlit worker process, rather than copied
+into each process's heap, so worker memory does not grow with the number
+of stored points.
+
+A store's JSON metadata is stamped with the modification time and size of
+the column file it was written with. The two files are replaced one after
+the other, and read_meta() ignores metadata whose stamp does not match, so
+a reader never pairs new columns with the previous metadata or the reverse.
+"""
+import json
+import os
+
+import numpy as np
+
+_open_cache = {}
+
+def write_array(path, array):
+    """Atomically write an array as a .npy file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+    return array
+
+def write_columns(path, columns, meta_path=None, meta=None):
+    """Atomically write equal-length columns as one structured .npy file, and their metadata if given"""
+    columns = {name: np.asarray(values) for name, values in columns.items()}
+    length = len(next(iter(columns.values()))) if columns else 0
+    table = np.empty(length, dtype=[(name, values.dtype) for name, values in columns.items()])
+    for name, values in columns.items():
+        table[name] = values
+    if meta_path is None:
+        return write_array(path, table)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, table)
+    # A rename keeps the file's mtime and size, so the stamp still matches once it is in place
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(dict(meta, columns_stamp=_stamp(tmp_path)), f, indent=4)
+    os.replace(tmp_path, path)
+    os.replace(meta_path + ".tmp", meta_path)
+    return table
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def read_meta(path, meta_path):
+    """Metadata written with the current column file; {} when missing or written with another one"""
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    stamp = meta.pop("columns_stamp", None)
+    if stamp is not None and stamp != _stamp(path):
+        return {}
+    return meta
+
+def open_columns(path):
+    """Read-only memory map of a .npy file, cached per process until the file changes"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _open_cache:
+        for stale in [k for k in _open_cache if k[0] == path]:
+            del _open_cache[stale]
+        try:
+            _open_cache[key] = np.load(path, mmap_mode="r")
+        except ValueError:
+            # Empty arrays have no data to map
+            _open_cache[key] = np.load(path)
+    return _open_cache[key]
+
+def column_views(table):
+    """Dict of per-column views into a structured array; nothing is copied"""
+    return {name: table[name] for name in table.dtype.names}
@@ -0,0 +1,162 @@
+"""Pre-aggregated crime cube: grid cell x hour of day x weekday x crime type.
+
+The cube collapses years of binned incidents into a fixed-size array, so
+time-of-day, weekday and type filters are a single matrix-vector product.
+It is updated in place from the bins added by each ingest.
+"""
+import os
+
+import numpy as np
+
+from crime_data import (
+    DATA_DIR, CRIME_TYPES, HEATMAP_MAX_CELLS, cells_to_heatmap, coarsen_cells,
+    cell_centers, load_crime_store
+)
+
+CRIME_CUBE_FILE = os.path.join(DATA_DIR, "crime_cube.npz")
+
+# Cube cells are ~300 m x 150 m around Solapur
+CUBE_LEVEL = 17
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# Named hour-of-day windows offered in the sidebar, as [start, end) hours
+TIME_WINDOWS = {
+    "Any time": (0, 24),
+    "Morning (06:00–12:00)": (6, 12),
+    "Afternoon (12:00–17:00)": (12, 17),
+    "Evening (17:00–21:00)": (17, 21),
+    "Late night (21:00–05:00)": (21, 5)
+}
+
+_cube_cache = {}
+
+def _time_indices(epoch_hour):
+    """Hour of day and weekday (Monday = 0) for local epoch hours"""
+    epoch_hour = np.asarray(epoch_hour, dtype=np.int64)
+    # 1970-01-01 was a Thursday
+    return epoch_hour % 24, (epoch_hour // 24 + 3) % 7
+
+def _empty_cube(store_version=None):
+    return {
+        "cells": np.array([], dtype=np.int64),
+        "counts": np.zeros((0, 24, 7, len(CRIME_TYPES)), dtype=np.float32),
+        "store_version": store_version
+    }
+
+def update_cube(cube, bins, store_version, from_level):
+    """Add binned incidents to the cube, growing the cell axis as needed
+
+    bins is any mapping with cell, type_id, epoch_hour and count arrays, such
+    as the crime store or the new bins returned by an ingest.
+    """
+    cells = coarsen_cells(np.asarray(bins["cell"]), from_level, CUBE_LEVEL)
+    if len(cells):
+        new_cells = np.setdiff1d(np.unique(cells), cube["cells"], assume_unique=True)
+        if len(new_cells):
+            all_cells = np.union1d(cube["cells"], new_cells)
+            counts = np.zeros((len(all_cells),) + cube["counts"].shape[1:], dtype=np.float32)
+            counts[np.searchsorted(all_cells, cube["cells"])] = cube["counts"]
+            cube["cells"], cube["counts"] = all_cells, counts
+
+        hour, weekday = _time_indices(bins["epoch_hour"])
+        cell_idx = np.searchsorted(cube["cells"], cells)
+        n_types = cube["counts"].shape[3]
+        flat = ((cell_idx * 24 + hour) * 7 + weekday) * n_types + np.asarray(bins["type_id"], dtype=np.int64)
+        added = np.bincount(flat, weights=np.asarray(bins["count"], dtype=np.float64), minlength=cube["counts"].size)
+        cube["counts"] += added.reshape(cube["counts"].shape).astype(np.float32)
+    cube["store_version"] = store_version
+    return cube
+
+def build_cube(store):
+    """Build the cube from scratch from the whole crime store"""
+    return update_cube(_empty_cube(), store, store["meta"]["version"], store["meta"]["level"])
+
+def save_cube(cube, path=CRIME_CUBE_FILE):
+    """Atomically write the cube to disk"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, cells=cube["cells"], counts=cube["counts"], store_version=np.array(cube["store_version"] or ""))
+    os.replace(tmp_path, path)
+
+def _read_cube(path):
+    with np.load(path) as data:
+        return {
+            "cells": data["cells"],
+            "counts": data["counts"],
+            "store_version": str(data["store_version"]) or None
+        }
+
+def load_cube(store=None, path=CRIME_CUBE_FILE):
+    """Load the cube matching the crime store, rebuilding it if it is stale
+
+    Returns None when there is no crime store. Cached per process.
+    """
+    store = store if store is not None else load_crime_store()
+    if store is None:
+        return None
+    version = store["meta"]["version"]
+    cached = _cube_cache.get(path)
+    if cached is not None and cached["store_version"] == version:
+        return cached
+
+    cube = _read_cube(path) if os.path.exists(path) else None
+    if cube is None or cube["store_version"] != version:
+        cube = build_cube(store)
+        save_cube(cube, path)
+    _cube_cache[path] = cube
+    return cube
+
+def apply_ingest(report, new_bins, path=CRIME_CUBE_FILE):
+    """Fold the bins from one ingest into the saved cube without a full rebuild
+
+    Falls back to a rebuild when the saved cube does not match the store
+    version the ingest started from.
+    """
+    cube = _read_cube(path) if os.path.exists(path) else None
+    if cube is None or cube["store_version"] != report.get("previous_version"):
+        cube = build_cube(load_crime_store())
+    else:
+        cube = update_cube(cube, new_bins, report["version"], report["level"])
+    save_cube(cube, path)
+    _cube_cache[path] = cube
+    return cube
+
+def hours_in_window(start, end):
+    """Hours of day in [start, end), wrapping past midnight when start > end; just start's hour when they are equal"""
+    if start == end:
+        return [start % 24]
+    if start < end:
+        return list(range(start, end))
+    return list(range(start, 24)) + list(range(0, end))
+
+def slice_mask(hours=None, weekdays=None, type_ids=None):
+    """Flattened 0/1 selector over the (hour, weekday, type) axes"""
+    hour_sel = np.zeros(24, dtype=np.float32)
+    hour_sel[list(range(24)) if hours is None else list(hours)] = 1.0
+    weekday_sel = np.zeros(7, dtype=np.float32)
+    weekday_sel[list(range(7)) if weekdays is None else list(weekdays)] = 1.0
+    type_sel = np.zeros(len(CRIME_TYPES), dtype=np.float32)
+    type_sel[list(range(len(CRIME_TYPES))) if type_ids is None else list(type_ids)] = 1.0
+    return np.einsum("h,w,t->hwt", hour_sel, weekday_sel, type_sel).ravel()
+
+def slice_cube(cube, hours=None, weekdays=None, type_ids=None):
+    """Total incidents per cube cell for the selected hours, weekdays and types
+
+    Returns (cells, counts) for cells with at least one matching incident.
+    """
+    n = len(cube["cells"])
+    counts = cube["counts"].reshape(n, -1) @ slice_mask(hours, weekdays, type_ids)
+    occupied = counts > 0
+    return cube["cells"][occupied], counts[occupied]
+
+def cube_heatmap_points(cube, zoom, hours=None, weekdays=None, type_ids=None, bounds=None,
+                        max_cells=HEATMAP_MAX_CELLS):
+    """Heatmap points for a time/type slice of the cube"""
+    cells, counts = slice_cube(cube, hours, weekdays, type_ids)
+    if bounds is not None:
+        south, west, north, east = bounds
+        lat, lon = cell_centers(cells, CUBE_LEVEL)
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        cells, counts = cells[inside], counts[inside]
+    return cells_to_heatmap(cells, counts, CUBE_LEVEL, zoom, max_cells)
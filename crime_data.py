@@ -0,0 +1,446 @@
+"""Crime incident ingestion and the binned crime store.
+
+Raw incident files (CSV or JSON Lines with a type, timestamp and lat/lon per
+row) are streamed in chunks, validated, deduplicated and folded into a compact
+store of (grid cell, crime type, hour) bins. Memory use is bounded by the number
+of distinct bins and seen incidents, never by the size of the input files.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar import column_views, open_columns, read_meta, write_columns
+
+# --- Configuration ---
+
+DATA_DIR = "data"
+CRIME_STORE_FILE = os.path.join(DATA_DIR, "crime_store.npy")
+LEGACY_CRIME_STORE_FILE = os.path.join(DATA_DIR, "crime_store.npz")
+CRIME_META_FILE = os.path.join(DATA_DIR, "crime_store.json")
+CRIME_SEEN_FILE = os.path.join(DATA_DIR, "crime_seen.npy")
+
+# Rows read from an input file per chunk
+INGEST_CHUNK_ROWS = 200_000
+
+# Grid resolution of the store: bits per axis, ~37 m x 19 m cells around Solapur
+BASE_LEVEL = 20
+
+# Heatmap cells are about 2**(HEATMAP_PIXEL_BITS - 8) screen pixels wide
+HEATMAP_PIXEL_BITS = 5
+HEATMAP_MAX_CELLS = 20_000
+
+# Incidents outside this box (south, west, north, east) are rejected
+REGION_BOUNDS = (17.0, 74.5, 18.7, 76.6)
+
+# Timestamps carrying a timezone are converted to local time before binning
+LOCAL_TIMEZONE = "Asia/Kolkata"
+
+CRIME_TYPES = [
+    "Theft", "Assault", "Burglary", "Robbery", "Vandalism",
+    "Harassment", "Chain Snatching", "Vehicle Theft", "Other"
+]
+CRIME_TYPE_IDS = {name.lower(): i for i, name in enumerate(CRIME_TYPES)}
+
+# Accepted spellings of the input columns
+COLUMN_ALIASES = {
+    "type": ["type", "crime_type", "category", "offense", "offence"],
+    "timestamp": ["timestamp", "datetime", "date_time", "occurred_at", "time", "date"],
+    "lat": ["lat", "latitude", "y"],
+    "lon": ["lon", "lng", "long", "longitude", "x"]
+}
+
+# --- Grid Cells ---
+
+def cell_ids(lat, lon, level=BASE_LEVEL):
+    """Map coordinates to geohash-style grid cell ids at the given level"""
+    n = 1 << level
+    ix = np.clip(((np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n).astype(np.int64), 0, n - 1)
+    iy = np.clip(((np.asarray(lat, dtype=np.float64) + 90.0) / 180.0 * n).astype(np.int64), 0, n - 1)
+    return (iy << level) | ix
+
+def cell_xy(cells, level=BASE_LEVEL):
+    """Split cell ids into their column and row indices"""
+    cells = np.asarray(cells, dtype=np.int64)
+    return cells & ((1 << level) - 1), cells >> level
+
+def coarsen_cells(cells, from_level, to_level):
+    """Map cell ids onto their parent cells at a coarser level"""
+    shift = from_level - to_level
+    if shift <= 0:
+        return np.asarray(cells, dtype=np.int64)
+    ix, iy = cell_xy(cells, from_level)
+    return ((iy >> shift) << to_level) | (ix >> shift)
+
+def cell_centers(cells, level=BASE_LEVEL):
+    """Return the (lat, lon) centre of each cell"""
+    ix, iy = cell_xy(cells, level)
+    n = float(1 << level)
+    return (iy + 0.5) / n * 180.0 - 90.0, (ix + 0.5) / n * 360.0 - 180.0
+
+def cell_size_deg(level=BASE_LEVEL):
+    """Return the (lat, lon) size of a cell in degrees"""
+    n = float(1 << level)
+    return 180.0 / n, 360.0 / n
+
+# --- Streaming Input ---
+
+def _normalise_columns(df):
+    """Rename aliased input columns to type/timestamp/lat/lon"""
+    lookup = {c.lower().strip(): c for c in df.columns}
+    renames = {}
+    for target, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lookup:
+                renames[lookup[alias]] = target
+                break
+    df = df.rename(columns=renames)
+    missing = [c for c in COLUMN_ALIASES if c not in df.columns]
+    if missing:
+        raise ValueError(f"Incident file is missing columns: {', '.join(missing)}")
+    return df[list(COLUMN_ALIASES)]
+
+def read_incident_chunks(path, chunk_rows=INGEST_CHUNK_ROWS):
+    """Yield DataFrames of raw incidents from a CSV or JSON Lines file"""
+    lowered = path.lower()
+    if lowered.endswith((".jsonl", ".ndjson", ".json")):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_rows, dtype=str, keep_default_na=True)
+    with reader:
+        for chunk in reader:
+            yield _normalise_columns(chunk)
+
+def _parse_timestamps(values):
+    """Parse timestamps to naive local datetimes, NaT where invalid"""
+    if pd.api.types.is_numeric_dtype(values):
+        ts = pd.to_datetime(values, unit="s", errors="coerce", utc=True)
+    else:
+        try:
+            ts = pd.to_datetime(values, errors="coerce")
+        except (ValueError, TypeError):
+            # Mixed naive and zone-aware strings; read everything as UTC
+            ts = pd.to_datetime(values, errors="coerce", utc=True)
+    if getattr(ts.dt, "tz", None) is not None:
+        ts = ts.dt.tz_convert(LOCAL_TIMEZONE).dt.tz_localize(None)
+    return ts
+
+def clean_chunk(df, bounds=REGION_BOUNDS):
+    """Validate a raw chunk into typed columns, dropping unusable rows"""
+    lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype=np.float64)
+    ts = _parse_timestamps(df["timestamp"])
+    type_names = df["type"].astype(str).str.strip().str.lower()
+    type_id = type_names.map(CRIME_TYPE_IDS).fillna(CRIME_TYPE_IDS["other"]).to_numpy(dtype=np.uint8)
+
+    valid = np.isfinite(lat) & np.isfinite(lon) & ts.notna().to_numpy()
+    valid &= df["type"].notna().to_numpy()
+    if bounds is not None:
+        south, west, north, east = bounds
+        valid &= (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+
+    seconds = ts[valid].to_numpy(dtype="datetime64[s]").astype(np.int64)
+    clean = pd.DataFrame({
+        "type_id": type_id[valid],
+        "ts": seconds,
+        "lat": lat[valid],
+        "lon": lon[valid]
+    })
+    return clean, int((~valid).sum())
+
+def incident_hashes(clean):
+    """Hash incidents on type, second and ~1 m position for deduplication"""
+    key = pd.DataFrame({
+        "type_id": clean["type_id"].to_numpy(),
+        "ts": clean["ts"].to_numpy(),
+        "lat": np.round(clean["lat"].to_numpy() * 1e5).astype(np.int64),
+        "lon": np.round(clean["lon"].to_numpy() * 1e5).astype(np.int64)
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy(dtype=np.uint64)
+
+def _drop_seen(clean, seen):
+    """Drop duplicates within the chunk and against already seen hashes"""
+    hashes = incident_hashes(clean)
+    _, first = np.unique(hashes, return_index=True)
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[first] = True
+    if len(seen):
+        pos = np.searchsorted(seen, hashes)
+        pos[pos == len(seen)] = 0
+        keep &= seen[pos] != hashes
+    return clean[keep], np.union1d(seen, hashes[keep])
+
+def bin_incidents(clean, level=BASE_LEVEL):
+    """Aggregate clean incidents into (cell, type_id, epoch_hour) counts"""
+    bins = pd.DataFrame({
+        "cell": cell_ids(clean["lat"].to_numpy(), clean["lon"].to_numpy(), level),
+        "type_id": clean["type_id"].to_numpy(dtype=np.uint8),
+        "epoch_hour": (clean["ts"].to_numpy() // 3600).astype(np.int32)
+    })
+    return bins.groupby(["cell", "type_id", "epoch_hour"], sort=False).size().rename("count").reset_index()
+
+def merge_bins(*frames):
+    """Sum bin counts across several bin frames"""
+    frames = [f for f in frames if f is not None and len(f)]
+    if not frames:
+        return pd.DataFrame({
+            "cell": np.array([], dtype=np.int64),
+            "type_id": np.array([], dtype=np.uint8),
+            "epoch_hour": np.array([], dtype=np.int32),
+            "count": np.array([], dtype=np.uint32)
+        })
+    merged = pd.concat(frames, ignore_index=True)
+    return merged.groupby(["cell", "type_id", "epoch_hour"], sort=True)["count"].sum().reset_index()
+
+# --- Store ---
+
+_store_cache = {}
+
+def _bins_to_arrays(bins):
+    """Convert a bin frame to the compact arrays written to the store"""
+    return {
+        "cell": bins["cell"].to_numpy(dtype=np.int64),
+        "type_id": bins["type_id"].to_numpy(dtype=np.uint8),
+        "epoch_hour": bins["epoch_hour"].to_numpy(dtype=np.int32),
+        "count": bins["count"].to_numpy(dtype=np.uint32)
+    }
+
+def _store_version(arrays):
+    """Content hash identifying a version of the store"""
+    digest = hashlib.sha1()
+    for name in ("cell", "type_id", "epoch_hour", "count"):
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()[:12]
+
+def load_crime_store(path=CRIME_STORE_FILE, meta_path=CRIME_META_FILE):
+    """Load the binned crime store, or None if it has not been built
+
+    The result is a dict of read-only, memory-mapped column arrays (cell,
+    type_id, epoch_hour, count) plus a "meta" dict; it is cached per process
+    until either file changes. A store in the old compressed .npz format is
+    converted on first load.
+    """
+    if not os.path.exists(path):
+        if path != CRIME_STORE_FILE or not os.path.exists(LEGACY_CRIME_STORE_FILE):
+            return None
+        with np.load(LEGACY_CRIME_STORE_FILE) as data:
+            write_columns(path, {name: data[name] for name in ("cell", "type_id", "epoch_hour", "count")})
+    key = (path, os.path.getmtime(path), os.path.getmtime(meta_path) if os.path.exists(meta_path) else None)
+    if key not in _store_cache:
+        store = column_views(open_columns(path))
+        # Empty while a save is between its two renames; the version is then hashed from the columns
+        meta = read_meta(path, meta_path)
+        meta.setdefault("level", BASE_LEVEL)
+        meta.setdefault("crime_types", CRIME_TYPES)
+        if "version" not in meta:
+            meta["version"] = _store_version(store)
+        store["meta"] = meta
+        _store_cache.clear()
+        _store_cache[key] = store
+    return _store_cache[key]
+
+def crime_store_version(path=CRIME_STORE_FILE):
+    """Return the version of the current crime store, or None"""
+    store = load_crime_store(path)
+    return store["meta"]["version"] if store else None
+
+def save_crime_store(bins, stats, path=CRIME_STORE_FILE, meta_path=CRIME_META_FILE):
+    """Atomically write the binned store and its metadata, stamped with the store file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    arrays = _bins_to_arrays(bins)
+    meta = dict(stats)
+    meta.update({
+        "version": _store_version(arrays),
+        "level": BASE_LEVEL,
+        "crime_types": CRIME_TYPES,
+        "bins": int(len(bins)),
+        "incidents": int(arrays["count"].sum()),
+        "updated": time.strftime("%Y-%m-%d %H:%M:%S")
+    })
+    write_columns(path, arrays, meta_path, meta)
+    return meta
+
+def ingest_incidents(paths, append=True, bounds=REGION_BOUNDS, chunk_rows=INGEST_CHUNK_ROWS,
+                     store_path=CRIME_STORE_FILE, meta_path=CRIME_META_FILE, seen_path=CRIME_SEEN_FILE,
+                     return_new_bins=False):
+    """Stream incident files into the binned store and return an ingest report
+
+    With return_new_bins=True, the bins added by this ingest are returned as
+    well, so derived aggregates can be updated incrementally.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    existing = load_crime_store(store_path, meta_path) if append else None
+    report = {"files": list(paths), "rows_read": 0, "rows_valid": 0, "rows_rejected": 0, "rows_duplicate": 0}
+    if existing is not None:
+        report["previous_version"] = existing["meta"]["version"]
+        stored = pd.DataFrame({k: existing[k] for k in ("cell", "type_id", "epoch_hour", "count")})
+        seen = np.load(seen_path) if os.path.exists(seen_path) else np.array([], dtype=np.uint64)
+        totals = {k: existing["meta"].get(k, 0) for k in ("rows_read", "rows_valid", "rows_rejected", "rows_duplicate")}
+    else:
+        stored = None
+        seen = np.array([], dtype=np.uint64)
+        totals = {"rows_read": 0, "rows_valid": 0, "rows_rejected": 0, "rows_duplicate": 0}
+
+    started = time.perf_counter()
+    new_bins = None
+    for path in paths:
+        for chunk in read_incident_chunks(path, chunk_rows):
+            clean, rejected = clean_chunk(chunk, bounds)
+            unique, seen = _drop_seen(clean, seen)
+            report["rows_read"] += len(chunk)
+            report["rows_rejected"] += rejected
+            report["rows_duplicate"] += len(clean) - len(unique)
+            report["rows_valid"] += len(unique)
+            new_bins = merge_bins(new_bins, bin_incidents(unique))
+
+    for key in totals:
+        totals[key] += report[key]
+    meta = save_crime_store(merge_bins(stored, new_bins), totals, store_path, meta_path)
+    np.save(seen_path, seen)
+    report.update({
+        "version": meta["version"],
+        "level": meta["level"],
+        "bins": meta["bins"],
+        "incidents": meta["incidents"],
+        "seconds": round(time.perf_counter() - started, 3)
+    })
+    if return_new_bins:
+        return report, merge_bins(new_bins)
+    return report
+
+# --- Queries ---
+
+def cells_in_bounds(store, south, west, north, east, level=None):
+    """Return a boolean mask of store bins whose cell lies inside the box"""
+    level = level or store["meta"]["level"]
+    lat, lon = cell_centers(store["cell"], level)
+    return (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+
+def coarsen_counts(cells, counts, from_level, to_level):
+    """Sum per-cell counts onto parent cells at a coarser level"""
+    parents = coarsen_cells(cells, from_level, to_level)
+    unique, inverse = np.unique(parents, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique))
+
+def aggregate_cells(store, level, mask=None):
+    """Sum incident counts per cell at a coarser level
+
+    Returns (cells, counts) with one entry per occupied cell, so downstream
+    payloads scale with the number of cells rather than incidents.
+    """
+    cells = store["cell"] if mask is None else store["cell"][mask]
+    counts = store["count"] if mask is None else store["count"][mask]
+    return coarsen_counts(cells, counts, store["meta"]["level"], level)
+
+def heatmap_level_for_zoom(zoom):
+    """Pick the grid level giving a few screen pixels per cell at a map zoom"""
+    # A 256 px tile spans 360 / 2**zoom degrees, so zoom + 8 bits is one pixel
+    return int(min(BASE_LEVEL, max(8, zoom + HEATMAP_PIXEL_BITS)))
+
+def cells_to_heatmap(cells, counts, level, zoom, max_cells=HEATMAP_MAX_CELLS):
+    """Turn per-cell counts into [lat, lon, weight] heatmap points for a map zoom
+
+    Cells are coarsened until at most max_cells remain, and weights are scaled
+    to [0, 1] against the 99th percentile so a single hotspot cannot wash out
+    the rest of the layer.
+    """
+    target = min(level, heatmap_level_for_zoom(zoom))
+    cells_out, counts_out = coarsen_counts(cells, counts, level, target)
+    while len(cells_out) > max_cells and target > 8:
+        target -= 1
+        cells_out, counts_out = coarsen_counts(cells, counts, level, target)
+    if not len(cells_out):
+        return []
+    lat, lon = cell_centers(cells_out, target)
+    scale = max(float(np.percentile(counts_out, 99)), 1.0)
+    weight = np.minimum(counts_out / scale, 1.0)
+    return np.column_stack([np.round(lat, 5), np.round(lon, 5), np.round(weight, 3)]).tolist()
+
+_heatmap_cache = {}
+
+def heatmap_points(store, zoom, bounds=None, max_cells=HEATMAP_MAX_CELLS):
+    """Return heatmap points for the whole store, cached per store version"""
+    key = (store["meta"]["version"], zoom, bounds, max_cells)
+    if key in _heatmap_cache:
+        return _heatmap_cache[key]
+
+    mask = cells_in_bounds(store, *bounds) if bounds is not None else np.ones(len(store["cell"]), dtype=bool)
+    points = cells_to_heatmap(store["cell"][mask], store["count"][mask], store["meta"]["level"], zoom, max_cells)
+
+    if len(_heatmap_cache) >= 32:
+        _heatmap_cache.clear()
+    _heatmap_cache[key] = points
+    return points
+
+# --- Synthetic Data ---
+
+def generate_synthetic_incidents(path, rows, centers=None, seed=42, chunk_rows=INGEST_CHUNK_ROWS):
+    """Write a synthetic incident CSV clustered around the given (lat, lon) centres"""
+    rng = np.random.default_rng(seed)
+    if not centers:
+        centers = [(17.6599, 75.9064), (17.6715, 75.8952), (17.6868, 75.9120), (17.7202, 75.9195)]
+    centers = np.asarray(centers, dtype=np.float64)
+    start = pd.Timestamp("2022-01-01").value // 10**9
+    span = 3 * 365 * 24 * 3600
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    written = 0
+    with open(path, "w") as f:
+        f.write("type,timestamp,lat,lon\n")
+        while written < rows:
+            n = min(chunk_rows, rows - written)
+            pick = rng.integers(0, len(centers), n)
+            spread = rng.uniform(0.002, 0.02, n)
+            lat = centers[pick, 0] + rng.normal(0, 1, n) * spread
+            lon = centers[pick, 1] + rng.normal(0, 1, n) * spread
+            # Skew incidents towards the evening
+            hour_shift = (rng.normal(21, 4, n) % 24).astype(np.int64) * 3600
+            day = start + rng.integers(0, span // 86400, n) * 86400
+            ts = pd.to_datetime(day + hour_shift + rng.integers(0, 3600, n), unit="s")
+            chunk = pd.DataFrame({
+                "type": np.asarray(CRIME_TYPES)[rng.integers(0, len(CRIME_TYPES), n)],
+                "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+                "lat": np.round(lat, 6),
+                "lon": np.round(lon, 6)
+            })
+            chunk.to_csv(f, header=False, index=False)
+            written += n
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Crime incident ingestion")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="stream incident CSV/JSONL files into the crime store")
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("--replace", action="store_true", help="rebuild the store instead of appending")
+    ingest.add_argument("--chunk-rows", type=int, default=INGEST_CHUNK_ROWS)
+    synth = sub.add_parser("synth", help="write a synthetic incident CSV")
+    synth.add_argument("path")
+    synth.add_argument("--rows", type=int, default=100_000)
+    synth.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        report, new_bins = ingest_incidents(args.paths, append=not args.replace, chunk_rows=args.chunk_rows,
+                                            return_new_bins=True)
+        # Keep the time-sliced cube in step with the store
+        from crime_cube import apply_ingest
+        apply_ingest(report, new_bins)
+        # Update the risk model with just the new batch (a full retrain after --replace)
+        from risk_model import update_model
+        if args.replace:
+            update_model()
+        else:
+            update_model(new_bins, report["level"])
+        print(json.dumps(report, indent=4))
+    else:
+        generate_synthetic_incidents(args.path, args.rows, seed=args.seed)
+        print(f"Wrote {args.rows:,} incidents to {args.path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""High-risk crime zones and batch point-in-polygon checks against them."""
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import ConvexHull
+
+from crime_cube import CUBE_LEVEL, slice_cube
+from crime_data import cell_size_deg, cell_xy
+
+# A cube cell is high-risk when it holds this many times the mean cell count
+HIGH_RISK_FACTOR = 3.0
+
+# Zones with fewer cells are dropped as noise
+MIN_ZONE_CELLS = 2
+
+_zone_cache = {}
+
+def cells_outline(ix, iy, level):
+    """Convex hull ring ([lat, lon] rows) around the corners of a group of cells"""
+    d_lat, d_lon = cell_size_deg(level)
+    south = np.asarray(iy) * d_lat - 90.0
+    west = np.asarray(ix) * d_lon - 180.0
+    corners = np.column_stack([
+        np.concatenate([south, south, south + d_lat, south + d_lat]),
+        np.concatenate([west, west + d_lon, west, west + d_lon])
+    ])
+    return corners[ConvexHull(corners).vertices]
+
+def high_risk_zones(cube, factor=HIGH_RISK_FACTOR, min_cells=MIN_ZONE_CELLS):
+    """Polygons around clusters of high-crime cube cells, cached per store version
+
+    Adjacent (8-connected) high-risk cells are grouped and each group is
+    outlined by the convex hull of its cell corners. Each zone is a dict with
+    "polygon" ([lat, lon] ring), "bbox" (south, west, north, east),
+    "incidents" and "cells".
+    """
+    key = (cube["store_version"], factor, min_cells)
+    if key in _zone_cache:
+        return _zone_cache[key]
+
+    cells, counts = slice_cube(cube)
+    zones = []
+    if len(cells):
+        hot = counts >= counts.mean() * factor
+        ix, iy = cell_xy(cells[hot], CUBE_LEVEL)
+        hot_counts = counts[hot]
+        if len(ix):
+            x0, y0 = ix.min(), iy.min()
+            grid = np.zeros((iy.max() - y0 + 1, ix.max() - x0 + 1), dtype=bool)
+            grid[iy - y0, ix - x0] = True
+            labels, n_zones = ndimage.label(grid, structure=np.ones((3, 3)))
+            zone_of = labels[iy - y0, ix - x0] - 1
+
+            for z in range(n_zones):
+                member = zone_of == z
+                if member.sum() < min_cells:
+                    continue
+                ring = cells_outline(ix[member], iy[member], CUBE_LEVEL)
+                zones.append({
+                    "polygon": np.round(ring, 6).tolist(),
+                    "bbox": (ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max()),
+                    "incidents": int(hot_counts[member].sum()),
+                    "cells": int(member.sum())
+                })
+    zones.sort(key=lambda zone: zone["incidents"], reverse=True)
+
+    _zone_cache.clear()
+    _zone_cache[key] = zones
+    return zones
+
+def points_in_polygon(lat, lon, ring):
+    """Even-odd ray casting of many points against one polygon ring"""
+    ring = np.asarray(ring, dtype=np.float64)
+    y1, x1 = ring[:, 0], ring[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+    py, px = lat[:, None], lon[:, None]
+    # Edges straddling the point's latitude, and where they cross it
+    straddles = (y1 > py) != (y2 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cross_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    return (straddles & (px < cross_x)).sum(axis=1) % 2 == 1
+
+def classify_points(lat, lon, zones):
+    """Index of the zone containing each point, or -1 when outside every zone
+
+    Points are first filtered by each zone's bounding box, so only the few
+    candidates near a zone go through the exact polygon test. Zones are
+    checked in order, so a point in overlapping zones gets the first (most
+    severe) one.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    result = np.full(len(lat), -1, dtype=np.int64)
+    for z, zone in enumerate(zones):
+        south, west, north, east = zone["bbox"]
+        candidates = np.flatnonzero((result < 0) & (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+        if len(candidates):
+            inside = points_in_polygon(lat[candidates], lon[candidates], zone["polygon"])
+            result[candidates[inside]] = z
+    return result
@@ -0,0 +1,156 @@
+"""Crime hotspot detection with DBSCAN/HDBSCAN on haversine distance.
+
+Clustering runs in a background worker process whenever the crime store
+version changes, and the resulting hotspot polygons are written to
+HOTSPOTS_FILE so the map can draw them without clustering during a rerun.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from sklearn.cluster import DBSCAN, HDBSCAN
+
+from crime_data import DATA_DIR, aggregate_cells, cell_centers, cell_xy, load_crime_store
+from geofence import cells_outline
+import workers
+
+HOTSPOTS_FILE = os.path.join(DATA_DIR, "hotspots.json")
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Incidents are clustered as weighted cell centroids at this level (~150 m x 75 m)
+HOTSPOT_LEVEL = 18
+
+# DBSCAN neighbourhood radius and the incidents needed inside it for a core cell
+HOTSPOT_EPS_KM = 0.3
+HOTSPOT_MIN_INCIDENTS = 200
+
+# HDBSCAN smallest cluster, in cells; only cells with at least this many incidents take part
+HDBSCAN_MIN_CLUSTER_CELLS = 5
+HDBSCAN_MIN_CELL_INCIDENTS = 10
+
+# Severity labels by share of hotspots ranked below, most severe first
+SEVERITY_LEVELS = [(0.8, "Critical"), (0.5, "High"), (0.0, "Elevated")]
+
+_file_cache = {}
+
+def detect_hotspots(store, method="dbscan"):
+    """Cluster the store's incidents into hotspots, most severe first
+
+    Each hotspot has a [lat, lon] "polygon" ring, its "center", the number of
+    "incidents" and "cells", a "density" (incidents per km²) and a
+    "severity" label.
+    """
+    cells, counts = aggregate_cells(store, HOTSPOT_LEVEL)
+    lat, lon = cell_centers(cells, HOTSPOT_LEVEL)
+    coords = np.radians(np.column_stack([lat, lon]))
+
+    if method == "hdbscan":
+        eligible = counts >= HDBSCAN_MIN_CELL_INCIDENTS
+        labels = np.full(len(cells), -1)
+        if eligible.sum() >= HDBSCAN_MIN_CLUSTER_CELLS:
+            labels[eligible] = HDBSCAN(min_cluster_size=HDBSCAN_MIN_CLUSTER_CELLS, metric="haversine", copy=True).fit_predict(coords[eligible])
+    else:
+        labels = DBSCAN(
+            eps=HOTSPOT_EPS_KM / EARTH_RADIUS_KM,
+            min_samples=HOTSPOT_MIN_INCIDENTS,
+            metric="haversine",
+            algorithm="ball_tree"
+        ).fit_predict(coords, sample_weight=counts)
+
+    ix, iy = cell_xy(cells, HOTSPOT_LEVEL)
+    cell_km2 = _cell_area_km2(lat)
+    hotspots = []
+    for label in np.unique(labels[labels >= 0]):
+        member = labels == label
+        ring = cells_outline(ix[member], iy[member], HOTSPOT_LEVEL)
+        incidents = float(counts[member].sum())
+        hotspots.append({
+            "polygon": np.round(ring, 6).tolist(),
+            "center": [round(float(np.average(lat[member], weights=counts[member])), 6),
+                       round(float(np.average(lon[member], weights=counts[member])), 6)],
+            "incidents": int(incidents),
+            "cells": int(member.sum()),
+            "density": round(incidents / float(cell_km2[member].sum()), 1)
+        })
+
+    hotspots.sort(key=lambda h: h["incidents"], reverse=True)
+    for rank, hotspot in enumerate(hotspots):
+        share_below = 1.0 - (rank + 1) / len(hotspots)
+        hotspot["severity"] = next(label for threshold, label in SEVERITY_LEVELS if share_below >= threshold)
+    return hotspots
+
+def _cell_area_km2(lat):
+    """Area of HOTSPOT_LEVEL cells at the given latitudes"""
+    n = float(1 << HOTSPOT_LEVEL)
+    return (180.0 / n * 111.32) * (360.0 / n * 111.32 * np.cos(np.radians(lat)))
+
+def build_hotspots(method="dbscan", path=HOTSPOTS_FILE):
+    """Detect hotspots for the current store and write them to disk"""
+    store = load_crime_store()
+    if store is None:
+        return None
+    started = time.perf_counter()
+    hotspots = detect_hotspots(store, method)
+    result = {
+        "store_version": store["meta"]["version"],
+        "method": method,
+        "hotspots": hotspots,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(path + ".tmp", path)
+    return result
+
+def load_hotspots(path=HOTSPOTS_FILE):
+    """Return the last computed hotspot file contents, or None; cached until the file changes"""
+    if not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    if key not in _file_cache:
+        try:
+            with open(path, "r") as f:
+                result = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return None
+        _file_cache.clear()
+        _file_cache[key] = result
+    return _file_cache[key]
+
+def hotspots_error():
+    """Why the latest hotspot build failed, or None when none has failed since the last success"""
+    return workers.error("hotspots")
+
+def ensure_hotspots(method="dbscan"):
+    """Return the latest hotspots, recomputing them in a worker process if stale
+
+    Never blocks: while a recomputation runs, the previous results (or None)
+    are returned. A build that failed, for instance because its worker was
+    killed, is retried after workers.RETRY_SECONDS; hotspots_error() says why.
+    """
+    current = load_hotspots()
+    store = load_crime_store()
+    if store is None:
+        return current
+    version = store["meta"]["version"]
+    if current is not None and current.get("store_version") == version and current.get("method") == method:
+        return current
+    workers.submit(("hotspots", version, method), build_hotspots, method)
+    return current
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect crime hotspots from the crime store")
+    parser.add_argument("--method", choices=["dbscan", "hdbscan"], default="dbscan")
+    args = parser.parse_args()
+    result = build_hotspots(args.method)
+    if result is None:
+        print("No crime store found")
+    else:
+        print(f"{len(result['hotspots'])} hotspots in {result['seconds']}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""Renderer-independent map layer definitions, drawn with folium or pydeck.
+
+A layer is a dict with a "kind" ("scatter", "heatmap", "hexagon", "polygon"
+or "line"), a "name", columnar "lat"/"lon"/"weight" arrays (or "polygons"
+rings / "paths" for polygon and line layers), a "color" or per-feature
+"colors", and optional
+per-feature "tooltip" strings. The map tab builds one list of layers and
+hands it to either renderer; above WEBGL_POINT_THRESHOLD markers and shapes
+left to draw after clustering, Leaflet's DOM/canvas rendering gets slow, so
+deck.gl (WebGL) is used instead.
+"""
+import hashlib
+import json
+
+import folium
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+from folium.elements import MacroElement
+from folium.plugins import HeatMap, VectorGridProtobuf
+from folium.template import Template
+
+# Leaflet markers and shapes across all layers above which the WebGL renderer is chosen automatically
+WEBGL_POINT_THRESHOLD = 10_000
+
+# Hexagon bin radius for aggregated density layers
+HEXAGON_RADIUS_M = 200
+
+# RGB values of the Leaflet.awesome-markers colour names used by folium.Icon
+MARKER_COLORS = {
+    "red": (214, 62, 42), "darkred": (162, 51, 54), "lightred": (255, 141, 126),
+    "orange": (246, 151, 48), "beige": (255, 203, 146),
+    "green": (114, 176, 38), "darkgreen": (114, 130, 36), "lightgreen": (187, 249, 112),
+    "blue": (56, 170, 221), "darkblue": (0, 103, 163), "lightblue": (138, 218, 255), "cadetblue": (67, 105, 120),
+    "purple": (208, 82, 184), "darkpurple": (91, 57, 107), "pink": (255, 142, 233),
+    "white": (251, 251, 251), "gray": (87, 87, 87), "lightgray": (163, 163, 163), "black": (48, 48, 48)
+}
+
+_geojson_cache = {}
+
+def to_rgb(color):
+    """RGB tuple from a marker colour name, a #rrggbb string or an RGB tuple"""
+    if isinstance(color, str):
+        if color.startswith("#"):
+            return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+        return MARKER_COLORS.get(color, MARKER_COLORS["blue"])
+    return tuple(color)
+
+def to_hex(color):
+    """#rrggbb string for any colour accepted by to_rgb"""
+    return "#{:02x}{:02x}{:02x}".format(*to_rgb(color))
+
+def point_layer(kind, name, lat, lon, weight=None, color="blue", radius=60, tooltip=None, drawn=None):
+    """Scatter, heatmap or hexagon layer over columnar point arrays
+
+    drawn is the number of markers Leaflet draws for the layer once it is
+    clustered, when that is fewer than its points.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    return {
+        "kind": kind,
+        "name": name,
+        "lat": lat,
+        "lon": np.asarray(lon, dtype=np.float64),
+        "weight": np.ones(len(lat)) if weight is None else np.asarray(weight, dtype=np.float64),
+        "color": to_rgb(color),
+        "radius": radius,
+        "tooltip": tooltip,
+        "drawn": len(lat) if drawn is None else drawn
+    }
+
+def heatmap_layer(name, points, kind="heatmap", gradient=None):
+    """Heatmap or hexagon layer from [[lat, lon, weight]] points"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    layer = point_layer(kind, name, points[:, 0], points[:, 1], weight=points[:, 2])
+    layer["gradient"] = gradient
+    return layer
+
+def polygon_layer(name, polygons, colors, tooltip=None):
+    """Polygon layer from [lat, lon] rings, one colour per polygon"""
+    return {
+        "kind": "polygon",
+        "name": name,
+        "polygons": polygons,
+        "colors": [to_rgb(c) for c in colors],
+        "tooltip": tooltip
+    }
+
+def line_layer(name, paths, color, tooltip=None, weight=2, opacity=0.6):
+    """Line layer from [lat, lon] paths sharing one style, e.g. all connections to one hub"""
+    paths = [[[round(float(lat), 6), round(float(lon), 6)] for lat, lon in path] for path in paths]
+    key = hashlib.sha1(json.dumps([name, paths, tooltip]).encode()).hexdigest()
+    return {
+        "kind": "line",
+        "name": name,
+        "paths": paths,
+        "color": to_rgb(color),
+        "tooltip": tooltip,
+        "weight": weight,
+        "opacity": opacity,
+        "key": key
+    }
+
+def line_geojson(layer):
+    """FeatureCollection of one LineString per path, built once per distinct line set
+
+    Separate features (rather than one MultiLineString) keep a tooltip label
+    per line, while Leaflet still draws the whole collection as one layer.
+    """
+    if layer["key"] not in _geojson_cache:
+        if len(_geojson_cache) >= 32:
+            _geojson_cache.clear()
+        _geojson_cache[layer["key"]] = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in path]},
+                    "properties": {"label": layer["tooltip"][i] if layer["tooltip"] else ""}
+                }
+                for i, path in enumerate(layer["paths"])
+            ]
+        }
+    return _geojson_cache[layer["key"]]
+
+def point_count(layers):
+    """Markers and shapes Leaflet would have to draw for a list of layers
+
+    Scatter layers count their markers after clustering. Heatmaps are drawn
+    as one canvas and hexagon layers are WebGL-only, so neither counts.
+    """
+    counts = {"scatter": lambda layer: layer["drawn"], "polygon": lambda layer: len(layer["polygons"]),
+              "line": lambda layer: len(layer["paths"])}
+    return sum(counts[layer["kind"]](layer) for layer in layers if layer["kind"] in counts)
+
+def choose_renderer(layers, preference="Auto", threshold=WEBGL_POINT_THRESHOLD):
+    """"pydeck" or "folium" for a renderer preference of Auto, Leaflet or WebGL"""
+    if preference == "Auto":
+        return "pydeck" if point_count(layers) > threshold else "folium"
+    return "pydeck" if preference == "WebGL" else "folium"
+
+# --- folium ---
+
+def add_to_folium(layer, parent):
+    """Draw a layer onto a folium map or feature group"""
+    if layer["kind"] == "heatmap":
+        points = np.column_stack([layer["lat"], layer["lon"], layer["weight"]]).tolist()
+        options = {"gradient": layer["gradient"]} if layer.get("gradient") else {}
+        HeatMap(points, name=layer["name"], radius=18, blur=15, min_opacity=0.3, **options).add_to(parent)
+    elif layer["kind"] == "scatter":
+        color = to_hex(layer["color"])
+        for i, (lat, lon) in enumerate(zip(layer["lat"], layer["lon"])):
+            folium.CircleMarker(
+                location=[lat, lon],
+                radius=5,
+                color=color,
+                fill=True,
+                fill_opacity=0.8,
+                tooltip=layer["tooltip"][i] if layer["tooltip"] else None
+            ).add_to(parent)
+    elif layer["kind"] == "polygon":
+        for i, ring in enumerate(layer["polygons"]):
+            color = to_hex(layer["colors"][i])
+            folium.Polygon(
+                ring,
+                color=color,
+                weight=2,
+                fill=True,
+                fill_opacity=0.15,
+                tooltip=layer["tooltip"][i] if layer["tooltip"] else None
+            ).add_to(parent)
+    elif layer["kind"] == "line" and layer["paths"]:
+        style = {"color": to_hex(layer["color"]), "weight": layer["weight"], "opacity": layer["opacity"]}
+        folium.GeoJson(
+            line_geojson(layer),
+            name=layer["name"],
+            style_function=lambda _feature: style,
+            tooltip=folium.GeoJsonTooltip(fields=["label"], labels=False) if layer["tooltip"] else None
+        ).add_to(parent)
+    # Leaflet has no hexagon aggregation; those layers are drawn by pydeck only
+    return parent
+
+class IconRegistry(MacroElement):
+    """Defines each distinct AwesomeMarkers icon once for every marker on a map
+
+    folium.Icon emits its own JS icon object for every marker; markers made
+    with IconRegistry.marker look theirs up in one shared table instead. The
+    table lives on window so feature groups added by streamlit_folium after
+    the map (which run in a separate eval) can use it too. Add the registry
+    to the map before any marker so its script runs first.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            window.{{ this.get_name() }} = {
+            {%- for key, options in this.icons.items() %}
+                {{ key|tojson }}: L.AwesomeMarkers.icon({{ options|tojavascript }}),
+            {%- endfor %}
+            };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._name = "IconRegistry"
+        self.icons = {}
+
+    def register(self, color, icon, prefix="fa", icon_color="white"):
+        """Key of the shared icon for a colour/glyph combination, defining it if new"""
+        key = f"{prefix}-{icon}-{color}-{icon_color}"
+        if key not in self.icons:
+            self.icons[key] = folium.Icon(color=color, icon=icon, prefix=prefix, icon_color=icon_color).options
+        return key
+
+    def marker(self, location, color, icon, popup=None, tooltip=None, prefix="fa", popup_table=None, popup_row=None):
+        """Marker using the shared icon for color/icon, with an optional lazy popup from a PopupTable row"""
+        return RegistryMarker(location, self, self.register(color, icon, prefix), popup=popup, tooltip=tooltip,
+                              popup_table=popup_table, popup_row=popup_row)
+
+class RegistryMarker(folium.Marker):
+    """folium.Marker whose icon comes from an IconRegistry"""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.marker(
+                {{ this.location|tojson }},
+                {{ this.options|tojavascript }}
+            ).setIcon({{ this.registry.get_name() }}[{{ this.icon_key|tojson }}])
+            {%- if this.popup_table %}
+            .bindPopup(function () { return {{ this.popup_table.get_name() }}.render({{ this.popup_row }}); }, {maxWidth: 300})
+            {%- endif %}
+            .addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, location, registry, icon_key, popup=None, tooltip=None, popup_table=None, popup_row=None):
+        super().__init__(location, popup=popup, tooltip=tooltip)
+        self.registry = registry
+        self.icon_key = icon_key
+        self.popup_table = popup_table
+        self.popup_row = popup_row
+
+class PopupTable(MacroElement):
+    """Popup contents for many markers as one compact table, turned into HTML on click
+
+    Each marker only carries a row number; the row's values are substituted
+    into a JS template literal (fields available as r.<name>) when its popup
+    opens, instead of a popup element being serialised for every marker. Add
+    the table to the same layer as its markers.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            window.{{ this.get_name() }} = {
+                fields: {{ this.fields|tojson }},
+                rows: {{ this.rows|tojson }},
+                render: function (i) {
+                    var r = {};
+                    this.fields.forEach(function (field, k) { r[field] = this.rows[i][k]; }, this);
+                    return `{{ this.template }}`;
+                }
+            };
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, template, fields):
+        super().__init__()
+        self._name = "PopupTable"
+        self.template = template
+        self.fields = list(fields)
+        self.rows = []
+
+    def add_row(self, **values):
+        """Append a row of field values and return its index for RegistryMarker"""
+        self.rows.append([values.get(field) for field in self.fields])
+        return len(self.rows) - 1
+
+class VectorTileLayer(VectorGridProtobuf):
+    """Crime grid, hotspot and place layers from the prebuilt vector tiles, labelled on click
+
+    The tiles come from vector_tiles.py through the local tile server; only
+    the tiles in view are downloaded, and beyond max_native_zoom the last
+    built zoom is scaled up.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) -%}
+        var {{ this.get_name() }} = L.vectorGrid.protobuf({{ this.url|tojson }}, {
+            maxNativeZoom: {{ this.max_native_zoom }},
+            interactive: true,
+            vectorTileLayerStyles: {
+                crime_grid: function (p) {
+                    var color = p.weight > 0.66 ? "#B91C1C" : p.weight > 0.33 ? "#F97316" : "#FACC15";
+                    return {fill: true, stroke: false, fillColor: color, fillOpacity: 0.15 + 0.5 * p.weight};
+                },
+                hotspots: function (p) {
+                    var color = {{ this.severity_colors|tojson }}[p.severity] || "#DC2626";
+                    return {fill: true, fillColor: color, fillOpacity: 0.2, color: color, weight: 2};
+                },
+                places: {radius: 5, fill: true, fillColor: "#2563EB", fillOpacity: 0.9, color: "#FFFFFF", weight: 1}
+            }
+        }).on("click", function (e) {
+            L.popup().setLatLng(e.latlng).setContent(e.layer.properties.label).openOn(this._map);
+        });
+        {%- endmacro %}
+        """
+    )
+
+    def __init__(self, url, name, max_native_zoom, severity_colors):
+        super().__init__(url, name=name)
+        self._name = "VectorTileLayer"
+        self.max_native_zoom = int(max_native_zoom)
+        self.severity_colors = severity_colors
+
+# --- pydeck ---
+
+def _point_frame(layer):
+    # ~1 m coordinate precision keeps the JSON sent to deck.gl compact
+    frame = pd.DataFrame({
+        "lat": np.round(layer["lat"], 5),
+        "lon": np.round(layer["lon"], 5),
+        "weight": np.round(layer["weight"], 3)
+    })
+    if layer["tooltip"]:
+        frame["tooltip"] = layer["tooltip"]
+    return frame
+
+def to_deck_layer(layer):
+    """pydeck Layer for a layer definition"""
+    layer_id = layer["name"].lower().replace(" ", "-")
+    if layer["kind"] == "polygon":
+        frame = pd.DataFrame({
+            # deck.gl expects [lon, lat] vertex order
+            "polygon": [[[lon, lat] for lat, lon in ring] for ring in layer["polygons"]],
+            "color": [list(c) + [60] for c in layer["colors"]],
+            "line": [list(c) + [220] for c in layer["colors"]]
+        })
+        if layer["tooltip"]:
+            frame["tooltip"] = layer["tooltip"]
+        return pdk.Layer("PolygonLayer", frame, id=layer_id, get_polygon="polygon", get_fill_color="color",
+                         get_line_color="line", line_width_min_pixels=2, pickable=bool(layer["tooltip"]))
+    if layer["kind"] == "line":
+        frame = pd.DataFrame({"path": [[[lon, lat] for lat, lon in path] for path in layer["paths"]]})
+        if layer["tooltip"]:
+            frame["tooltip"] = layer["tooltip"]
+        return pdk.Layer("PathLayer", frame, id=layer_id, get_path="path", get_color=list(layer["color"]) + [int(layer["opacity"] * 255)],
+                         width_min_pixels=layer["weight"], pickable=bool(layer["tooltip"]))
+    frame = _point_frame(layer)
+    if layer["kind"] == "scatter":
+        return pdk.Layer("ScatterplotLayer", frame, id=layer_id, get_position=["lon", "lat"],
+                         get_fill_color=list(layer["color"]) + [200], get_radius=layer["radius"],
+                         radius_min_pixels=3, pickable=bool(layer["tooltip"]))
+    if layer["kind"] == "hexagon":
+        return pdk.Layer("HexagonLayer", frame, id=layer_id, get_position=["lon", "lat"], radius=HEXAGON_RADIUS_M,
+                         get_color_weight="weight", color_aggregation="SUM", get_elevation_weight="weight",
+                         elevation_aggregation="SUM", elevation_scale=4, extruded=True, opacity=0.6)
+    return pdk.Layer("HeatmapLayer", frame, id=layer_id, get_position=["lon", "lat"], get_weight="weight",
+                     radius_pixels=30, opacity=0.8)
+
+def to_deck(layers, center, zoom):
+    """pydeck Deck drawing all layers, centred on (lat, lon)"""
+    pitch = 40 if any(layer["kind"] == "hexagon" for layer in layers) else 0
+    return pdk.Deck(
+        layers=[to_deck_layer(layer) for layer in layers],
+        initial_view_state=pdk.ViewState(latitude=center[0], longitude=center[1], zoom=zoom, pitch=pitch),
+        tooltip={"text": "{tooltip}"},
+        map_style=None
+    )
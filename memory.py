@@ -0,0 +1,201 @@
+"""Per-session memory accounting for the admin diagnostics view.
+
+At the end of every rerun app.py calls account_session(), which marks
+the session as seen and, at most every ACCOUNT_SECONDS per session,
+measures its st.session_state (map_data, filtered_colleges, widget values
+and the rest) key by key and records it against the session id. It also
+samples the process RSS and the number of active sessions at most every
+RSS_SAMPLE_SECONDS. Sizes are deep sizes: objects shared with module
+globals, such as the college dicts in filtered_colleges, count in full,
+so a session's figure is an upper bound on what it alone costs.
+
+With tracemalloc on (SAFEMAP_TRACEMALLOC=1, or start_tracemalloc from the
+admin panel) every rerun also takes a snapshot; top_allocators diffs the
+latest against the previous rerun's, or against the first one since
+tracing began, to show which source lines are growing. tracemalloc slows
+allocation down, so it is off by default.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from metrics import SESSION_TIMEOUT, register
+
+RSS_SAMPLE_SECONDS = 10
+
+# Seconds between measurements of one session's state; deep_size walks all of it
+ACCOUNT_SECONDS = 30
+RSS_HISTORY = 360
+
+# Frames kept per traced allocation; 1 groups by the allocating line
+TRACEMALLOC_FRAMES = 1
+TRACEMALLOC_ON_START = os.environ.get("SAFEMAP_TRACEMALLOC", "") == "1"
+
+# Largest keys listed per session
+TOP_KEYS = 3
+
+# Not walked into: they belong to the process, not to any session
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+_sessions = {}
+_rss_history = deque(maxlen=RSS_HISTORY)
+_snapshots = {}
+_lock = threading.Lock()
+
+# --- Sizes ---
+
+def deep_size(obj):
+    """Bytes held by an object and everything it references, counting shared objects once"""
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, SHARED_TYPES):
+            continue
+        seen.add(id(item))
+        if isinstance(item, np.ndarray):
+            # Includes the data only when the array owns it, so views and memory maps count as headers
+            total += sys.getsizeof(item)
+            continue
+        if isinstance(item, (pd.DataFrame, pd.Series)):
+            total += int(np.sum(item.memory_usage(deep=True)))
+            continue
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        elif hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+    return total
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Not Linux: peak rather than current RSS (bytes on macOS, KB elsewhere)
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# --- Sessions ---
+
+def account_session(session_id, username, state):
+    """Mark a session as seen, record its state size per key when due, and sample RSS when due
+
+    state is a function returning the session's state dict, only called
+    when the session has not been measured for ACCOUNT_SECONDS.
+    """
+    now = time.time()
+    with _lock:
+        record = _sessions.get(session_id)
+        measure = record is None or now - record["measured"] >= ACCOUNT_SECONDS
+        if not measure:
+            record.update(username=username, seen=now)
+    if measure:
+        key_sizes = {}
+        for key, value in state().items():
+            try:
+                key_sizes[str(key)] = deep_size(value)
+            except Exception:
+                # Widget and third-party values may not walk cleanly; skip rather than fail the rerun
+                continue
+        record = {"username": username, "bytes": sum(key_sizes.values()), "keys": key_sizes, "seen": now, "measured": now}
+    with _lock:
+        _sessions[session_id] = record
+        cutoff = now - SESSION_TIMEOUT
+        for stale in [s for s, record in _sessions.items() if record["seen"] < cutoff]:
+            del _sessions[stale]
+        due = not _rss_history or now - _rss_history[-1]["time"] >= RSS_SAMPLE_SECONDS
+        sessions = len(_sessions)
+    if due:
+        with _lock:
+            _rss_history.append({"time": now, "rss": rss_bytes(), "sessions": sessions})
+    if tracemalloc.is_tracing():
+        take_snapshot()
+
+def session_sizes():
+    """Active sessions' state sizes, largest first, each with its TOP_KEYS largest keys"""
+    with _lock:
+        records = [dict(record, session_id=session_id) for session_id, record in _sessions.items()]
+    for record in records:
+        record["top_keys"] = sorted(record.pop("keys").items(), key=lambda item: -item[1])[:TOP_KEYS]
+    return sorted(records, key=lambda record: -record["bytes"])
+
+def rss_history():
+    """(time, rss, sessions) samples, oldest first"""
+    with _lock:
+        return list(_rss_history)
+
+register("safemap_process_rss_bytes", "gauge", "Resident set size of the server process",
+         collect=lambda: {(): rss_bytes()})
+register("safemap_session_state_bytes", "gauge", "Total deep size of the active sessions' state",
+         collect=lambda: {(): sum(record["bytes"] for record in session_sizes())})
+
+# --- tracemalloc ---
+
+def start_tracemalloc(frames=TRACEMALLOC_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    with _lock:
+        _snapshots.clear()
+
+def stop_tracemalloc():
+    tracemalloc.stop()
+    with _lock:
+        _snapshots.clear()
+
+def take_snapshot():
+    """Snapshot traced allocations; the first since tracing began is kept as the baseline"""
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+    ])
+    with _lock:
+        _snapshots.setdefault("start", snapshot)
+        _snapshots["previous"] = _snapshots.get("latest", snapshot)
+        _snapshots["latest"] = snapshot
+
+def top_allocators(since="previous", limit=10):
+    """Source lines whose traced memory grew the most between snapshots
+
+    since is "previous" (the rerun before the latest) or "start".
+    """
+    with _lock:
+        base, latest = _snapshots.get(since), _snapshots.get("latest")
+    if base is None or latest is None:
+        return []
+    stats = [stat for stat in latest.compare_to(base, "lineno") if stat.size_diff > 0]
+    return [
+        {"where": f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}", "size_diff": stat.size_diff,
+         "count_diff": stat.count_diff, "size": stat.size}
+        for stat in sorted(stats, key=lambda stat: -stat.size_diff)[:limit]
+    ]
+
+def _short_path(filename):
+    """Path relative to site-packages or the working directory, when under either"""
+    if "site-packages" + os.sep in filename:
+        return filename.split("site-packages" + os.sep, 1)[1]
+    return os.path.relpath(filename) if filename.startswith(os.getcwd()) else filename
+
+def traced_memory():
+    """(current, peak) bytes traced by tracemalloc, or None when it is off"""
+    return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+
+if TRACEMALLOC_ON_START:
+    start_tracemalloc()
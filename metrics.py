@@ -0,0 +1,205 @@
+"""Prometheus metrics for a Streamlit server process.
+
+start_metrics_server(), called by app.py, serves every metric below in the
+Prometheus text format at /metrics from a daemon thread inside the server
+process, where the reruns happen. Streamlit only runs app.py for a session,
+so the endpoint comes up with the first session; the warm-up's /readyz
+gates traffic until then anyway. The warm-up's own headless runs of app.py
+start no metrics server. Give each server process its own
+SAFEMAP_METRICS_PORT; Prometheus adds the counters up across targets.
+Scrape it locally with:
+
+    curl -s localhost:9108/metrics
+
+Rerun, map and user-store timings come from the tracing spans, through a
+tracing listener; shared cache hits and misses are this process's own
+counts. Active sessions are the sessions that reran within SESSION_TIMEOUT,
+as reported by session_seen() on every rerun.
+"""
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from shared_cache import local_counts
+from tracing import add_listener
+
+# Local only by default; set SAFEMAP_METRICS_HOST=0.0.0.0 for a Prometheus on another host
+METRICS_HOST = os.environ.get("SAFEMAP_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("SAFEMAP_METRICS_PORT", "9108"))
+
+# Seconds after its last rerun that a session still counts as active
+SESSION_TIMEOUT = 300
+
+# Upper bounds in seconds; reruns and map builds take tens to hundreds of milliseconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STORE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+_metrics = {}
+_sessions = {}
+_lock = threading.Lock()
+_server = None
+_bind_failed = False
+
+# --- Registry ---
+
+def register(name, kind, help_text, buckets=None, collect=None):
+    """Declare a counter, gauge or histogram; collect() returns {labels: value} at scrape time"""
+    with _lock:
+        if name not in _metrics:
+            _metrics[name] = {"type": kind, "help": help_text, "buckets": buckets, "collect": collect, "values": {}}
+    return _metrics[name]
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    """Add to a counter"""
+    key = _labels_key(labels)
+    with _lock:
+        values = _metrics[name]["values"]
+        values[key] = values.get(key, 0) + amount
+
+def observe(name, value, **labels):
+    """Add a sample to a histogram"""
+    metric = _metrics[name]
+    key = _labels_key(labels)
+    with _lock:
+        hist = metric["values"].get(key)
+        if hist is None:
+            hist = metric["values"][key] = {"buckets": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(metric["buckets"]):
+            if value <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+# --- Sources ---
+
+def session_seen(session_id):
+    """Mark a session as active; called on every rerun"""
+    with _lock:
+        _sessions[session_id] = time.time()
+
+def active_sessions():
+    """Sessions that reran within SESSION_TIMEOUT; older ones are forgotten"""
+    cutoff = time.time() - SESSION_TIMEOUT
+    with _lock:
+        for session_id in [s for s, seen in _sessions.items() if seen < cutoff]:
+            del _sessions[session_id]
+        return len(_sessions)
+
+def _cache_requests():
+    values = {}
+    for name, count in local_counts().items():
+        namespace, outcome = name.rsplit(":", 1)
+        values[_labels_key({"namespace": namespace, "result": outcome})] = count
+    return values
+
+# span name: (histogram, labels)
+SPAN_METRICS = {
+    "map.build": ("safemap_map_build_seconds", {}),
+    "user_store.load": ("safemap_user_store_seconds", {"op": "read"}),
+    "user_store.save": ("safemap_user_store_seconds", {"op": "write"})
+}
+
+def observe_span(name, seconds):
+    """Tracing listener: turn rerun and hot-path spans into metrics"""
+    if name.startswith("rerun:"):
+        page = name.split(":", 1)[1]
+        inc("safemap_reruns_total", page=page)
+        observe("safemap_rerun_seconds", seconds, page=page)
+    elif name.startswith("map.render."):
+        observe("safemap_map_render_seconds", seconds, renderer=name.rsplit(".", 1)[1])
+    elif name in SPAN_METRICS:
+        metric, labels = SPAN_METRICS[name]
+        observe(metric, seconds, **labels)
+
+register("safemap_reruns_total", "counter", "Script reruns per page")
+register("safemap_rerun_seconds", "histogram", "Script rerun duration per page", LATENCY_BUCKETS)
+register("safemap_map_build_seconds", "histogram", "Time to build the main map's layers", LATENCY_BUCKETS)
+register("safemap_map_render_seconds", "histogram", "Time to serialise and send the main map, per renderer", LATENCY_BUCKETS)
+register("safemap_user_store_seconds", "histogram", "User store read and write latency", STORE_BUCKETS)
+register("safemap_login_attempts_total", "counter", "Login attempts by result")
+register("safemap_cache_requests_total", "counter", "Shared cache lookups by namespace and result", collect=_cache_requests)
+register("safemap_active_sessions", "gauge", f"Sessions that reran in the last {SESSION_TIMEOUT}s",
+         collect=lambda: {(): active_sessions()})
+
+# --- Exposition ---
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    with _lock:
+        metrics = [(name, dict(m, values=dict(m["values"]))) for name, m in sorted(_metrics.items())]
+    lines = []
+    for name, metric in metrics:
+        values = metric["collect"]() if metric["collect"] else metric["values"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(values.items()):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(key)} {_format_number(value)}")
+                continue
+            # Snapshot under the lock: observe() updates histograms in place
+            with _lock:
+                counts, total, count = list(value["buckets"]), value["sum"], value["count"]
+            for bound, bucket_count in zip(metric["buckets"], counts):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {_format_number(total)}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves /metrics to Prometheus"""
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        data = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics in a daemon thread (once per process); returns its URL, or None when the port is taken
+
+    A failed bind is not retried, so reruns do not try and log it again.
+    """
+    global _server, _bind_failed
+    add_listener(observe_span)
+    with _lock:
+        if _bind_failed:
+            return None
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            except OSError as e:
+                # Another process already has the port; this one goes unscraped
+                _bind_failed = True
+                logger.error("Metrics server could not bind %s:%s (%s); set SAFEMAP_METRICS_PORT per server process",
+                             host, port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return f"http://{host if host != '0.0.0.0' else 'localhost'}:{_server.server_address[1]}/metrics"
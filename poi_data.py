@@ -0,0 +1,479 @@
+"""Points-of-interest catalogue: ingestion and the indexed POI store.
+
+POIs are read from a local OpenStreetMap XML extract (optionally .gz/.bz2),
+a CSV or a GeoJSON dump, their tags mapped onto the map's place categories,
+deduplicated and written to a compact store sorted by grid cell, so the
+places around a point are found with a few binary searches. OSM extracts
+are streamed through expat in two passes, the second collecting only the
+node coordinates that tagged ways refer to, so memory is bounded by the
+number of POIs rather than the size of the extract.
+"""
+import argparse
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import time
+from xml.parsers import expat
+
+import numpy as np
+import pandas as pd
+
+from columnar import column_views, open_columns, write_array, write_columns
+from crime_data import DATA_DIR, REGION_BOUNDS, cell_ids, cell_xy
+
+POI_STORE_FILE = os.path.join(DATA_DIR, "poi_store.npy")
+POI_NAMES_FILE = os.path.join(DATA_DIR, "poi_names.npy")
+POI_META_FILE = os.path.join(DATA_DIR, "poi_store.json")
+
+# The place categories of the map tab that come from the catalogue
+POI_CATEGORIES = ["Apartment", "Cafe", "Restaurant", "Medical", "Market", "Police Station"]
+
+# OSM (key, value) tags per category; a value of None matches any value of the key
+TAG_CATEGORIES = {
+    ("building", "apartments"): "Apartment",
+    ("building", "dormitory"): "Apartment",
+    ("tourism", "apartment"): "Apartment",
+    ("tourism", "hostel"): "Apartment",
+    ("tourism", "guest_house"): "Apartment",
+    ("amenity", "cafe"): "Cafe",
+    ("amenity", "restaurant"): "Restaurant",
+    ("amenity", "fast_food"): "Restaurant",
+    ("amenity", "food_court"): "Restaurant",
+    ("amenity", "hospital"): "Medical",
+    ("amenity", "clinic"): "Medical",
+    ("amenity", "doctors"): "Medical",
+    ("amenity", "pharmacy"): "Medical",
+    ("healthcare", None): "Medical",
+    ("amenity", "marketplace"): "Market",
+    ("shop", "supermarket"): "Market",
+    ("shop", "convenience"): "Market",
+    ("shop", "mall"): "Market",
+    ("shop", "greengrocer"): "Market",
+    ("amenity", "police"): "Police Station"
+}
+TAG_KEYS = sorted({key for key, _ in TAG_CATEGORIES})
+
+# Cells of the store's spatial index (~600 m x 300 m) and of the duplicate check (~150 m x 75 m)
+POI_INDEX_LEVEL = 16
+DEDUPE_LEVEL = 18
+
+POI_CHUNK_ROWS = 50_000
+
+# Longer names are truncated in the store
+MAX_NAME_BYTES = 255
+
+# OSM files are parsed in blocks of this size, so the raw text in memory is bounded too
+OSM_BLOCK_BYTES = 1 << 20
+
+# Places shown around a college
+NEARBY_RADIUS_KM = 1.5
+NEARBY_LIMIT = 50
+
+EARTH_RADIUS_KM = 6371.0088
+
+_store_cache = {}
+
+# --- Readers ---
+
+def tag_category(tags):
+    """Map a dict of OSM-style tags onto a place category, or None"""
+    for key in TAG_KEYS:
+        value = tags.get(key)
+        if value:
+            category = TAG_CATEGORIES.get((key, value)) or TAG_CATEGORIES.get((key, None))
+            if category:
+                return category
+    return None
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+def _parse_osm(path, start, end=None, block_bytes=OSM_BLOCK_BYTES):
+    """Feed an OSM file to an expat parser block by block, yielding after each block"""
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    if end is not None:
+        parser.EndElementHandler = end
+    with _open_text(path) as f:
+        while True:
+            block = f.read(block_bytes)
+            parser.Parse(block, not block)
+            yield
+            if not block:
+                return
+
+def _chunks(records, size=POI_CHUNK_ROWS):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+def read_osm_pois(path):
+    """Stream POI records from an OSM XML extract
+
+    Tagged nodes are emitted in the first pass. Tagged ways (apartment
+    buildings, hospitals, markets) are placed at the mean of their nodes,
+    whose coordinates are collected in a second pass.
+    """
+    records, ways, current = [], [], {}
+
+    def start(name, attrs):
+        if name == "node" or name == "way":
+            current.clear()
+            current.update(kind=name, attrs=attrs, tags={}, refs=[])
+        elif name == "tag" and current:
+            current["tags"][attrs["k"]] = attrs["v"]
+        elif name == "nd" and current:
+            current["refs"].append(int(attrs["ref"]))
+
+    def end(name):
+        if (name == "node" or name == "way") and current:
+            category = tag_category(current["tags"]) if current["tags"] else None
+            if category is not None:
+                attrs, element_id, label = current["attrs"], current["attrs"]["id"], current["tags"].get("name", "")
+                if name == "node":
+                    records.append({"source": f"n{element_id}", "name": label, "category": category,
+                                    "lat": float(attrs["lat"]), "lon": float(attrs["lon"])})
+                else:
+                    ways.append((element_id, label, category, current["refs"]))
+            current.clear()
+
+    for _ in _parse_osm(path, start, end):
+        yield from records
+        records.clear()
+    if not ways:
+        return
+
+    needed = {ref for _, _, _, refs in ways for ref in refs}
+    coords = {}
+
+    def collect(name, attrs):
+        if name == "node":
+            node_id = int(attrs["id"])
+            if node_id in needed:
+                coords[node_id] = (float(attrs["lat"]), float(attrs["lon"]))
+
+    for _ in _parse_osm(path, collect):
+        pass
+    for way_id, name, category, refs in ways:
+        points = [coords[ref] for ref in dict.fromkeys(refs) if ref in coords]
+        if points:
+            yield {"source": f"w{way_id}", "name": name, "category": category,
+                   "lat": sum(p[0] for p in points) / len(points), "lon": sum(p[1] for p in points) / len(points)}
+
+def _frame_categories(df):
+    """Category column from a category column or from OSM tag columns"""
+    if "category" in df.columns:
+        by_name = {c.lower(): c for c in POI_CATEGORIES}
+        return df["category"].astype(str).str.strip().str.lower().map(by_name)
+    tag_columns = [key for key in TAG_KEYS if key in df.columns]
+    return pd.Series([tag_category(row) for row in df[tag_columns].to_dict("records")], index=df.index, dtype=object)
+
+def read_csv_pois(path, chunk_rows=POI_CHUNK_ROWS):
+    """Stream POI frames from a CSV with lat/lon, an optional name and a category or OSM tag columns"""
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=str):
+        chunk.columns = [c.strip().lower() for c in chunk.columns]
+        chunk = chunk.rename(columns={"latitude": "lat", "longitude": "lon", "lng": "lon"})
+        if not {"lat", "lon"}.issubset(chunk.columns):
+            raise ValueError(f"{path} needs lat and lon columns")
+        yield pd.DataFrame({
+            "source": chunk.get("id", pd.Series("", index=chunk.index)).fillna("").astype(str),
+            "name": chunk.get("name", pd.Series("", index=chunk.index)).fillna(""),
+            "category": _frame_categories(chunk),
+            "lat": pd.to_numeric(chunk["lat"], errors="coerce"),
+            "lon": pd.to_numeric(chunk["lon"], errors="coerce"),
+            "fee": pd.to_numeric(chunk.get("fee", chunk.get("rent")), errors="coerce")
+        })
+
+def read_geojson_pois(path):
+    """POI records from a GeoJSON FeatureCollection of points or polygons"""
+    with open(path, "r", encoding="utf-8") as f:
+        features = json.load(f).get("features", [])
+    by_name = {c.lower(): c for c in POI_CATEGORIES}
+    for i, feature in enumerate(features):
+        properties = feature.get("properties") or {}
+        geometry = feature.get("geometry") or {}
+        category = by_name.get(str(properties.get("category", "")).strip().lower()) or tag_category(properties)
+        if geometry.get("type") == "Point":
+            lon, lat = geometry["coordinates"][:2]
+        elif geometry.get("type") == "Polygon" and geometry["coordinates"]:
+            ring = np.asarray(geometry["coordinates"][0], dtype=np.float64)
+            lon, lat = ring[:, 0].mean(), ring[:, 1].mean()
+        else:
+            continue
+        yield {"source": str(feature.get("id", properties.get("id", f"f{i}"))), "name": properties.get("name") or "",
+               "category": category, "lat": float(lat), "lon": float(lon), "fee": properties.get("fee", properties.get("rent"))}
+
+def read_poi_chunks(path, chunk_rows=POI_CHUNK_ROWS):
+    """Yield frames of source, name, category, lat and lon for any supported input file"""
+    name = path.lower()
+    for suffix in (".gz", ".bz2"):
+        name = name[:-len(suffix)] if name.endswith(suffix) else name
+    if name.endswith(".csv"):
+        yield from read_csv_pois(path, chunk_rows)
+    elif name.endswith((".geojson", ".json")):
+        yield from _chunks(read_geojson_pois(path), chunk_rows)
+    elif name.endswith((".osm", ".xml")):
+        yield from _chunks(read_osm_pois(path), chunk_rows)
+    else:
+        raise ValueError(f"Unsupported POI file: {path}")
+
+# --- Cleaning ---
+
+def clean_pois(df, bounds=REGION_BOUNDS):
+    """Drop rows without a known category or with coordinates outside the bounds
+
+    Returns the cleaned frame and the number of rejected rows.
+    """
+    south, west, north, east = bounds
+    valid = (
+        df["category"].isin(POI_CATEGORIES)
+        & df["lat"].between(south, north)
+        & df["lon"].between(west, east)
+    )
+    clean = df[valid].copy()
+    clean["name"] = clean["name"].fillna("").astype(str).str.strip()
+    clean["fee"] = pd.to_numeric(clean["fee"], errors="coerce") if "fee" in clean.columns else np.nan
+    return clean, int((~valid).sum())
+
+def dedupe_pois(df):
+    """Drop repeated source ids, then the same named place within one dedupe cell
+
+    Unnamed places only count as duplicates at (almost) the same position.
+    """
+    df = df[(df["source"] == "") | ~df["source"].duplicated()]
+    name_key = df["name"].str.lower().str.replace(r"\W+", " ", regex=True).str.strip()
+    position = df["lat"].round(5).astype(str) + "," + df["lon"].round(5).astype(str)
+    cell = pd.Series(cell_ids(df["lat"], df["lon"], DEDUPE_LEVEL), index=df.index).astype(str)
+    key = df["category"] + "|" + name_key.where(name_key != "", position) + "|" + cell
+    return df[~key.duplicated()]
+
+# --- Store ---
+
+def _pack_names(names):
+    """Names as one UTF-8 blob plus start/length columns, much smaller than a fixed-width string array"""
+    encoded = [name.encode("utf-8")[:MAX_NAME_BYTES] for name in names]
+    lengths = np.array([len(e) for e in encoded], dtype=np.uint16)
+    starts = np.zeros(len(encoded), dtype=np.uint32)
+    starts[1:] = np.cumsum(lengths[:-1], dtype=np.uint32)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), starts, lengths
+
+def poi_name(store, i):
+    """Name of the i-th POI in the store ("" when it has none)"""
+    start = int(store["name_start"][i])
+    return store["names"][start:start + int(store["name_length"][i])].tobytes().decode("utf-8", errors="ignore")
+
+def _store_version(arrays):
+    digest = hashlib.sha1()
+    for name in ("cell", "lat", "lon", "category_id", "fee", "names"):
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()[:12]
+
+def save_poi_store(df, stats, path=POI_STORE_FILE, meta_path=POI_META_FILE, names_path=POI_NAMES_FILE):
+    """Atomically write the POIs sorted by index cell, with their metadata"""
+    cells = cell_ids(df["lat"], df["lon"], POI_INDEX_LEVEL)
+    order = np.argsort(cells, kind="stable")
+    names, name_start, name_length = _pack_names(df["name"].to_numpy()[order])
+    columns = {
+        "cell": cells[order],
+        "lat": df["lat"].to_numpy(dtype=np.float64)[order],
+        "lon": df["lon"].to_numpy(dtype=np.float64)[order],
+        "category_id": df["category"].map(POI_CATEGORIES.index).to_numpy(dtype=np.uint8)[order],
+        "fee": pd.to_numeric(df["fee"], errors="coerce").to_numpy(dtype=np.float32)[order],
+        "name_start": name_start,
+        "name_length": name_length
+    }
+    meta = dict(stats)
+    meta.update({
+        "version": _store_version(dict(columns, names=names)),
+        "level": POI_INDEX_LEVEL,
+        "categories": POI_CATEGORIES,
+        "pois": int(len(df)),
+        "by_category": {c: int(n) for c, n in df["category"].value_counts().items()},
+        "updated": time.strftime("%Y-%m-%d %H:%M:%S")
+    })
+    # Names first: a reader that sees the new table must find its names
+    write_array(names_path, names)
+    write_columns(path, columns)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=4)
+    os.replace(meta_path + ".tmp", meta_path)
+    return meta
+
+def load_poi_store(path=POI_STORE_FILE, meta_path=POI_META_FILE, names_path=POI_NAMES_FILE):
+    """Load the POI store, or None if it has not been built; cached until the file changes
+
+    Columns and names are read-only memory maps shared with other processes.
+    """
+    if not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    if key not in _store_cache:
+        store = column_views(open_columns(path))
+        store["names"] = open_columns(names_path)
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        meta.setdefault("level", POI_INDEX_LEVEL)
+        if "version" not in meta:
+            meta["version"] = _store_version(store)
+        store["meta"] = meta
+        _store_cache.clear()
+        _store_cache[key] = store
+    return _store_cache[key]
+
+def _store_frame(store):
+    """The stored POIs as a frame, for merging with a new import"""
+    return pd.DataFrame({
+        "source": "",
+        "name": [poi_name(store, i) for i in range(len(store["cell"]))],
+        "category": [POI_CATEGORIES[c] for c in store["category_id"]],
+        "lat": store["lat"].astype(np.float64),
+        "lon": store["lon"].astype(np.float64),
+        "fee": store["fee"].astype(np.float64)
+    })
+
+def ingest_pois(paths, append=False, bounds=REGION_BOUNDS, chunk_rows=POI_CHUNK_ROWS,
+                store_path=POI_STORE_FILE, meta_path=POI_META_FILE, names_path=POI_NAMES_FILE):
+    """Stream POI files into the store and return an ingest report
+
+    By default the import replaces the catalogue; with append=True the new
+    POIs are merged into it, skipping ones already stored.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    report = {"files": list(paths), "rows_read": 0, "rows_rejected": 0, "rows_duplicate": 0}
+    existing = load_poi_store(store_path, meta_path, names_path) if append else None
+    frames = [_store_frame(existing)] if existing is not None else []
+    kept = sum(len(f) for f in frames)
+
+    started = time.perf_counter()
+    for path in paths:
+        for chunk in read_poi_chunks(path, chunk_rows):
+            clean, rejected = clean_pois(chunk, bounds)
+            report["rows_read"] += len(chunk)
+            report["rows_rejected"] += rejected
+            frames.append(clean)
+            # Dedupe as we go so memory holds the catalogue, not every row read
+            if sum(len(f) for f in frames) > 4 * chunk_rows:
+                merged = dedupe_pois(pd.concat(frames, ignore_index=True))
+                frames = [merged]
+
+    pois = dedupe_pois(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame(
+        {"source": [], "name": [], "category": [], "lat": [], "lon": [], "fee": []})
+    report["rows_duplicate"] = kept + report["rows_read"] - report["rows_rejected"] - len(pois)
+    meta = save_poi_store(pois, {k: report[k] for k in ("rows_read", "rows_rejected", "rows_duplicate")},
+                          store_path, meta_path, names_path)
+    report.update({
+        "version": meta["version"],
+        "pois": meta["pois"],
+        "by_category": meta["by_category"],
+        "seconds": round(time.perf_counter() - started, 3)
+    })
+    return report
+
+# --- Queries ---
+
+def pois_in_bounds(store, bounds, category=None):
+    """Indices of stored POIs inside (south, west, north, east), optionally of one category"""
+    south, west, north, east = bounds
+    level = store["meta"]["level"]
+    (ix0, ix1), (iy0, iy1) = cell_xy(cell_ids([south, north], [west, east], level), level)
+    rows = np.arange(iy0, iy1 + 1, dtype=np.int64)
+    starts = np.searchsorted(store["cell"], (rows << level) | ix0, side="left")
+    ends = np.searchsorted(store["cell"], (rows << level) | ix1, side="right")
+    idx = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(rows) else np.array([], dtype=np.int64)
+    idx = idx.astype(np.int64)
+    lat, lon = store["lat"][idx], store["lon"][idx]
+    keep = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+    if category is not None:
+        keep &= store["category_id"][idx] == POI_CATEGORIES.index(category)
+    return idx[keep]
+
+def nearby_places(store, lat, lon, category, radius_km=NEARBY_RADIUS_KM, limit=NEARBY_LIMIT):
+    """Places of a category within radius_km of a point, nearest first
+
+    Returns dicts with "name", "category", "lat", "lon", "fee" (None when
+    unknown) and "distance_km".
+    """
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = dlat / max(np.cos(np.radians(lat)), 1e-6)
+    idx = pois_in_bounds(store, (lat - dlat, lon - dlon, lat + dlat, lon + dlon), category)
+    plat, plon = np.radians(store["lat"][idx].astype(np.float64)), np.radians(store["lon"][idx].astype(np.float64))
+    a = np.sin((plat - np.radians(lat)) / 2) ** 2 + np.cos(np.radians(lat)) * np.cos(plat) * np.sin((plon - np.radians(lon)) / 2) ** 2
+    distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+    order = np.argsort(distance, kind="stable")
+    order = order[distance[order] <= radius_km][:limit]
+    return [
+        {"name": poi_name(store, i), "category": category, "lat": float(store["lat"][i]), "lon": float(store["lon"][i]),
+         "fee": None if np.isnan(store["fee"][i]) else int(store["fee"][i]), "distance_km": round(float(d), 3)}
+        for i, d in zip(idx[order], distance[order])
+    ]
+
+def poi_records(store):
+    """Every stored POI as a dict with name, category, lat and lon"""
+    return [
+        {"name": poi_name(store, i) or POI_CATEGORIES[c], "category": POI_CATEGORIES[c], "lat": float(la), "lon": float(lo)}
+        for i, (c, la, lo) in enumerate(zip(store["category_id"], store["lat"], store["lon"]))
+    ]
+
+# --- Synthetic Data ---
+
+def generate_synthetic_osm(path, pois, centers=None, seed=42, untagged_per_poi=20):
+    """Write a synthetic OSM XML extract with tagged POI nodes and apartment ways among untagged nodes"""
+    rng = np.random.default_rng(seed)
+    centers = np.asarray(centers or [(17.6599, 75.9064), (17.6715, 75.8952), (17.6868, 75.9120)], dtype=np.float64)
+    tag_pairs = [(k, v) for k, v in TAG_CATEGORIES if v is not None]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    node_id, ways = 0, []
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="safemap-synth">\n')
+        for i in range(pois):
+            lat, lon = centers[rng.integers(len(centers))] + rng.normal(0, 0.02, 2)
+            for _ in range(untagged_per_poi):
+                node_id += 1
+                f.write(f'  <node id="{node_id}" lat="{lat + rng.normal(0, 0.001):.7f}" lon="{lon + rng.normal(0, 0.001):.7f}"/>\n')
+            key, value = tag_pairs[rng.integers(len(tag_pairs))]
+            if key == "building":
+                # Buildings are ways over the last four untagged nodes
+                ways.append((i, value, list(range(node_id - 3, node_id + 1))))
+                continue
+            node_id += 1
+            f.write(f'  <node id="{node_id}" lat="{lat:.7f}" lon="{lon:.7f}">\n'
+                    f'    <tag k="{key}" v="{value}"/>\n    <tag k="name" v="{value.replace("_", " ").title()} {i}"/>\n  </node>\n')
+        for i, value, refs in ways:
+            f.write(f'  <way id="{i}">\n' + "".join(f'    <nd ref="{r}"/>\n' for r in refs + refs[:1])
+                    + f'    <tag k="building" v="{value}"/>\n    <tag k="name" v="Residency {i}"/>\n  </way>\n')
+        f.write("</osm>\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Points-of-interest catalogue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="import OSM XML, CSV or GeoJSON POI files into the store")
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("--append", action="store_true", help="merge into the existing store instead of replacing it")
+    synth = sub.add_parser("synth", help="write a synthetic OSM extract")
+    synth.add_argument("path")
+    synth.add_argument("--pois", type=int, default=20_000)
+    synth.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        print(json.dumps(ingest_pois(args.paths, append=args.append), indent=4))
+    else:
+        generate_synthetic_osm(args.path, args.pois, seed=args.seed)
+        print(f"Wrote {args.pois:,} POIs to {args.path}")
+
+if __name__ == "__main__":
+    main()
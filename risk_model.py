@@ -0,0 +1,278 @@
+"""Incremental crime-risk model: probability of an incident per grid cell and hour.
+
+A scikit-learn SGD logistic regression is updated with partial_fit from each
+new batch of binned incidents instead of being retrained from scratch.
+Features are a cell's incident rates from the history before the period
+whose incidents are the labels, so a label is never counted in its own
+features.
+Training runs in a worker process, every update is saved as a versioned
+snapshot, and predictions for every cube cell and hour of day are written
+to RISK_GRID_FILE so the map only has to read them.
+"""
+import argparse
+import glob
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.preprocessing import StandardScaler
+
+from crime_data import DATA_DIR, HEATMAP_MAX_CELLS, cell_centers, cell_xy, cells_to_heatmap, coarsen_cells, load_crime_store
+from crime_cube import CUBE_LEVEL, load_cube
+import workers
+
+MODEL_DIR = os.path.join(DATA_DIR, "models")
+RISK_GRID_FILE = os.path.join(DATA_DIR, "risk_grid.npz")
+
+# Negative (cell, hour) samples drawn per positive one
+NEGATIVE_RATIO = 3
+
+# Snapshots kept on disk
+KEEP_SNAPSHOTS = 5
+
+# A full training run labels this many of the store's last hours, or its later half if shorter
+LABEL_HOURS = 90 * 24
+
+_grid_cache = {}
+
+# --- Features ---
+
+def cell_features(store, cells, before=None):
+    """Per-cell incident rates from the store's bins before an epoch hour (default: all of them)
+
+    Rates are per day of history, so features from a shorter history are on
+    the same scale as those the grid is predicted from.
+    """
+    epoch_hour = np.asarray(store["epoch_hour"], dtype=np.int64)
+    end = int(epoch_hour.max()) + 1 if before is None else before
+    keep = epoch_hour < end
+    bin_cells = coarsen_cells(np.asarray(store["cell"])[keep], store["meta"]["level"], CUBE_LEVEL)
+    pos = np.clip(np.searchsorted(cells, bin_cells), 0, max(len(cells) - 1, 0))
+    found = cells[pos] == bin_cells
+    hourly = np.zeros((len(cells), 24))
+    np.add.at(hourly, (pos[found], epoch_hour[keep][found] % 24), np.asarray(store["count"], dtype=np.float64)[keep][found])
+    hourly /= max((end - int(epoch_hour.min())) / 24.0, 1.0)
+    total = hourly.sum(axis=1)
+
+    # Sum of the 3x3 block of cells around each cell
+    ix, iy = cell_xy(cells, CUBE_LEVEL)
+    neighbourhood = np.zeros(len(total))
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour = ((iy + dy) << CUBE_LEVEL) | (ix + dx)
+            pos = np.clip(np.searchsorted(cells, neighbour), 0, max(len(total) - 1, 0))
+            neighbourhood += np.where(cells[pos] == neighbour, total[pos], 0.0)
+    return {"cells": cells, "hourly": hourly, "total": total, "neighbourhood": neighbourhood}
+
+def label_cutoff(epoch_hour):
+    """First epoch hour of a full training run's label period: the last LABEL_HOURS, or the later half"""
+    first, last = int(np.min(epoch_hour)), int(np.max(epoch_hour))
+    return max(last + 1 - LABEL_HOURS, (first + last + 1) // 2)
+
+def feature_matrix(features, cell_idx, hour):
+    """Model inputs for (cell index, hour of day) pairs"""
+    angle = 2.0 * np.pi * hour / 24.0
+    return np.column_stack([
+        np.log1p(features["total"][cell_idx]),
+        np.log1p(features["hourly"][cell_idx, hour]),
+        np.log1p(features["neighbourhood"][cell_idx]),
+        np.sin(angle),
+        np.cos(angle)
+    ])
+
+def training_samples(bins, features, from_level, rng):
+    """Positive (cell, epoch hour) pairs from new bins plus sampled negatives
+
+    Returns X, y and the fraction of all negative pairs that was sampled,
+    which is needed to undo the sampling bias in predicted probabilities.
+    """
+    cells = coarsen_cells(np.asarray(bins["cell"]), from_level, CUBE_LEVEL)
+    epoch_hour = np.asarray(bins["epoch_hour"], dtype=np.int64)
+    pairs = np.unique(np.column_stack([np.searchsorted(features["cells"], cells), epoch_hour]), axis=0)
+
+    n_cells = len(features["cells"])
+    hours_span = int(epoch_hour.max() - epoch_hour.min() + 1)
+    n_neg = len(pairs) * NEGATIVE_RATIO
+    neg_cells = rng.integers(0, n_cells, n_neg)
+    neg_hours = epoch_hour.min() + rng.integers(0, hours_span, n_neg)
+    negative_space = max(n_cells * hours_span - len(pairs), 1)
+
+    cell_idx = np.concatenate([pairs[:, 0], neg_cells])
+    hour = np.concatenate([pairs[:, 1], neg_hours]) % 24
+    y = np.concatenate([np.ones(len(pairs)), np.zeros(n_neg)])
+    return feature_matrix(features, cell_idx, hour), y, min(n_neg / negative_space, 1.0)
+
+# --- Snapshots ---
+
+def _snapshot_version(path):
+    return int(os.path.basename(path)[len("risk_model_v"):-len(".pkl")])
+
+def _snapshot_paths():
+    """Snapshot files, oldest version first; by number, so v10000 sorts after v9999"""
+    return sorted(glob.glob(os.path.join(MODEL_DIR, "risk_model_v*.pkl")), key=_snapshot_version)
+
+def load_latest_snapshot():
+    """Return the newest model snapshot, or None"""
+    paths = _snapshot_paths()
+    if not paths:
+        return None
+    with open(paths[-1], "rb") as f:
+        return pickle.load(f)
+
+def save_snapshot(snapshot):
+    """Write a new versioned snapshot and prune old ones"""
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = os.path.join(MODEL_DIR, f"risk_model_v{snapshot['version']:04d}.pkl")
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+    for old in _snapshot_paths()[:-KEEP_SNAPSHOTS]:
+        os.remove(old)
+    return path
+
+# --- Training ---
+
+def update_model(bins=None, from_level=None, seed=0):
+    """partial_fit the latest snapshot on a batch of bins and save a new one
+
+    With no bins, the model is trained from scratch on the whole store, its
+    last LABEL_HOURS as labels and the hours before as features. A batch's
+    features come from the store's bins before the batch's first hour. The
+    prediction grid is refreshed afterwards, from features over all bins.
+    """
+    store = load_crime_store()
+    if store is None or len(store["cell"]) == 0:
+        return None
+    cells = load_cube(store)["cells"]
+    snapshot = load_latest_snapshot() if bins is not None else None
+    if bins is None:
+        cutoff = label_cutoff(store["epoch_hour"])
+        label = np.asarray(store["epoch_hour"]) >= cutoff
+        bins = {name: np.asarray(store[name])[label] for name in ("cell", "epoch_hour")}
+        from_level = store["meta"]["level"]
+    elif len(bins["cell"]):
+        cutoff = int(np.min(bins["epoch_hour"]))
+    if len(bins["cell"]) == 0:
+        return snapshot
+
+    rng = np.random.default_rng(seed)
+    X, y, sampled = training_samples(bins, cell_features(store, cells, before=cutoff), from_level, rng)
+    if snapshot is None:
+        snapshot = {
+            "version": 0,
+            "scaler": StandardScaler(),
+            "model": SGDClassifier(loss="log_loss", alpha=1e-4, random_state=seed),
+            "negative_sampling": sampled,
+            "samples": 0
+        }
+        previous = _snapshot_paths()
+        if previous:
+            snapshot["version"] = _snapshot_version(previous[-1])
+
+    snapshot["scaler"].partial_fit(X)
+    snapshot["model"].partial_fit(snapshot["scaler"].transform(X), y, classes=np.array([0.0, 1.0]))
+    # Running average of the negative sampling rate, weighted by batch size
+    total = snapshot["samples"] + len(y)
+    snapshot["negative_sampling"] = (snapshot["negative_sampling"] * snapshot["samples"] + sampled * len(y)) / total
+    snapshot["samples"] = total
+    snapshot["version"] += 1
+    snapshot["store_version"] = store["meta"]["version"]
+    snapshot["trained_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    save_snapshot(snapshot)
+    write_risk_grid(snapshot, cell_features(store, cells))
+    return snapshot
+
+def predict_grid(snapshot, features):
+    """Incident probability for every cube cell and hour of day, shape (cells, 24)"""
+    n = len(features["cells"])
+    cell_idx = np.repeat(np.arange(n), 24)
+    hour = np.tile(np.arange(24), n)
+    X = snapshot["scaler"].transform(feature_matrix(features, cell_idx, hour))
+    p = snapshot["model"].predict_proba(X)[:, 1]
+    # Undo negative sampling: the model saw only a fraction w of the negatives
+    w = max(snapshot["negative_sampling"], 1e-12)
+    p = p / (p + (1.0 - p) / w)
+    return p.reshape(n, 24).astype(np.float32)
+
+def write_risk_grid(snapshot, features, path=RISK_GRID_FILE):
+    """Precompute and save predictions so the map adds no model latency"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, cells=features["cells"], probability=predict_grid(snapshot, features),
+             model_version=np.array(snapshot["version"]), store_version=np.array(snapshot["store_version"]))
+    os.replace(tmp_path, path)
+
+def load_risk_grid(path=RISK_GRID_FILE):
+    """Return the precomputed prediction grid, or None; cached until the file changes"""
+    if not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    if key not in _grid_cache:
+        with np.load(path) as data:
+            grid = {
+                "cells": data["cells"],
+                "probability": data["probability"],
+                "model_version": int(data["model_version"]),
+                "store_version": str(data["store_version"])
+            }
+        _grid_cache.clear()
+        _grid_cache[key] = grid
+    return _grid_cache[key]
+
+def risk_heatmap_points(grid, zoom, hours=None, bounds=None, max_cells=HEATMAP_MAX_CELLS):
+    """Heatmap points of mean predicted incident probability over the given hours"""
+    probability = grid["probability"] if hours is None else grid["probability"][:, list(hours)]
+    cells, mean_p = grid["cells"], probability.mean(axis=1)
+    if bounds is not None:
+        south, west, north, east = bounds
+        lat, lon = cell_centers(cells, CUBE_LEVEL)
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        cells, mean_p = cells[inside], mean_p[inside]
+    return cells_to_heatmap(cells, mean_p, CUBE_LEVEL, zoom, max_cells)
+
+# --- Background Training ---
+
+def training_error():
+    """Why the latest training run failed, or None when none has failed since the last success"""
+    return workers.error("risk_model")
+
+def train_async(bins=None, from_level=None):
+    """Run update_model in a worker process
+
+    Returns the future, or None while a run of the same kind is in progress
+    or within workers.RETRY_SECONDS of one that failed.
+    """
+    if bins is not None:
+        bins = {name: np.asarray(bins[name]) for name in ("cell", "type_id", "epoch_hour", "count")}
+    return workers.submit(("risk_model", "full" if bins is None else "batch"), update_model, bins, from_level)
+
+def training_in_progress():
+    """Whether a full training run is in progress"""
+    return workers.running(("risk_model", "full"))
+
+def ensure_risk_grid():
+    """Return the prediction grid, starting a background training run if there is none
+
+    After a failed run (training_error() says why) the next one starts
+    workers.RETRY_SECONDS later, not on every rerun.
+    """
+    grid = load_risk_grid()
+    if grid is None and load_crime_store() is not None:
+        train_async()
+    return grid
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the crime-risk model from the crime store")
+    parser.parse_args()
+    snapshot = update_model()
+    if snapshot is None:
+        print("No crime store found")
+    else:
+        print(json.dumps({"version": snapshot["version"], "samples": snapshot["samples"],
+                          "store_version": snapshot["store_version"]}, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Shortest and safety-weighted walking routes.
+
+Routes are searched on a road graph read from ROADS_FILE (GeoJSON
+LineStrings) when one is available, otherwise on a regular 8-neighbour
+walking lattice over the city. Safest-route edge weights combine edge length
+with the crime density of the cube cells the edge crosses; those penalties
+are precomputed in a background thread whenever the crime store changes, so
+a route query is a single Dijkstra run.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from crime_data import DATA_DIR, cell_ids, load_crime_store
+from crime_cube import CUBE_LEVEL, load_cube, slice_cube
+
+ROADS_FILE = os.path.join(DATA_DIR, "roads.geojson")
+
+# Area and spacing of the fallback walking lattice
+ROUTING_BOUNDS = (17.58, 75.76, 17.78, 75.98)
+LATTICE_SPACING_KM = 0.1
+
+# How strongly crime density lengthens an edge: an edge through a cell at the
+# city-average density counts as (1 + SAFETY_WEIGHT) times its length
+SAFETY_WEIGHT = 2.0
+
+KM_PER_DEG_LAT = 111.32
+
+_graph_cache = {}
+_penalty_lock = threading.Lock()
+_refreshing = set()
+
+# --- Graph ---
+
+def _km_between(lat1, lon1, lat2, lon2):
+    """Equirectangular distance in km, accurate at street scale"""
+    mean_lat = np.radians((lat1 + lat2) / 2.0)
+    dy = (lat2 - lat1) * KM_PER_DEG_LAT
+    dx = (lon2 - lon1) * KM_PER_DEG_LAT * np.cos(mean_lat)
+    return np.hypot(dx, dy)
+
+def _finish_graph(lat, lon, src, dst, source):
+    """Attach edge lengths and a node index to raw graph arrays"""
+    length = _km_between(lat[src], lon[src], lat[dst], lon[dst])
+    return {
+        "lat": lat,
+        "lon": lon,
+        "src": src,
+        "dst": dst,
+        "length_km": length,
+        "tree": cKDTree(np.column_stack([lat, lon * np.cos(np.radians(lat.mean()))])),
+        "source": source,
+        # Safest-route penalties per time window, filled in by the background refresh
+        "penalties": {}
+    }
+
+def build_lattice_graph(bounds=ROUTING_BOUNDS, spacing_km=LATTICE_SPACING_KM):
+    """Regular 8-neighbour walking lattice over the bounds"""
+    south, west, north, east = bounds
+    d_lat = spacing_km / KM_PER_DEG_LAT
+    d_lon = spacing_km / (KM_PER_DEG_LAT * np.cos(np.radians((south + north) / 2.0)))
+    rows = int(np.ceil((north - south) / d_lat)) + 1
+    cols = int(np.ceil((east - west) / d_lon)) + 1
+    grid_lat, grid_lon = np.meshgrid(south + np.arange(rows) * d_lat, west + np.arange(cols) * d_lon, indexing="ij")
+    node = np.arange(rows * cols).reshape(rows, cols)
+
+    src, dst = [], []
+    for dr, dc in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        c0, c1 = (0, cols - dc) if dc >= 0 else (-dc, cols)
+        src.append(node[0:rows - dr, c0:c1].ravel())
+        dst.append(node[dr:rows, c0 + dc:c1 + dc].ravel())
+    return _finish_graph(grid_lat.ravel(), grid_lon.ravel(), np.concatenate(src), np.concatenate(dst), "lattice")
+
+def load_road_graph(path=ROADS_FILE):
+    """Road graph from GeoJSON LineStrings; vertices closer than ~1 m are merged"""
+    with open(path, "r") as f:
+        features = json.load(f).get("features", [])
+
+    coords, src, dst = [], [], []
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "LineString":
+            lines = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiLineString":
+            lines = geometry["coordinates"]
+        else:
+            continue
+        for line in lines:
+            start = len(coords)
+            coords.extend((pt[1], pt[0]) for pt in line)
+            src.extend(range(start, len(coords) - 1))
+            dst.extend(range(start + 1, len(coords)))
+
+    coords = np.round(np.asarray(coords, dtype=np.float64), 5)
+    unique, inverse = np.unique(coords, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    src, dst = inverse[np.asarray(src)], inverse[np.asarray(dst)]
+    keep = src != dst
+    return _finish_graph(unique[:, 0], unique[:, 1], src[keep], dst[keep], "roads")
+
+def get_graph():
+    """Road graph if ROADS_FILE exists, else the walking lattice; cached per process"""
+    key = os.path.getmtime(ROADS_FILE) if os.path.exists(ROADS_FILE) else None
+    if key not in _graph_cache:
+        _graph_cache.clear()
+        _graph_cache[key] = load_road_graph() if key is not None else build_lattice_graph()
+    return _graph_cache[key]
+
+def _adjacency(graph, weights):
+    """Symmetric sparse adjacency matrix for the given edge weights
+
+    csr_matrix adds up repeated entries, so edges between the same two nodes
+    (overlapping ways, or a segment listed in both directions) are reduced
+    to the lightest one first.
+    """
+    n = len(graph["lat"])
+    pairs = np.sort(np.column_stack([graph["src"], graph["dst"]]), axis=1)
+    order = np.lexsort((weights, pairs[:, 1], pairs[:, 0]))
+    pairs, weights = pairs[order], np.asarray(weights)[order]
+    first = np.ones(len(pairs), dtype=bool)
+    first[1:] = np.any(pairs[1:] != pairs[:-1], axis=1)
+    src, dst, weights = pairs[first, 0], pairs[first, 1], weights[first]
+    rows = np.concatenate([src, dst])
+    cols = np.concatenate([dst, src])
+    return csr_matrix((np.concatenate([weights, weights]), (rows, cols)), shape=(n, n))
+
+# --- Crime Penalties ---
+
+def edge_crime_density(graph, cube, hours=None):
+    """Relative crime density along each edge (1.0 = city-average cell)
+
+    Each edge is sampled at both ends and its midpoint, and the densities of
+    the cube cells under those samples are averaged.
+    """
+    cells, counts = slice_cube(cube, hours=hours)
+    if not len(cells):
+        return np.zeros(len(graph["src"]))
+    mean_count = counts.mean()
+
+    lat, lon = graph["lat"], graph["lon"]
+    src, dst = graph["src"], graph["dst"]
+    samples = [
+        (lat[src], lon[src]),
+        ((lat[src] + lat[dst]) / 2.0, (lon[src] + lon[dst]) / 2.0),
+        (lat[dst], lon[dst])
+    ]
+    density = np.zeros(len(src))
+    for sample_lat, sample_lon in samples:
+        sample_cells = cell_ids(sample_lat, sample_lon, CUBE_LEVEL)
+        pos = np.clip(np.searchsorted(cells, sample_cells), 0, len(cells) - 1)
+        density += np.where(cells[pos] == sample_cells, counts[pos], 0.0)
+    return density / len(samples) / mean_count
+
+def compute_edge_weights(graph, store_version, hours=None):
+    """Precompute the safest-route adjacency for a store version and time window"""
+    density = edge_crime_density(graph, load_cube(), hours)
+    weights = graph["length_km"] * (1.0 + SAFETY_WEIGHT * density)
+    return {
+        "version": store_version,
+        "adjacency": _adjacency(graph, weights),
+        "density": density
+    }
+
+def _refresh(graph, store_version, hours_key):
+    try:
+        penalties = compute_edge_weights(graph, store_version, list(hours_key) if hours_key else None)
+        with _penalty_lock:
+            graph["penalties"][hours_key] = penalties
+    finally:
+        with _penalty_lock:
+            _refreshing.discard(hours_key)
+
+def refresh_penalties_async(graph, store_version, hours=None):
+    """Start a background refresh of edge penalties unless one is running"""
+    hours_key = tuple(hours) if hours is not None else None
+    with _penalty_lock:
+        if hours_key in _refreshing:
+            return
+        _refreshing.add(hours_key)
+    threading.Thread(target=_refresh, args=(graph, store_version, hours_key), daemon=True).start()
+
+def get_safety_weights(graph, hours=None, wait=False):
+    """Current safest-route penalties, refreshing them in the background when stale
+
+    Returns the latest available penalties (possibly for an older store
+    version while the refresh runs), or None when none have been computed
+    yet. With wait=True, the first computation runs inline instead.
+    """
+    store = load_crime_store()
+    if store is None:
+        return None
+    version = store["meta"]["version"]
+    hours_key = tuple(hours) if hours is not None else None
+    with _penalty_lock:
+        current = graph["penalties"].get(hours_key)
+    if current is None and wait:
+        current = compute_edge_weights(graph, version, hours)
+        with _penalty_lock:
+            graph["penalties"][hours_key] = current
+    elif current is None or current["version"] != version:
+        refresh_penalties_async(graph, version, hours)
+    return current
+
+# --- Routing ---
+
+def nearest_node(graph, lat, lon):
+    """Index of the graph node closest to a coordinate"""
+    scale = np.cos(np.radians(graph["lat"].mean()))
+    _, idx = graph["tree"].query([lat, lon * scale])
+    return int(idx)
+
+def find_route(graph, origin, destination, penalties=None):
+    """Route between two (lat, lon) points
+
+    Uses plain edge length, or the safety-weighted adjacency when penalties
+    are given. Returns the path coordinates, its length and its crime
+    exposure (length-weighted relative density).
+    """
+    start = nearest_node(graph, *origin)
+    end = nearest_node(graph, *destination)
+    adjacency = penalties["adjacency"] if penalties else _length_adjacency(graph)
+    _, predecessors = dijkstra(adjacency, directed=False, indices=start, return_predecessors=True)
+
+    path = [end]
+    while path[-1] != start and predecessors[path[-1]] >= 0:
+        path.append(int(predecessors[path[-1]]))
+    if path[-1] != start:
+        return None
+    path.reverse()
+
+    lat, lon = graph["lat"][path], graph["lon"][path]
+    seg_km = _km_between(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    route = {
+        "nodes": path,
+        "coords": np.column_stack([lat, lon]).tolist(),
+        "length_km": round(float(seg_km.sum()), 2),
+        "exposure": None
+    }
+    if penalties:
+        density = _path_density(graph, penalties["density"], np.asarray(path))
+        route["exposure"] = round(float((seg_km * density).sum()), 2)
+    return route
+
+def _length_adjacency(graph):
+    if "length_adjacency" not in graph:
+        graph["length_adjacency"] = _adjacency(graph, graph["length_km"])
+    return graph["length_adjacency"]
+
+def _path_density(graph, edge_density, path):
+    """Relative crime density of each consecutive edge on a node path"""
+    if "edge_lookup" not in graph:
+        n = len(graph["lat"])
+        keys = np.concatenate([graph["src"] * n + graph["dst"], graph["dst"] * n + graph["src"]])
+        order = np.argsort(keys)
+        graph["edge_lookup"] = (keys[order], np.concatenate([np.arange(len(graph["src"]))] * 2)[order])
+    keys, edge_idx = graph["edge_lookup"]
+    n = len(graph["lat"])
+    pos = np.searchsorted(keys, path[:-1] * n + path[1:])
+    return edge_density[edge_idx[pos]]
+
+def route_exposure(graph, route, penalties):
+    """Crime exposure of an existing route under the given penalties"""
+    path = np.asarray(route["nodes"])
+    lat, lon = graph["lat"][path], graph["lon"][path]
+    seg_km = _km_between(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    return round(float((seg_km * _path_density(graph, penalties["density"], path)).sum()), 2)
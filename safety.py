@@ -0,0 +1,105 @@
+"""Per-college safety scores from kernel density of nearby crime incidents."""
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from crime_data import aggregate_cells, cell_centers
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Radii (km) the kernel density is evaluated at; the score averages them
+SAFETY_RADII_KM = (0.5, 1.0, 2.0)
+
+# Incidents are indexed at this grid level (~150 m x 75 m cells)
+SAFETY_INDEX_LEVEL = 18
+
+# Score bands for the risk label
+RISK_LEVELS = [(70, "Low"), (40, "Moderate"), (0, "High")]
+
+_index_cache = {}
+_score_cache = {}
+
+def build_incident_index(store, level=SAFETY_INDEX_LEVEL):
+    """Build a haversine BallTree over occupied cells, cached per store version"""
+    key = (store["meta"]["version"], level)
+    if key not in _index_cache:
+        cells, counts = aggregate_cells(store, level)
+        lat, lon = cell_centers(cells, level)
+        coords = np.radians(np.column_stack([lat, lon]))
+        _index_cache.clear()
+        _index_cache[key] = {
+            "tree": BallTree(coords, metric="haversine"),
+            "counts": counts,
+            "reference_density": _reference_density(lat, lon, counts)
+        }
+    return _index_cache[key]
+
+def _reference_density(lat, lon, counts):
+    """City-wide average incidents per km² over the occupied area"""
+    if len(counts) == 0:
+        return 1.0
+    height = (lat.max() - lat.min()) * 111.32
+    width = (lon.max() - lon.min()) * 111.32 * np.cos(np.radians(lat.mean()))
+    return float(counts.sum()) / max(height * width, 1.0)
+
+def kernel_densities(index, lat, lon, radii_km=SAFETY_RADII_KM):
+    """Epanechnikov kernel density (incidents per km²) around each point
+
+    Returns an array of shape (len(lat), len(radii_km)).
+    """
+    radii = np.asarray(radii_km, dtype=np.float64)
+    points = np.radians(np.column_stack([lat, lon]))
+    neighbours, distances = index["tree"].query_radius(points, r=radii.max() / EARTH_RADIUS_KM, return_distance=True)
+
+    sizes = np.array([len(n) for n in neighbours])
+    densities = np.zeros((len(points), len(radii)))
+    if sizes.sum() == 0:
+        return densities
+    owner = np.repeat(np.arange(len(points)), sizes)
+    dist_km = np.concatenate(distances) * EARTH_RADIUS_KM
+    counts = index["counts"][np.concatenate(neighbours)]
+
+    # (neighbours x radii) kernel weights, normalised so each kernel integrates to 1
+    u = dist_km[:, None] / radii[None, :]
+    weights = np.where(u < 1.0, 1.0 - u ** 2, 0.0) * counts[:, None]
+    norm = np.pi * radii ** 2 / 2.0
+    for k in range(len(radii)):
+        densities[:, k] = np.bincount(owner, weights=weights[:, k], minlength=len(points)) / norm[k]
+    return densities
+
+def risk_level(score):
+    """Map a safety score to a Low/Moderate/High risk label"""
+    for threshold, label in RISK_LEVELS:
+        if score >= threshold:
+            return label
+    return RISK_LEVELS[-1][1]
+
+def compute_safety_scores(store, colleges, radii_km=SAFETY_RADII_KM):
+    """Score every college 0-100, where 50 is the city-wide average density
+
+    Results are cached per store version, radii and college list.
+    """
+    radii_km = tuple(radii_km)
+    key = (store["meta"]["version"], radii_km, tuple(c["name"] for c in colleges))
+    if key in _score_cache:
+        return _score_cache[key]
+
+    index = build_incident_index(store)
+    lat = np.array([c["lat"] for c in colleges], dtype=np.float64)
+    lon = np.array([c["lon"] for c in colleges], dtype=np.float64)
+    densities = kernel_densities(index, lat, lon, radii_km)
+    relative = densities.mean(axis=1) / index["reference_density"]
+    scores = 100.0 / (1.0 + relative)
+
+    results = {}
+    for i, college in enumerate(colleges):
+        score = round(float(scores[i]), 1)
+        results[college["name"]] = {
+            "score": score,
+            "risk_level": risk_level(score),
+            "densities": {r: round(float(d), 2) for r, d in zip(radii_km, densities[i])}
+        }
+
+    if len(_score_cache) >= 16:
+        _score_cache.clear()
+    _score_cache[key] = results
+    return results
@@ -0,0 +1,174 @@
+"""In-process scheduler for periodic background jobs.
+
+Jobs are registered with an interval and a concurrency limit and run on a
+small thread pool, outside any user rerun. One daemon thread wakes every
+TICK_SECONDS and submits the jobs that are due. Jobs that do CPU-heavy
+work hand it to the existing spawn process pools (hotspots, risk model)
+and wait for the result.
+
+Every Streamlit server process runs its own scheduler. Host-wide jobs
+claim one of max_concurrent lock-file slots in LOCK_DIR before running
+and leave a stamp file when they finish; a process skips a scheduled run
+when the stamp shows another process on the host ran the job within the
+interval, so each job runs about once per interval per host. Jobs registered
+with per_process=True, such as flushing a process's own buffers, only
+count runs in their own process. Each job keeps stats (runs, failures,
+skips, the last start, its duration and its result or error) for the
+admin status panel.
+"""
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): limits then apply per process only
+    fcntl = None
+
+from crime_data import DATA_DIR
+
+LOCK_DIR = os.path.join(DATA_DIR, "locks")
+SCHEDULER_WORKERS = 4
+TICK_SECONDS = 1.0
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = None
+_thread = None
+
+# --- Jobs ---
+
+def add_job(name, func, every, max_concurrent=1, initial_delay=None, per_process=False, description=""):
+    """Register a job to run every `every` seconds, or replace its function and schedule
+
+    The first run is after initial_delay seconds (default: one interval).
+    Stats are kept when a job is registered again, as app reruns do.
+    """
+    with _lock:
+        job = _jobs.get(name)
+        if job is None:
+            job = _jobs[name] = {
+                "name": name, "running": 0, "runs": 0, "failures": 0, "skipped": 0,
+                "last_started": None, "last_seconds": None, "last_result": None, "last_error": None,
+                "next_run": time.time() + (every if initial_delay is None else initial_delay)
+            }
+        elif job.get("every") != every:
+            job["next_run"] = min(job["next_run"], time.time() + every)
+        job.update(func=func, every=every, max_concurrent=max_concurrent, per_process=per_process, description=description)
+    return job
+
+def _claim_slot(job):
+    """Lock a free host-wide slot file for the job
+
+    Returns the open file, None when every slot is taken, or False when the
+    job needs no host-wide lock.
+    """
+    if fcntl is None or job["per_process"]:
+        return False
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    for slot in range(job["max_concurrent"]):
+        f = open(os.path.join(LOCK_DIR, f"{job['name']}.{slot}.lock"), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            f.close()
+    return None
+
+def _run(job, slot):
+    started = time.perf_counter()
+    try:
+        result = job["func"]()
+        error = None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finally:
+        if slot:
+            with open(_stamp_path(job), "a"):
+                os.utime(_stamp_path(job))
+            slot.close()
+    with _lock:
+        job["running"] -= 1
+        job["runs"] += 1
+        job["last_seconds"] = round(time.perf_counter() - started, 3)
+        job["last_result"] = None if result is None else str(result)[:200]
+        job["last_error"] = error
+        if error:
+            job["failures"] += 1
+
+def _submit(job, forced=False):
+    """Start a job run unless it is at its concurrency limit; returns whether it started"""
+    with _lock:
+        if job["running"] >= job["max_concurrent"]:
+            job["skipped"] += 1
+            return False
+        job["running"] += 1
+    slot = _claim_slot(job)
+    if slot and not forced and _ran_elsewhere(job):
+        slot.close()
+        slot = None
+    if slot is None:
+        # Another process on this host is running it, or just did
+        with _lock:
+            job["running"] -= 1
+            job["skipped"] += 1
+        return False
+    with _lock:
+        job["last_started"] = time.time()
+    _get_executor().submit(_run, job, slot)
+    return True
+
+def run_job_now(name):
+    """Run a job immediately, outside its schedule; returns whether it started"""
+    job = _jobs.get(name)
+    return job is not None and _submit(job, forced=True)
+
+def _stamp_path(job):
+    return os.path.join(LOCK_DIR, f"{job['name']}.last")
+
+def _ran_elsewhere(job):
+    """Whether any process on the host finished the job within most of its interval"""
+    try:
+        return time.time() - os.path.getmtime(_stamp_path(job)) < 0.9 * job["every"]
+    except OSError:
+        return False
+
+# --- Scheduler Loop ---
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS, thread_name_prefix="scheduler")
+    return _executor
+
+def _loop():
+    while True:
+        now = time.time()
+        with _lock:
+            due = [job for job in _jobs.values() if job["next_run"] <= now]
+            for job in due:
+                job["next_run"] = now + job["every"]
+        try:
+            for job in due:
+                _submit(job)
+        except RuntimeError:
+            # The interpreter is exiting and thread pools take no more work
+            return
+        time.sleep(TICK_SECONDS)
+
+def start_scheduler():
+    """Start the scheduler thread once per process"""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_loop, name="scheduler", daemon=True)
+            _thread.start()
+
+def job_status():
+    """Schedule and last-run stats for every registered job"""
+    with _lock:
+        return [{key: value for key, value in job.items() if key != "func"} for job in _jobs.values()]
@@ -0,0 +1,619 @@
+"""Cross-process cache for computed artefacts: maps, figures, distances and scores.
+
+Streamlit runs several server processes, and anything memoised in one of
+them (or in st.session_state) is recomputed by every other. Values cached
+here are serialised into a backend all of them share, chosen by
+SAFEMAP_CACHE_URL:
+
+- unset or sqlite:///path: a SQLite file on local disk (CACHE_FILE), shared
+  by the processes on one host;
+- redis://[:password@]host:port/db: any Redis-protocol server, spoken over
+  RESP without a client library, shared across hosts. start_resp_server
+  runs a small in-process stand-in for local use and checks.
+
+Entries expire after their TTL. The SQLite backend evicts the least recently
+used entries once the file holds more than CACHE_MAX_BYTES; a Redis server
+applies its own maxmemory policy, where volatile-lru keeps the hit counters,
+which have no TTL. Hits and misses are counted per namespace
+in the backend, so the hit rate covers every process.
+
+Values are stored as JSON, raw bytes or a numpy .npy array, never pickled,
+so whoever can write to the backend cannot run code in the app. JSON keeps
+dicts with number keys (tagged) but turns tuples into lists; anything else
+is not cached and is recomputed each time.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import numpy as np
+
+from crime_data import DATA_DIR
+
+CACHE_FILE = os.path.join(DATA_DIR, "shared_cache.sqlite")
+CACHE_URL = os.environ.get("SAFEMAP_CACHE_URL", "")
+CACHE_MAX_BYTES = int(os.environ.get("SAFEMAP_CACHE_MAX_MB", "256")) * 1024 * 1024
+DEFAULT_TTL = 6 * 3600
+
+# Eviction frees space down to this fraction of the limit, so it runs in batches
+EVICT_TO = 0.9
+
+# Hit and miss counts are written to the backend at most this often per process
+COUNTER_FLUSH_SECONDS = 5.0
+
+# Keys are namespaced so a shared Redis server can hold other data too
+KEY_PREFIX = "safemap:"
+
+REDIS_TIMEOUT = 2.0
+RESP_SERVER_HOST = "127.0.0.1"
+RESP_SERVER_PORT = 6380
+
+_backend = None
+_backend_lock = threading.Lock()
+_counts = {}
+_totals = {}
+_counts_lock = threading.Lock()
+_last_flush = [time.monotonic()]
+
+# --- SQLite Backend ---
+
+class SQLiteBackend:
+    """Cache entries in a SQLite file, safe to share between processes"""
+    name = "sqlite"
+
+    def __init__(self, path=CACHE_FILE, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL lets readers in other processes carry on while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires REAL, accessed REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            self._track_bytes(conn)
+            self._local.conn = conn
+        return conn
+
+    def _track_bytes(self, conn):
+        """Keep the stored bytes in a totals row, updated by triggers, so eviction needs no SUM scan
+
+        Created in one transaction with the row's first value, so a file
+        written before the triggers existed starts from its true total.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO totals SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS entries_inserted AFTER INSERT ON entries "
+                         "BEGIN UPDATE totals SET value = value + NEW.size WHERE name = 'bytes'; END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS entries_deleted AFTER DELETE ON entries "
+                         "BEGIN UPDATE totals SET value = value - OLD.size WHERE name = 'bytes'; END")
+            conn.execute("CREATE TRIGGER IF NOT EXISTS entries_resized AFTER UPDATE OF size ON entries "
+                         "BEGIN UPDATE totals SET value = value + NEW.size - OLD.size WHERE name = 'bytes'; END")
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM entries WHERE key = ? AND expires < ?", (key, now))
+            return None
+        conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        now = time.time()
+        # An upsert, not INSERT OR REPLACE: REPLACE deletes the old row without firing the delete trigger
+        conn.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+            "value = excluded.value, size = excluded.size, expires = excluded.expires, accessed = excluded.accessed",
+            (key, value, len(value), now + ttl, now)
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        total = conn.execute("SELECT value FROM totals WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Least recently used first, until the running total covers the excess
+        excess = total - int(self.max_bytes * EVICT_TO)
+        evicted = conn.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM (SELECT key, size, SUM(size) OVER (ORDER BY accessed, key) AS running FROM entries) WHERE running - size < ?)",
+            (excess,)
+        ).rowcount
+        self.incr({"evictions": evicted})
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM entries")
+        conn.execute("DELETE FROM counters")
+
+    def incr(self, amounts):
+        self._conn().executemany(
+            "INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(amounts.items())
+        )
+
+    def counters(self):
+        return dict(self._conn().execute("SELECT name, value FROM counters").fetchall())
+
+    def size(self):
+        """(entries, bytes) currently stored"""
+        return tuple(self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE expires >= ?", (time.time(),)).fetchone())
+
+# --- Redis Backend ---
+
+def encode_command(args):
+    """A command as a RESP array of bulk strings"""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+def read_reply(reader):
+    """Read one RESP reply from a binary file object"""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed by the cache server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode("utf-8")
+    if kind == b"-":
+        raise RuntimeError(body.decode("utf-8"))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("connection closed by the cache server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        return None if length < 0 else [read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"unexpected reply from the cache server: {line[:40]!r}")
+
+class RedisBackend:
+    """Cache entries on a Redis-protocol server, one connection per thread"""
+    name = "redis"
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self.password = parsed.password
+        self.db = int(parsed.path.strip("/") or 0)
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=REDIS_TIMEOUT)
+        self._local.sock, self._local.reader = sock, sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = self._local.reader = None
+
+    def _send(self, *args):
+        self._local.sock.sendall(encode_command(args))
+        return read_reply(self._local.reader)
+
+    def command(self, *args):
+        """Run one command, reconnecting once if the connection dropped"""
+        for attempt in range(2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._connect()
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+
+    def _scan(self, pattern):
+        cursor, keys = "0", []
+        while True:
+            cursor, batch = self.command("SCAN", cursor, "MATCH", pattern, "COUNT", 1000)
+            keys += batch
+            if cursor in (b"0", "0"):
+                return keys
+
+    def get(self, key):
+        return self.command("GET", KEY_PREFIX + key)
+
+    def set(self, key, value, ttl):
+        self.command("SET", KEY_PREFIX + key, value, "EX", max(int(ttl), 1))
+
+    def delete(self, key):
+        self.command("DEL", KEY_PREFIX + key)
+
+    def clear(self):
+        keys = self._scan(KEY_PREFIX + "*")
+        for i in range(0, len(keys), 500):
+            self.command("DEL", *keys[i:i + 500])
+
+    def incr(self, amounts):
+        for name, amount in amounts.items():
+            self.command("INCRBY", f"{KEY_PREFIX}counter:{name}", amount)
+
+    def _info(self, section):
+        info = self.command("INFO", section).decode("utf-8")
+        return dict(line.split(":", 1) for line in info.splitlines() if ":" in line)
+
+    def counters(self):
+        """Hit and miss counts, with evictions taken from the server's evicted_keys"""
+        keys = self._scan(f"{KEY_PREFIX}counter:*")
+        prefix = len(f"{KEY_PREFIX}counter:")
+        values = self.command("MGET", *keys) if keys else []
+        counters = {key.decode("utf-8")[prefix:]: int(value) for key, value in zip(keys, values) if value is not None}
+        counters["evictions"] = int(self._info("stats").get("evicted_keys", 0))
+        return counters
+
+    def size(self):
+        """(entries, bytes); bytes is the server's whole used_memory"""
+        entries = len(self._scan(KEY_PREFIX + "*")) - len(self._scan(f"{KEY_PREFIX}counter:*"))
+        return entries, int(self._info("memory").get("used_memory", 0))
+
+# --- Local RESP Server ---
+
+class RespHandler(socketserver.StreamRequestHandler):
+    """Answers the subset of Redis commands RedisBackend uses"""
+    store = None
+
+    def handle(self):
+        while True:
+            try:
+                args = read_reply(self.rfile)
+            except (ConnectionError, ValueError, OSError):
+                return
+            if not isinstance(args, list) or not args:
+                return
+            try:
+                reply = self.store.execute(args[0].decode("utf-8").upper(), args[1:])
+            except (RuntimeError, ValueError, IndexError) as e:
+                reply = RuntimeError(f"ERR {e}")
+            self.wfile.write(encode_reply(reply))
+
+def encode_reply(value):
+    if isinstance(value, RuntimeError):
+        return b"-%s\r\n" % str(value).encode("utf-8")
+    if value is True:
+        return b"+OK\r\n"
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(v) for v in value)
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+class RespStore:
+    """In-memory key store with expiry and LRU eviction past max_bytes"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.time():
+            self._delete(key)
+            return None
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def _delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
+        return entry is not None
+
+    def _set(self, key, value, expires):
+        self._delete(key)
+        self.entries[key] = (value, expires)
+        self.bytes += len(value)
+        # Like Redis's volatile-lru policy: only keys with a TTL are evicted, so counters survive
+        while self.bytes > self.max_bytes:
+            victim = next((k for k, (_, e) in self.entries.items() if e is not None and k != key), None)
+            if victim is None:
+                break
+            self._delete(victim)
+            self.evicted += 1
+
+    def execute(self, command, args):
+        with self.lock:
+            if command == "PING":
+                return "PONG"
+            if command in ("AUTH", "SELECT"):
+                return True
+            if command == "GET":
+                entry = self._get(args[0])
+                return entry[0] if entry else None
+            if command == "MGET":
+                return [entry[0] if entry else None for entry in map(self._get, args)]
+            if command == "SET":
+                options = [a.decode("utf-8").upper() for a in args[2:]]
+                expires = time.time() + int(options[options.index("EX") + 1]) if "EX" in options else None
+                self._set(args[0], args[1], expires)
+                return True
+            if command == "DEL":
+                return sum(self._delete(key) for key in args)
+            if command == "INCRBY":
+                entry = self._get(args[0])
+                value = int(entry[0] if entry else 0) + int(args[1])
+                self._set(args[0], str(value).encode("utf-8"), entry[1] if entry else None)
+                return value
+            if command == "SCAN":
+                options = [a.decode("utf-8") for a in args[1:]]
+                prefix = options[options.index("MATCH") + 1].rstrip("*").encode("utf-8") if "MATCH" in options else b""
+                now = time.time()
+                return ["0", [key for key, (_, expires) in self.entries.items()
+                              if key.startswith(prefix) and (expires is None or expires >= now)]]
+            if command == "DBSIZE":
+                return len(self.entries)
+            if command == "FLUSHDB":
+                self.entries.clear()
+                self.bytes = 0
+                return True
+            if command == "INFO":
+                return f"# Memory\r\nused_memory:{self.bytes}\r\n# Stats\r\nevicted_keys:{self.evicted}\r\n"
+        raise RuntimeError(f"unknown command '{command}'")
+
+def start_resp_server(host=RESP_SERVER_HOST, port=RESP_SERVER_PORT, max_bytes=CACHE_MAX_BYTES):
+    """Run a local Redis-protocol stand-in in a daemon thread; port 0 picks a free port"""
+    handler = type("LocalRespHandler", (RespHandler,), {"store": RespStore(max_bytes)})
+    server = socketserver.ThreadingTCPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# --- Cache API ---
+
+CACHE_ERRORS = (OSError, ConnectionError, RuntimeError, sqlite3.Error)
+
+# Raised by dumps for values it cannot store, and by loads for blobs it cannot read
+VALUE_ERRORS = (TypeError, ValueError, KeyError)
+
+# First byte of a stored value: what follows it
+JSON_VALUE, BYTES_VALUE, ARRAY_VALUE = b"j", b"b", b"n"
+
+def _to_json(value):
+    """JSON-ready copy of a value; dicts with non-string keys become tagged [key, value] lists"""
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: _to_json(v) for k, v in value.items()}
+        return {"__items__": [[_to_json(k), _to_json(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _from_json(value):
+    if isinstance(value, dict):
+        if list(value) == ["__items__"]:
+            return {_key(_from_json(k)): _from_json(v) for k, v in value["__items__"]}
+        return {k: _from_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    return value
+
+def _key(key):
+    return tuple(map(_key, key)) if isinstance(key, list) else key
+
+def dumps(value):
+    """Bytes to store for a value: raw bytes, a numpy .npy array or JSON"""
+    if isinstance(value, bytes):
+        return BYTES_VALUE + value
+    if isinstance(value, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return ARRAY_VALUE + buffer.getvalue()
+    return JSON_VALUE + json.dumps(_to_json(value), separators=(",", ":")).encode("utf-8")
+
+def loads(blob):
+    """Value from stored bytes; raises ValueError for anything dumps did not write"""
+    kind, body = blob[:1], blob[1:]
+    if kind == BYTES_VALUE:
+        return bytes(body)
+    if kind == ARRAY_VALUE:
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    if kind == JSON_VALUE:
+        return _from_json(json.loads(body))
+    raise ValueError("not a shared cache value")
+
+def open_backend(url=CACHE_URL):
+    """Backend for a cache URL: redis://... or sqlite:///path, SQLite at CACHE_FILE when empty"""
+    if url.startswith("redis://"):
+        return RedisBackend(url)
+    if url.startswith("sqlite://"):
+        return SQLiteBackend(urlparse(url).path or CACHE_FILE)
+    return SQLiteBackend()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend()
+    return _backend
+
+def set_backend(backend):
+    """Switch this process to another backend, returning the previous one"""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+def cache_key(*parts):
+    """Short stable key for any values with a deterministic repr"""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+def _count(namespace, outcome):
+    with _counts_lock:
+        name = f"{namespace}:{outcome}"
+        _counts[name] = _counts.get(name, 0) + 1
+        _totals[name] = _totals.get(name, 0) + 1
+    if time.monotonic() - _last_flush[0] >= COUNTER_FLUSH_SECONDS:
+        flush_counters()
+
+def flush_counters():
+    """Add this process's pending hit and miss counts to the backend"""
+    with _counts_lock:
+        pending = dict(_counts)
+        _counts.clear()
+        _last_flush[0] = time.monotonic()
+    if pending:
+        try:
+            get_backend().incr(pending)
+        except CACHE_ERRORS:
+            pass
+
+def local_counts():
+    """Hits, misses and errors per "namespace:outcome" in this process since it started"""
+    with _counts_lock:
+        return dict(_totals)
+
+def cached(namespace, key, compute, ttl=DEFAULT_TTL):
+    """Value stored under namespace and key, computed and stored on a miss
+
+    A backend that is down or full only costs the recomputation.
+    """
+    backend = get_backend()
+    full_key = f"{namespace}:{key}"
+    try:
+        blob = backend.get(full_key)
+    except CACHE_ERRORS:
+        blob = None
+        _count(namespace, "errors")
+    if blob is not None:
+        try:
+            value = loads(blob)
+            _count(namespace, "hits")
+            return value
+        except VALUE_ERRORS:
+            # Written by an older version, or not by this cache at all
+            pass
+    _count(namespace, "misses")
+    value = compute()
+    try:
+        backend.set(full_key, dumps(value), ttl)
+    except CACHE_ERRORS + VALUE_ERRORS:
+        _count(namespace, "errors")
+    return value
+
+def set_value(namespace, key, value, ttl=DEFAULT_TTL):
+    """Store a value directly, such as a status other processes read; returns whether it was stored"""
+    try:
+        get_backend().set(f"{namespace}:{key}", dumps(value), ttl)
+        return True
+    except CACHE_ERRORS + VALUE_ERRORS:
+        return False
+
+def get_value(namespace, key, default=None):
+    """Stored value, or default when it is missing; not counted as a hit or miss"""
+    try:
+        blob = get_backend().get(f"{namespace}:{key}")
+        return loads(blob) if blob is not None else default
+    except CACHE_ERRORS + VALUE_ERRORS:
+        return default
+
+def invalidate(namespace, key):
+    try:
+        get_backend().delete(f"{namespace}:{key}")
+    except CACHE_ERRORS:
+        pass
+
+def cache_stats():
+    """Entries, size, evictions and hit rate per namespace across all processes"""
+    flush_counters()
+    backend = get_backend()
+    try:
+        entries, size = backend.size()
+        counters = backend.counters()
+    except CACHE_ERRORS as e:
+        return {"backend": backend.name, "error": str(e)}
+    namespaces = {}
+    for name, value in counters.items():
+        namespace, _, outcome = name.rpartition(":")
+        if namespace:
+            namespaces.setdefault(namespace, {"hits": 0, "misses": 0, "errors": 0})[outcome] = value
+    for counts in namespaces.values():
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = round(counts["hits"] / lookups, 3) if lookups else None
+    hits = sum(c["hits"] for c in namespaces.values())
+    lookups = hits + sum(c["misses"] for c in namespaces.values())
+    return {
+        "backend": backend.name,
+        "entries": entries,
+        "bytes": size,
+        "evictions": counters.get("evictions", 0),
+        "hit_rate": round(hits / lookups, 3) if lookups else None,
+        "namespaces": namespaces
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared cache for computed artefacts")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="print entries, size and hit rates")
+    sub.add_parser("clear", help="remove every cached entry and counter")
+    serve = sub.add_parser("serve", help="run the local Redis-protocol stand-in")
+    serve.add_argument("--host", default=RESP_SERVER_HOST)
+    serve.add_argument("--port", type=int, default=RESP_SERVER_PORT)
+    serve.add_argument("--max-mb", type=int, default=CACHE_MAX_BYTES // (1024 * 1024))
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(cache_stats(), indent=4))
+    elif args.command == "clear":
+        get_backend().clear()
+        print("Cache cleared")
+    else:
+        server = start_resp_server(args.host, args.port, args.max_mb * 1024 * 1024)
+        print(f"Serving a Redis-protocol cache at redis://{args.host}:{server.server_address[1]}/0")
+        while True:
+            time.sleep(3600)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Offline base-map tiles: an MBTiles cache and a local tile server.
+
+Raster tiles for a bounding box are downloaded once into TILE_CACHE_FILE (an
+MBTiles SQLite database) and served to the browser by a small HTTP server
+running in a background thread. Tiles missing from the cache are fetched
+from TILE_SOURCE_URL on first request and stored, so the cache also fills
+while browsing online.
+"""
+import argparse
+import math
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from crime_data import DATA_DIR
+
+TILE_CACHE_FILE = os.path.join(DATA_DIR, "tiles.mbtiles")
+VECTOR_TILE_FILE = os.path.join(DATA_DIR, "vector_tiles.mbtiles")
+
+TILE_SOURCE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+TILE_ATTRIBUTION = "&copy; OpenStreetMap contributors"
+USER_AGENT = "SafeMap-tile-cache/1.0"
+
+# Zoom levels seeded by default; the map tab bounds need a few thousand tiles up to z14
+SEED_ZOOMS = range(10, 15)
+
+# Kept low to stay within the OpenStreetMap tile usage policy
+SEED_WORKERS = 2
+
+TILE_SERVER_HOST = "127.0.0.1"
+TILE_SERVER_PORT = int(os.environ.get("SAFEMAP_TILE_PORT", "8765"))
+
+# URL template the browser uses to reach the tile server when it is not on the same machine;
+# vector tiles are expected next to it under /vtiles/
+TILE_PUBLIC_URL = os.environ.get("SAFEMAP_TILE_URL")
+
+_server = None
+_server_lock = threading.Lock()
+_db_lock = threading.Lock()
+_seeding = set()
+
+# --- MBTiles Store ---
+
+def open_cache(path=TILE_CACHE_FILE, metadata=None):
+    """Open (creating if needed) an MBTiles database"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    metadata = metadata or {"name": "SafeMap base map", "format": "png", "attribution": TILE_ATTRIBUTION}
+    conn.executemany("INSERT OR IGNORE INTO metadata VALUES (?, ?)", list(metadata.items()))
+    conn.commit()
+    return conn
+
+def read_metadata(path):
+    """MBTiles metadata as a dict, or None when the file does not exist"""
+    if not os.path.exists(path):
+        return None
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT name, value FROM metadata").fetchall())
+
+def _tms_row(z, y):
+    """MBTiles stores rows bottom-up (TMS); map clients count them top-down"""
+    return (1 << z) - 1 - y
+
+def read_tile(conn, z, x, y):
+    """Tile bytes from the cache, or None"""
+    with _db_lock:
+        row = conn.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                           (z, x, _tms_row(z, y))).fetchone()
+    return row[0] if row else None
+
+def write_tile(conn, z, x, y, data):
+    write_tiles(conn, [(z, x, y, data)])
+
+def write_tiles(conn, tiles):
+    """Store (z, x, y, data) tiles in one transaction"""
+    with _db_lock:
+        conn.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                         [(z, x, _tms_row(z, y), sqlite3.Binary(data)) for z, x, y, data in tiles])
+        conn.commit()
+
+def cached_tile_count(path=TILE_CACHE_FILE):
+    """Number of tiles in the cache, 0 when there is none"""
+    if not os.path.exists(path):
+        return 0
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+# --- Seeding ---
+
+def tile_xy(lat, lon, z):
+    """Slippy-map tile containing a point"""
+    n = 1 << z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tiles_in_bounds(bounds, zooms=SEED_ZOOMS):
+    """(z, x, y) of every tile covering (south, west, north, east) at the given zooms"""
+    south, west, north, east = bounds
+    for z in zooms:
+        x0, y0 = tile_xy(north, west, z)
+        x1, y1 = tile_xy(south, east, z)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                yield z, x, y
+
+def fetch_tile(z, x, y, url=TILE_SOURCE_URL, timeout=10):
+    """Download one tile from the upstream tile server"""
+    request = urllib.request.Request(url.format(z=z, x=x, y=y), headers={"User-Agent": USER_AGENT})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+def seed_tiles(bounds, zooms=SEED_ZOOMS, path=TILE_CACHE_FILE, workers=SEED_WORKERS, url=TILE_SOURCE_URL):
+    """Download every missing tile for the bounds and zooms into the cache
+
+    Returns counts of tiles already cached, fetched and failed.
+    """
+    conn = open_cache(path)
+    report = {"cached": 0, "fetched": 0, "failed": 0}
+    missing = []
+    for z, x, y in tiles_in_bounds(bounds, zooms):
+        if read_tile(conn, z, x, y) is None:
+            missing.append((z, x, y))
+        else:
+            report["cached"] += 1
+
+    def download(tile):
+        try:
+            write_tile(conn, *tile, fetch_tile(*tile, url=url))
+            return "fetched"
+        except OSError:
+            return "failed"
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for outcome in pool.map(download, missing):
+            report[outcome] += 1
+    conn.close()
+    return report
+
+def seed_tiles_async(bounds, zooms=SEED_ZOOMS, path=TILE_CACHE_FILE):
+    """Seed the cache for the bounds in a background thread, once per process"""
+    key = (tuple(round(v, 4) for v in bounds), tuple(zooms), path)
+    with _server_lock:
+        if key in _seeding:
+            return
+        _seeding.add(key)
+    threading.Thread(target=seed_tiles, args=(bounds, zooms, path), daemon=True).start()
+
+# --- Tile Server ---
+
+class TileHandler(BaseHTTPRequestHandler):
+    """Serves /tiles/{z}/{x}/{y}.png from the cache, fetching and storing misses
+
+    Also serves prebuilt vector tiles from vector_path at /vtiles/{z}/{x}/{y}.pbf.
+    """
+    conn = None
+    fetch_missing = True
+    vector_path = None
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        try:
+            if len(parts) != 4 or parts[0] not in ("tiles", "vtiles"):
+                raise ValueError(self.path)
+            z, x, y = int(parts[1]), int(parts[2]), int(parts[3].split(".")[0])
+        except ValueError:
+            self.send_error(404)
+            return
+
+        if parts[0] == "vtiles":
+            self.send_vector_tile(z, x, y)
+            return
+        data = read_tile(self.conn, z, x, y)
+        if data is None and self.fetch_missing:
+            try:
+                data = fetch_tile(z, x, y)
+                write_tile(self.conn, z, x, y, data)
+            except OSError:
+                data = None
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_tile(data, "image/png")
+
+    def send_vector_tile(self, z, x, y):
+        if not self.vector_path or not os.path.exists(self.vector_path):
+            self.send_error(404)
+            return
+        # Opened per request: the build step replaces the file as a whole
+        with sqlite3.connect(self.vector_path) as conn:
+            row = conn.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                               (z, x, _tms_row(z, y))).fetchone()
+        if row is None:
+            self.send_error(404)
+            return
+        self.send_tile(row[0], "application/x-protobuf", encoding="gzip")
+
+    def send_tile(self, data, content_type, encoding=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "public, max-age=604800")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_tile_server(path=TILE_CACHE_FILE, host=TILE_SERVER_HOST, port=TILE_SERVER_PORT, fetch_missing=True,
+                      vector_path=VECTOR_TILE_FILE, kind="tiles"):
+    """Start the tile server in a daemon thread (once per process) and return the URL template for kind"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            handler = type("CacheTileHandler", (TileHandler,), {
+                "conn": open_cache(path), "fetch_missing": fetch_missing, "vector_path": vector_path
+            })
+            try:
+                _server = ThreadingHTTPServer((host, port), handler)
+            except OSError:
+                # Port taken: another app process is already serving the same cache
+                return tile_url(host, port, kind)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return tile_url(host, port, kind)
+
+def tile_url(host=TILE_SERVER_HOST, port=TILE_SERVER_PORT, kind="tiles"):
+    """Tile URL template the browser should use for the local server"""
+    if TILE_PUBLIC_URL:
+        base = TILE_PUBLIC_URL.split("/tiles/")[0]
+    else:
+        base = f"http://{host if host != '0.0.0.0' else 'localhost'}:{port}"
+    extension = "pbf" if kind == "vtiles" else "png"
+    return f"{base}/{kind}/{{z}}/{{x}}/{{y}}.{extension}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline map tile cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    seed = sub.add_parser("seed", help="download tiles for a bounding box into the cache")
+    seed.add_argument("--bounds", type=float, nargs=4, metavar=("SOUTH", "WEST", "NORTH", "EAST"), required=True)
+    seed.add_argument("--min-zoom", type=int, default=min(SEED_ZOOMS))
+    seed.add_argument("--max-zoom", type=int, default=max(SEED_ZOOMS))
+    serve = sub.add_parser("serve", help="serve cached tiles over HTTP")
+    serve.add_argument("--offline", action="store_true", help="do not fetch tiles missing from the cache")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        started = time.perf_counter()
+        report = seed_tiles(args.bounds, range(args.min_zoom, args.max_zoom + 1))
+        print(f"{report} in {time.perf_counter() - started:.1f}s")
+    else:
+        print(f"Serving {TILE_CACHE_FILE} at {start_tile_server(fetch_missing=not args.offline)}")
+        while True:
+            time.sleep(3600)
+
+if __name__ == "__main__":
+    main()
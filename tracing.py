@@ -0,0 +1,189 @@
+"""Lightweight per-rerun tracing with rolling latency percentiles.
+
+app.py calls start_trace() at the top of every rerun and finish_trace()
+at the end. Sections in between are timed with spans:
+
+    with span("map.build"):
+        ...
+
+or, around long inline sections, `s = span("name").start()` and
+`s.finish()`; helper functions use the @traced() decorator. Spans nest
+within the rerun's trace, which belongs to the script thread running it.
+Every span duration, and the whole rerun as "rerun" and "rerun:<page>",
+is added to a rolling window of the last ROLLING_WINDOW samples per name
+and summarised as p50/p95/p99. Spans outside a rerun, such as scheduler
+jobs calling traced helpers, count towards the summaries only. Time loops
+with one span around the loop rather than one per item; a trace keeps at
+most MAX_SPANS spans and counts the rest as dropped, which still reach the
+summaries.
+
+With a trace file set (SAFEMAP_TRACE_FILE, or set_trace_file from the
+admin panel), each finished rerun is appended as one JSON line. Listeners
+added with add_listener receive every recorded (name, seconds) too; the
+metrics endpoint builds its histograms from them.
+"""
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+ROLLING_WINDOW = 500
+RECENT_TRACES = 20
+
+# Spans kept per trace, so an accidental per-item span cannot grow traces without bound
+MAX_SPANS = 200
+TRACE_FILE = os.environ.get("SAFEMAP_TRACE_FILE", "")
+
+_local = threading.local()
+_samples = {}
+_recent = deque(maxlen=RECENT_TRACES)
+_lock = threading.Lock()
+_trace_file = TRACE_FILE
+_listeners = []
+
+# --- Spans ---
+
+class Span:
+    """Times a block and records it in the current trace, if any"""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace = None
+        self.parent = None
+        self.started = None
+
+    def start(self):
+        self.trace = getattr(_local, "trace", None)
+        if self.trace is not None:
+            stack = self.trace["stack"]
+            self.parent = stack[-1].name if stack else None
+            stack.append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def finish(self):
+        seconds = time.perf_counter() - self.started
+        if self.trace is not None:
+            if self in self.trace["stack"]:
+                self.trace["stack"].remove(self)
+            if len(self.trace["spans"]) < MAX_SPANS:
+                self.trace["spans"].append({
+                    "name": self.name,
+                    "parent": self.parent,
+                    "start_ms": round((self.started - self.trace["started"]) * 1000, 3),
+                    "ms": round(seconds * 1000, 3)
+                })
+            else:
+                self.trace["dropped"] += 1
+        record(self.name, seconds)
+        return seconds
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.finish()
+        return False
+
+def span(name):
+    return Span(name)
+
+def traced(name=None):
+    """Decorator timing every call of a function as a span (default: the function's name)"""
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# --- Traces ---
+
+def start_trace():
+    """Begin a rerun's trace on this thread, closing one left open by st.rerun() or an error"""
+    if getattr(_local, "trace", None) is not None:
+        finish_trace(status="interrupted")
+    _local.trace = {"id": uuid.uuid4().hex[:16], "started_at": time.time(), "started": time.perf_counter(), "stack": [], "spans": [], "dropped": 0}
+
+def finish_trace(page=None, status="ok"):
+    """End this thread's trace, record the rerun duration and export it; returns the trace"""
+    trace = getattr(_local, "trace", None)
+    if trace is None:
+        return None
+    _local.trace = None
+    seconds = time.perf_counter() - trace["started"]
+    record("rerun", seconds)
+    if page:
+        record(f"rerun:{page}", seconds)
+    result = {
+        "id": trace["id"],
+        "started_at": round(trace["started_at"], 3),
+        "page": page,
+        "status": status,
+        "ms": round(seconds * 1000, 3),
+        "spans": sorted(trace["spans"], key=lambda s: s["start_ms"]),
+        "dropped_spans": trace["dropped"]
+    }
+    with _lock:
+        _recent.append(result)
+        path = _trace_file
+    if path:
+        export_trace(result, path)
+    return result
+
+def export_trace(trace, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    line = json.dumps(trace) + "\n"
+    with _lock:
+        with open(path, "a") as f:
+            f.write(line)
+
+def set_trace_file(path):
+    """Start (path) or stop (empty) appending finished reruns to a JSONL file"""
+    global _trace_file
+    with _lock:
+        _trace_file = path or ""
+
+def trace_file():
+    return _trace_file
+
+# --- Summaries ---
+
+def record(name, seconds):
+    with _lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(maxlen=ROLLING_WINDOW)
+        samples.append(seconds)
+    for listener in _listeners:
+        listener(name, seconds)
+
+def add_listener(func):
+    """Call func(name, seconds) for every recorded span and rerun (once per function)"""
+    with _lock:
+        if func not in _listeners:
+            _listeners.append(func)
+
+def summaries():
+    """p50/p95/p99, mean and max in milliseconds over the rolling window, per span name"""
+    with _lock:
+        samples = {name: np.array(values) * 1000 for name, values in _samples.items()}
+    result = {}
+    for name, values in samples.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        result[name] = {"count": len(values), "p50": round(float(p50), 2), "p95": round(float(p95), 2),
+                        "p99": round(float(p99), 2), "mean": round(float(values.mean()), 2), "max": round(float(values.max()), 2)}
+    return result
+
+def recent_traces():
+    """The last RECENT_TRACES finished reruns in this process, newest first"""
+    with _lock:
+        return list(reversed(_recent))
@@ -0,0 +1,301 @@
+"""Precomputed Mapbox Vector Tiles for the crime grid, hotspots and POI catalogue.
+
+A build step cuts each layer into MVT tiles for every zoom in
+VECTOR_TILE_ZOOMS and stores them gzipped in VECTOR_TILE_FILE (MBTiles).
+The tile server in tile_cache serves them, so the map downloads only the
+tiles in view, and the browser can cache them until the next build.
+"""
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import struct
+import time
+from itertools import groupby
+
+import numpy as np
+
+from clustering import project
+from crime_data import aggregate_cells, cell_xy, heatmap_level_for_zoom, load_crime_store
+from hotspots import ensure_hotspots, load_hotspots
+from poi_data import POI_CATEGORIES, load_poi_store, poi_name
+from tile_cache import VECTOR_TILE_FILE, open_cache, read_metadata, write_tiles
+import workers
+
+# Tiles are built up to the last zoom and overzoomed by the browser beyond it
+VECTOR_TILE_ZOOMS = range(8, 15)
+
+# Tile coordinate resolution, the MVT default
+TILE_EXTENT = 4096
+
+VECTOR_LAYERS = ["crime_grid", "hotspots", "places"]
+
+# Encoded tiles per write transaction
+WRITE_BATCH = 500
+
+# --- MVT Encoding ---
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def _field(number, payload):
+    """Length-delimited protobuf field"""
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+def _uint_field(number, value):
+    return _varint(number << 3) + _varint(value)
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _uint_field(7, int(value))
+    if isinstance(value, (int, np.integer)):
+        return _uint_field(6, _zigzag(int(value)) & 0xFFFFFFFFFFFFFFFF)
+    if isinstance(value, (float, np.floating)):
+        return _varint((3 << 3) | 1) + struct.pack("<d", float(value))
+    return _field(1, str(value).encode("utf-8"))
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+def _geometry(kind, coords):
+    """MVT geometry commands for a point (x, y) or a polygon's list of rings"""
+    if kind == "Point":
+        return [_command(1, 1), _zigzag(coords[0]), _zigzag(coords[1])]
+    commands, cursor = [], (0, 0)
+    for ring in coords:
+        deltas = []
+        for x, y in ring:
+            deltas += [_zigzag(x - cursor[0]), _zigzag(y - cursor[1])]
+            cursor = (x, y)
+        commands += [_command(1, 1)] + deltas[:2] + [_command(2, len(ring) - 1)] + deltas[2:] + [_command(7, 1)]
+    return commands
+
+def encode_layer(name, features, extent=TILE_EXTENT):
+    """One MVT layer; features are dicts with "type", tile "coords" and "properties" """
+    keys, values, body = {}, {}, []
+    for i, feature in enumerate(features):
+        tags = []
+        for key, value in feature["properties"].items():
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        geometry = _geometry(feature["type"], feature["coords"])
+        encoded = (_uint_field(1, i + 1)
+                   + _field(2, b"".join(_varint(t) for t in tags))
+                   + _uint_field(3, 1 if feature["type"] == "Point" else 3)
+                   + _field(4, b"".join(_varint(g) for g in geometry)))
+        body.append(_field(2, encoded))
+    return (_uint_field(15, 2) + _field(1, name.encode("utf-8")) + b"".join(body)
+            + b"".join(_field(3, key.encode("utf-8")) for key in keys)
+            + b"".join(_field(4, _encode_value(value)) for _, value in values)
+            + _uint_field(5, extent))
+
+def encode_tile(layers):
+    """Gzipped MVT tile from a {layer name: features} dict"""
+    return gzip.compress(b"".join(_field(3, encode_layer(name, features)) for name, features in layers.items() if features))
+
+# --- Tiling ---
+
+def tile_coords(lat, lon, z):
+    """World coordinates in tile extent units at a zoom; tile index is coordinate // TILE_EXTENT"""
+    x, y = project(lat, lon)
+    scale = (1 << z) * TILE_EXTENT
+    return np.round(x * scale).astype(np.int64), np.round(y * scale).astype(np.int64)
+
+def _ring_orientation(xs, ys):
+    """Twice the signed ring area in tile coordinates; MVT exterior rings are positive"""
+    return float(np.sum(xs * np.roll(ys, -1) - np.roll(xs, -1) * ys))
+
+def _by_tile(tx, ty):
+    """Item indices grouped by tile, in (tx, ty) order: yields ((tx, ty), indices)"""
+    if not len(tx):
+        return
+    order = np.lexsort((ty, tx))
+    tx, ty = tx[order], ty[order]
+    breaks = np.flatnonzero((tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])) + 1
+    for start, end in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(order)]))):
+        yield (int(tx[start]), int(ty[start])), order[start:end]
+
+def crime_grid_features(store, z):
+    """Crime counts per grid cell at the heatmap level for the zoom, as square polygons, one tile at a time"""
+    level = min(store["meta"]["level"], heatmap_level_for_zoom(z))
+    cells, counts = aggregate_cells(store, level)
+    if not len(cells):
+        return
+    weight = np.minimum(counts / max(float(np.percentile(counts, 99)), 1.0), 1.0)
+    ix, iy = cell_xy(cells, level)
+    n = float(1 << level)
+    x0, y1 = tile_coords(iy / n * 180.0 - 90.0, ix / n * 360.0 - 180.0, z)
+    x1, y0 = tile_coords((iy + 1) / n * 180.0 - 90.0, (ix + 1) / n * 360.0 - 180.0, z)
+    for (tx, ty), idx in _by_tile(((x0 + x1) // 2) // TILE_EXTENT, ((y0 + y1) // 2) // TILE_EXTENT):
+        ox, oy = tx * TILE_EXTENT, ty * TILE_EXTENT
+        features = []
+        for i in idx:
+            left, right, top, bottom = int(x0[i] - ox), int(x1[i] - ox), int(y0[i] - oy), int(y1[i] - oy)
+            features.append({
+                "type": "Polygon",
+                "coords": [[(left, top), (right, top), (right, bottom), (left, bottom)]],
+                "properties": {"count": int(counts[i]), "weight": round(float(weight[i]), 3),
+                               "label": f"{int(counts[i]):,} incidents"}
+            })
+        yield (tx, ty), features
+
+def hotspot_features(hotspots, z):
+    """Hotspot outlines, repeated in every tile their bounding box touches, one tile at a time"""
+    tiles = {}
+    for h in hotspots:
+        ring = np.asarray(h["polygon"], dtype=np.float64)
+        if len(ring) > 1 and np.allclose(ring[0], ring[-1]):
+            ring = ring[:-1]
+        if len(ring) < 3:
+            continue
+        xs, ys = tile_coords(ring[:, 0], ring[:, 1], z)
+        if _ring_orientation(xs, ys) < 0:
+            xs, ys = xs[::-1], ys[::-1]
+        properties = {"severity": h["severity"], "incidents": int(h["incidents"]), "density": float(h["density"]),
+                      "label": f"{h['severity']} hotspot: {h['incidents']:,} incidents ({h['density']:,}/km²)"}
+        for tx in range(int(xs.min()) // TILE_EXTENT, int(xs.max()) // TILE_EXTENT + 1):
+            for ty in range(int(ys.min()) // TILE_EXTENT, int(ys.max()) // TILE_EXTENT + 1):
+                ox, oy = tx * TILE_EXTENT, ty * TILE_EXTENT
+                tiles.setdefault((tx, ty), []).append({
+                    "type": "Polygon",
+                    "coords": [[(int(x - ox), int(y - oy)) for x, y in zip(xs, ys)]],
+                    "properties": properties
+                })
+    # Hotspots are few, so their tiles fit in memory; sorted to merge with the other layers
+    yield from sorted(tiles.items())
+
+def place_features(poi_store, z):
+    """Places from the POI store's columns as points carrying their name and category, one tile at a time"""
+    if poi_store is None:
+        return
+    xs, ys = tile_coords(poi_store["lat"], poi_store["lon"], z)
+    for (tx, ty), idx in _by_tile(xs // TILE_EXTENT, ys // TILE_EXTENT):
+        ox, oy = tx * TILE_EXTENT, ty * TILE_EXTENT
+        features = []
+        for i in idx:
+            category = POI_CATEGORIES[poi_store["category_id"][i]]
+            name = poi_name(poi_store, i) or category
+            features.append({
+                "type": "Point",
+                "coords": (int(xs[i] - ox), int(ys[i] - oy)),
+                "properties": {"name": name, "category": category, "label": f"{name} ({category})"}
+            })
+        yield (tx, ty), features
+
+def _tagged(layer, tiles):
+    for tile, features in tiles:
+        yield tile, layer, features
+
+def zoom_tiles(store, hotspots, poi_store, z):
+    """Encoded tiles for one zoom, one at a time: yields (z, x, y, data)
+
+    Each layer yields its tiles in (x, y) order, so they merge tile by tile
+    and only one tile's features are held at once.
+    """
+    layers = heapq.merge(_tagged("crime_grid", crime_grid_features(store, z)),
+                         _tagged("hotspots", hotspot_features(hotspots, z)),
+                         _tagged("places", place_features(poi_store, z)), key=lambda item: item[0])
+    for (tx, ty), group in groupby(layers, key=lambda item: item[0]):
+        yield z, tx, ty, encode_tile({layer: features for _, layer, features in group})
+
+# --- Build ---
+
+def build_vector_tiles(path=VECTOR_TILE_FILE, zooms=VECTOR_TILE_ZOOMS):
+    """Cut the crime grid, hotspots and places into vector tiles and write the MBTiles file
+
+    Tiles are written in batches of WRITE_BATCH as they are encoded.
+    Returns the written metadata, or None when there is no crime store.
+    """
+    store = load_crime_store()
+    if store is None:
+        return None
+    started = time.perf_counter()
+    hotspot_result = load_hotspots()
+    hotspots = hotspot_result["hotspots"] if hotspot_result else []
+    poi_store = load_poi_store()
+
+    sources = [store["meta"]["version"], hotspot_result["store_version"] if hotspot_result else "",
+               poi_store["meta"]["version"] if poi_store is not None else ""]
+    metadata = {
+        "name": "SafeMap crime and places",
+        "format": "pbf",
+        "minzoom": str(min(zooms)),
+        "maxzoom": str(max(zooms)),
+        "store_version": store["meta"]["version"],
+        "hotspots_version": sources[1],
+        "places_version": sources[2],
+        "places": str(len(poi_store["cell"]) if poi_store is not None else 0),
+        "version": hashlib.sha1("|".join(sources).encode("utf-8")).hexdigest()[:12],
+        "json": json.dumps({"vector_layers": [{"id": name, "fields": {}} for name in VECTOR_LAYERS]})
+    }
+
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = open_cache(tmp_path, metadata)
+    count, batch = 0, []
+    for z in zooms:
+        for tile in zoom_tiles(store, hotspots, poi_store, z):
+            batch.append(tile)
+            if len(batch) >= WRITE_BATCH:
+                write_tiles(conn, batch)
+                count, batch = count + len(batch), []
+    write_tiles(conn, batch)
+    count += len(batch)
+    conn.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?)", ("seconds", str(round(time.perf_counter() - started, 3))))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+    metadata["tiles"] = count
+    return metadata
+
+def vector_tiles_error():
+    """Why the latest vector tile build failed, or None when none has failed since the last success"""
+    return workers.error("vector_tiles")
+
+def ensure_vector_tiles(path=VECTOR_TILE_FILE):
+    """Return the vector tile metadata, rebuilding in a worker process when its sources changed
+
+    Never blocks: while a build runs, the previous tiles' metadata (or None)
+    is returned. A build that failed is retried after workers.RETRY_SECONDS;
+    vector_tiles_error() says why.
+    """
+    current = read_metadata(path)
+    store = load_crime_store()
+    if store is None:
+        return current
+    hotspot_result = ensure_hotspots()
+    poi_store = load_poi_store()
+    key = (store["meta"]["version"], hotspot_result["store_version"] if hotspot_result else "",
+           poi_store["meta"]["version"] if poi_store is not None else "")
+    if current is not None and (current.get("store_version"), current.get("hotspots_version"), current.get("places_version")) == key:
+        return current
+    workers.submit(("vector_tiles",) + key, build_vector_tiles, path, VECTOR_TILE_ZOOMS)
+    return current
+
+def main():
+    parser = argparse.ArgumentParser(description="Build vector tiles for the crime grid, hotspots and places")
+    parser.add_argument("--min-zoom", type=int, default=min(VECTOR_TILE_ZOOMS))
+    parser.add_argument("--max-zoom", type=int, default=max(VECTOR_TILE_ZOOMS))
+    args = parser.parse_args()
+    metadata = build_vector_tiles(zooms=range(args.min_zoom, args.max_zoom + 1))
+    if metadata is None:
+        print("No crime store found")
+    else:
+        print(json.dumps({key: metadata[key] for key in ("version", "tiles", "places", "minzoom", "maxzoom")}, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Buffered college visit recording.
+
+Every map view of a college used to load and rewrite the whole user store.
+Visits are now appended to a buffer in this process, and the scheduler's
+flush job writes them to the store in one batch every VISIT_FLUSH_SECONDS.
+Reads merge the pending visits, so users see their visits at once. Visits
+still buffered when a process is killed are lost, which bounds the loss
+to one flush interval.
+"""
+import threading
+
+VISIT_FLUSH_SECONDS = 10
+
+# Visits kept per user, most recent last
+MAX_VISITS = 20
+
+_pending = []
+_lock = threading.Lock()
+
+# Held while the user store is loaded, changed and written back, so a flush in a
+# scheduler thread does not overwrite a registration or login from a rerun
+store_lock = threading.RLock()
+
+def add_visit(username, college_name, visit_time):
+    with _lock:
+        _pending.append((username, college_name, visit_time))
+
+def pending_visits(username=None):
+    """Buffered (username, college, time) visits, optionally for one user"""
+    with _lock:
+        return [v for v in _pending if username is None or v[0] == username]
+
+def take_visits():
+    """Remove and return every buffered visit, for writing to the store"""
+    with _lock:
+        visits = list(_pending)
+        _pending.clear()
+    return visits
+
+def restore_visits(visits):
+    """Put visits back at the front of the buffer after a failed write"""
+    with _lock:
+        _pending[:0] = visits
+
+def apply_visits(user_data, visits, keep=MAX_VISITS):
+    """Merge visits into user records, one entry per college; returns how many were applied
+
+    Visits by users who are not in the store are dropped.
+    """
+    applied = 0
+    for username, college_name, visit_time in visits:
+        record = user_data.get(username)
+        if record is None:
+            continue
+        visited = [v for v in record.get("visited_colleges", []) if v["college_name"] != college_name]
+        visited.append({"college_name": college_name, "visit_time": visit_time})
+        record["visited_colleges"] = visited[-keep:]
+        applied += 1
+    return applied
@@ -0,0 +1,242 @@
+"""Startup warm-up and readiness gate for the Streamlit server.
+
+Without it the first visitor after a deploy pays for every cold
+computation. `python warmup.py` runs next to `streamlit run app.py` and
+drives app.py headlessly (Streamlit's AppTest) through the common views:
+the default "All Colleges" map, every single-college map, comparison rows
+for every college and the analytics tab, which renders on every run. The
+safety scores, distance matrices, figures and display-only maps they
+compute land in the shared cache, and the crime layers (hotspots, risk
+grid, vector tiles) are built on disk, so server processes start warm.
+The headless runs start no metrics server or scheduler (SAFEMAP_HEADLESS).
+
+A small HTTP server on HEALTH_PORT answers the load balancer:
+
+- /healthz: 200 while this process is alive;
+- /readyz: 200 once the warm-up has finished and the Streamlit server at
+  APP_URL passes its own health check, 503 before;
+- /warmup: the warm-up status as JSON.
+
+The status is also kept in the shared cache, where the app reads it.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from streamlit.testing.v1 import AppTest
+
+from crime_data import load_crime_store
+from hotspots import ensure_hotspots
+from risk_model import ensure_risk_grid
+from shared_cache import get_value, set_value
+from vector_tiles import ensure_vector_tiles
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Streamlit server whose /_stcore/health must pass before traffic is routed; empty skips the check
+APP_URL = os.environ.get("SAFEMAP_APP_URL", "http://localhost:8501")
+
+# Reachable by the load balancer, unlike the tile server; give each server process its own port
+HEALTH_HOST = os.environ.get("SAFEMAP_HEALTH_HOST", "0.0.0.0")
+HEALTH_PORT = int(os.environ.get("SAFEMAP_HEALTH_PORT", "8766"))
+
+# Session user for the headless runs; not in the user store, so no visits are recorded
+WARMUP_USER = "warmup"
+
+SCRIPT_TIMEOUT = 300
+
+# Seconds to wait for the background crime layer builds to finish
+LAYER_TIMEOUT = 900
+
+COMPARISON_SIZE = 3
+COLLEGE_SELECTOR = "Choose College:"
+COMPARISON_SELECTOR = "Select colleges to compare:"
+STATUS_TTL = 7 * 24 * 3600
+
+_status = {"state": "starting", "done": 0, "total": 0, "failed": [], "started_at": None, "finished_at": None, "seconds": None}
+_status_lock = threading.Lock()
+_server = None
+
+# --- Status ---
+
+def _update(**changes):
+    with _status_lock:
+        _status.update(changes)
+        snapshot = json.loads(json.dumps(_status))
+    set_value("warmup", "status", snapshot, ttl=STATUS_TTL)
+
+def local_status():
+    """Warm-up status of this process"""
+    with _status_lock:
+        return json.loads(json.dumps(_status))
+
+def warmup_status():
+    """Latest warm-up status from the shared cache, or None when no warm-up has run"""
+    return get_value("warmup", "status")
+
+# --- Warm-up ---
+
+def _session(app_path):
+    at = AppTest.from_file(app_path, default_timeout=SCRIPT_TIMEOUT)
+    at.session_state["authenticated"] = True
+    at.session_state["username"] = WARMUP_USER
+    at.session_state["page"] = "map"
+    return at
+
+def _run(at):
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+def _select(at, elements, label, value):
+    next(e for e in elements if e.label == label).set_value(value)
+    _run(at)
+
+def _crime_layers_ready():
+    store = load_crime_store()
+    if store is None:
+        return True
+    version = store["meta"]["version"]
+    hotspots = ensure_hotspots()
+    risk_grid = ensure_risk_grid()
+    tiles = ensure_vector_tiles()
+    return (hotspots is not None and hotspots["store_version"] == version and risk_grid is not None
+            and tiles is not None and tiles.get("store_version") == version
+            and tiles.get("hotspots_version") == hotspots["store_version"])
+
+def wait_for_crime_layers(timeout=LAYER_TIMEOUT):
+    """Start the crime layer builds and wait for them; raises TimeoutError past timeout"""
+    deadline = time.monotonic() + timeout
+    while not _crime_layers_ready():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"crime layers not built within {timeout}s")
+        time.sleep(1.0)
+
+def warmup_steps(at):
+    """(name, action) pairs after a first run of the app; college names come from its own selector"""
+    selector = next(e for e in at.sidebar.selectbox if e.label == COLLEGE_SELECTOR)
+    names = [name for name in selector.options if name not in ("No College Selected", "All Colleges")]
+    steps = [("All Colleges map", lambda: _select(at, at.sidebar.selectbox, COLLEGE_SELECTOR, "All Colleges"))]
+    steps += [(f"{name} map", lambda name=name: _select(at, at.sidebar.selectbox, COLLEGE_SELECTOR, name)) for name in names]
+    # Every college appears in at least one comparison
+    for i in range(0, len(names), COMPARISON_SIZE):
+        group = names[i:i + COMPARISON_SIZE]
+        if len(group) < 2:
+            group = names[max(len(names) - 2, 0):]
+        steps.append((f"comparison of {', '.join(group)}", lambda group=group: _select(at, at.multiselect, COMPARISON_SELECTOR, group)))
+    steps.append(("crime layers", wait_for_crime_layers))
+    return steps
+
+def run_warmup(app_path=APP_PATH):
+    """Drive the app through the common views; returns the final status
+
+    Failed steps are recorded and skipped: a partly warm server is still
+    marked ready rather than kept out of rotation.
+    """
+    started = time.perf_counter()
+    # The app then starts no metrics server or scheduler in this process
+    os.environ["SAFEMAP_HEADLESS"] = "1"
+    _update(state="warming", done=0, total=0, failed=[], started_at=time.time(), finished_at=None, seconds=None)
+    failed = []
+    try:
+        at = _session(app_path)
+        _run(at)
+        steps = warmup_steps(at)
+    except Exception as e:
+        failed.append(f"app: {e}")
+        steps = [("crime layers", wait_for_crime_layers)]
+    _update(total=len(steps), failed=failed)
+    for i, (name, action) in enumerate(steps):
+        try:
+            action()
+        except Exception as e:
+            failed.append(f"{name}: {e}")
+        _update(done=i + 1, failed=failed)
+    _update(state="ready", finished_at=time.time(), seconds=round(time.perf_counter() - started, 1))
+    return local_status()
+
+def start_warmup(app_path=APP_PATH):
+    """Run the warm-up in a daemon thread"""
+    thread = threading.Thread(target=run_warmup, args=(app_path,), daemon=True)
+    thread.start()
+    return thread
+
+# --- Health Endpoint ---
+
+def app_healthy(app_url=APP_URL, timeout=2):
+    """Whether the Streamlit server answers its own health check"""
+    if not app_url:
+        return True
+    try:
+        with urllib.request.urlopen(f"{app_url.rstrip('/')}/_stcore/health", timeout=timeout) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Liveness, readiness and warm-up status for the load balancer"""
+    app_url = APP_URL
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/healthz":
+            self.send_json(200, {"status": "ok"})
+        elif path == "/readyz":
+            status = local_status()
+            app_ok = app_healthy(self.app_url)
+            ready = status["state"] == "ready" and app_ok
+            self.send_json(200 if ready else 503, {"ready": ready, "warmup": status["state"], "app": app_ok,
+                                                   "progress": f"{status['done']}/{status['total']}"})
+        elif path == "/warmup":
+            self.send_json(200, local_status())
+        else:
+            self.send_error(404)
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_health_server(host=HEALTH_HOST, port=HEALTH_PORT, app_url=APP_URL):
+    """Start the health endpoint in a daemon thread (once per process); returns its base URL"""
+    global _server
+    if _server is None:
+        handler = type("AppHealthHandler", (HealthHandler,), {"app_url": app_url})
+        _server = ThreadingHTTPServer((host, port), handler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return f"http://{host if host != '0.0.0.0' else 'localhost'}:{_server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm the shared cache and gate traffic until it is warm")
+    parser.add_argument("--app", default=APP_PATH, help="Streamlit script to drive")
+    parser.add_argument("--app-url", default=APP_URL, help="Streamlit server to health-check; empty to skip")
+    parser.add_argument("--host", default=HEALTH_HOST)
+    parser.add_argument("--port", type=int, default=HEALTH_PORT)
+    parser.add_argument("--once", action="store_true", help="warm up and exit without serving health checks")
+    args = parser.parse_args()
+
+    if args.once:
+        status = run_warmup(args.app)
+        print(json.dumps(status, indent=4))
+        sys.exit(1 if status["failed"] else 0)
+
+    print(f"Health checks at {start_health_server(args.host, args.port, args.app_url)}/readyz")
+    status = run_warmup(args.app)
+    print(f"Warm-up finished in {status['seconds']}s, {len(status['failed'])} failed steps")
+    while True:
+        time.sleep(3600)
+
+if __name__ == "__main__":
+    main()
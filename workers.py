@@ -0,0 +1,81 @@
+"""Spawned worker processes for builds too slow to run inside a rerun.
+
+Hotspot clustering, risk model training and vector tile builds each get a
+single-process pool of their own, named by the first element of the key
+they are submitted under, so a slow or crashed build of one kind does not
+hold up or break the others. At most one build runs per key, and a key
+whose build failed is not started again until RETRY_SECONDS have passed.
+A worker that dies, for instance killed for memory, breaks its pool; the
+pool is then dropped and the next build starts a fresh one.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Seconds before a failed build under the same key is started again
+RETRY_SECONDS = 600
+
+_pools = {}
+_pending = {}
+_failed = {}
+_lock = threading.Lock()
+
+def _get_pool(kind):
+    pool = _pools.get(kind)
+    if pool is None:
+        # Spawned rather than forked: the Streamlit server process is multi-threaded
+        pool = _pools[kind] = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return pool
+
+def _drop_pool(kind, pool):
+    """Forget a pool whose worker died, so the next submit starts a new one; call with _lock held"""
+    if _pools.get(kind) is pool:
+        del _pools[kind]
+    pool.shutdown(wait=False)
+
+def submit(key, func, *args):
+    """Run func(*args) in the pool for key[0]; returns the future, or None when none was started
+
+    Nothing starts while a build under the same key is running, or within
+    RETRY_SECONDS of one that failed.
+    """
+    kind = key[0]
+    with _lock:
+        failed = _failed.get(key)
+        if key in _pending or (failed is not None and time.time() - failed[0] < RETRY_SECONDS):
+            return None
+        pool = _get_pool(kind)
+        try:
+            future = pool.submit(func, *args)
+        except BrokenProcessPool:
+            _drop_pool(kind, pool)
+            pool = _get_pool(kind)
+            future = pool.submit(func, *args)
+        _pending[key] = future
+    future.add_done_callback(lambda f: _finished(key, f, pool))
+    return future
+
+def _finished(key, future, pool):
+    error = None if future.cancelled() else future.exception()
+    with _lock:
+        _pending.pop(key, None)
+        if isinstance(error, BrokenProcessPool):
+            _drop_pool(key[0], pool)
+        if error is None:
+            for failed in [k for k in _failed if k[0] == key[0]]:
+                del _failed[failed]
+        else:
+            _failed[key] = (time.time(), f"{type(error).__name__}: {error}")
+
+def running(key):
+    """Whether a build under key is in progress"""
+    with _lock:
+        return key in _pending
+
+def error(kind):
+    """Why the latest build of a kind failed, or None when none has failed since its last success"""
+    with _lock:
+        failures = sorted(failure for key, failure in _failed.items() if key[0] == kind)
+    return failures[-1][1] if failures else None